@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# Covarianze piene per C_fit: C = L L^T fattorizzata una volta (Cholesky) e il fattore L
+# in cache su disco, indirizzato per contenuto (sha256 dei byte di C). I chi2 usano solo
+# risolutori triangolari su L: nessuna inversa esplicita, costo O(N^2) per modello.
+import hashlib, os, sys
+import numpy as np
+from scipy.linalg import cholesky, solve_triangular
+
+FORMAT = "chol-v1"
+
+def load_cov(path):
+    # .npy mappato in memoria; testo: N righe x N colonne, oppure N in testa e N*N valori
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    v = np.loadtxt(path).ravel()
+    n = int(round(np.sqrt(v.size)))
+    if n*n != v.size:
+        n = int(v[0]); v = v[1:]
+    if n*n != v.size:
+        raise ValueError(f"{path}: {v.size} valori non formano una matrice quadrata")
+    return v.reshape(n, n)
+
+def cov_key(C):
+    h = hashlib.sha256(f"{FORMAT}:{C.shape[0]}x{C.shape[1]}:".encode())
+    h.update(memoryview(C))
+    return h.hexdigest()
+
+def cholesky_cached(C, cache_dir=None):
+    # fattore triangolare inferiore L (C = L L^T); dalla cache come memmap in sola lettura
+    C = np.ascontiguousarray(C, dtype=float)
+    p = None
+    if cache_dir:
+        p = os.path.join(cache_dir, f"{cov_key(C)}.chol.npy")
+        if os.path.exists(p):
+            return np.load(p, mmap_mode="r")
+    L = cholesky(C, lower=True, check_finite=False)
+    if p:
+        # scrittura atomica: piu' processi (scan, MC) possono condividere la cache
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{p}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f: np.save(f, L)
+        os.replace(tmp, p)
+    return L
+
+def whiten(L, r):
+    # L^{-1} r; r (N,) oppure (M, N) con un modello per riga
+    r = np.asarray(r, dtype=float)
+    return solve_triangular(L, r.T, lower=True, check_finite=False).T
+
+def chi2_cov(L, y, yhat):
+    a = whiten(L, np.asarray(y) - yhat)
+    return np.sum(a*a, axis=-1), int(np.shape(y)[-1])
+
+def marginalized(L, d, e=None):
+    # chi2 con offset additivo marginalizzato analiticamente:
+    #   a = L^{-1} d, e = L^{-1} 1, chi2 = a.a - (a.e)^2/(e.e), Delta = (a.e)/(e.e)
+    # residui standardizzati (per i test severi) = a - Delta e (sbiancati)
+    if e is None: e = whiten(L, np.ones(L.shape[0]))
+    a = whiten(L, d)
+    ee = float(e @ e)
+    S1 = a @ e
+    res = a - np.multiply.outer(S1/ee, e)
+    return np.sum(a*a, axis=-1) - S1*S1/ee, res
+
+def sne_factor(cfg, sne):
+    # fattore della covarianza SNe nell'ordine di sne.csv: se c'e' la colonna cov_idx
+    # (make_sne_csv, righe del catalogo originale) la matrice viene permutata; con
+    # sne_cov_add_stat la varianza statistica sigma_mu^2 si aggiunge sulla diagonale
+    C = load_cov(cfg["sne_cov"])
+    if "cov_idx" in sne.columns:
+        idx = sne["cov_idx"].values.astype(int)
+        C = C[np.ix_(idx, idx)]
+    if C.shape[0] != len(sne):
+        raise ValueError(f"sne_cov {C.shape} non compatibile con {len(sne)} SNe")
+    C = np.array(C, dtype=float)
+    if cfg.get("sne_cov_add_stat", False):
+        C[np.diag_indices_from(C)] += sne["sigma_mu"].values**2
+    return cholesky_cached(C, cfg.get("cov_cache", "cache/cov"))
+
+def bao_factors(cfg, bao):
+    # bao_cov: {"DV_over_rs"|"DM_over_rs"|"Hz_rs": percorso} sulle righe del CSV BAO
+    out = {}
+    for obs, path in (cfg.get("bao_cov") or {}).items():
+        C = np.array(load_cov(path), dtype=float)
+        if C.shape[0] != len(bao):
+            raise ValueError(f"bao_cov[{obs}] {C.shape} non compatibile con {len(bao)} righe BAO")
+        out[obs] = cholesky_cached(C, cfg.get("cov_cache", "cache/cov"))
+    return out
+
+if __name__ == "__main__":
+    # pre-fattorizza una covarianza nella cache: ccov.py cov.{npy,txt} [cache_dir]
+    if len(sys.argv) < 2:
+        print("usage: ccov.py cov.npy|cov.txt [cache_dir]"); sys.exit(2)
+    C = np.array(load_cov(sys.argv[1]), dtype=float)
+    cache = sys.argv[2] if len(sys.argv) > 2 else "cache/cov"
+    cholesky_cached(C, cache)
+    print(f"CHOL: {C.shape[0]}x{C.shape[1]} -> {os.path.join(cache, cov_key(C) + '.chol.npy')}")
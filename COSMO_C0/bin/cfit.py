@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
-import sys, json, numpy as np, pandas as pd
-from math import sqrt
-from scipy.stats import kstest, norm, spearmanr
+import sys, json, numpy as np
+import ccov, ctests
+from cobs_hz import load_table
 
 def load_json(p):
     with open(p,"r") as f: return json.load(f)
@@ -28,148 +28,225 @@ def sne_marginalized(z, mu_obs, sig, z_grid, DL_Mpc):
     res   = (d - Delta)/np.maximum(sig,1e-30)
     return chi2_marg, dof, res
 
+def sne_marginalized_cov(z, mu_obs, L, z_grid, DL_Mpc, e=None):
+    # come sne_marginalized con covarianza piena C = L L^T (ccov): residui sbiancati
+    DLq = np.interp(z, z_grid, DL_Mpc)
+    mu_th = 5.0*np.log10(np.maximum(DLq,1e-30)) + 25.0
+    c2, res = ccov.marginalized(L, mu_obs - mu_th, e)
+    return float(c2), int(z.size - 1), res
+
 def runs_test(signs):
-    # signs: array di +1/-1 (zero esclusi)
-    s = [int(1 if x>0 else -1) for x in signs if x!=0]
-    if len(s)<2: return 1.0  # p=1 se troppo pochi
-    R = 1 + sum(1 for i in range(1,len(s)) if s[i]!=s[i-1])
-    n1 = s.count(1); n2 = s.count(-1); N = n1+n2
-    if n1==0 or n2==0: return 0.0  # tutti stessi segni -> p≈0
-    mu = 2*n1*n2/N + 1
-    var = (2*n1*n2*(2*n1*n2 - n1 - n2))/((N**2)*(N-1))
-    if var<=0: return 1.0
-    z = (R - mu)/sqrt(var)
-    # p-value due code ~ N(0,1)
-    from math import erf
-    p = 2*0.5*(1 - erf(abs(z)/sqrt(2)))
-    return max(0.0, min(1.0, p))
+    # signs: array di +1/-1 (zero esclusi); versione vettoriale in ctests
+    return float(ctests.runs_p(signs)[0])
 
 def bin_uniformity_z(res_std, z, nbins=6):
-    # controlla che in ciascun bin: sum(e_i^2) ~ dof_bin (z-score |z|<=3)
-    edges = np.quantile(z, np.linspace(0,1,nbins+1))
-    ok = True; worst = {"bin":None, "zscore":0.0}
-    for b in range(nbins):
-        lo, hi = edges[b], edges[b+1] + (1e-12 if b==nbins-1 else 0.0)
-        sel = (z>=lo) & (z<hi)
-        e = res_std[sel]
-        dof = e.size
-        if dof<5:  # troppo pochi per test sensato
-            continue
-        S = float(np.sum(e*e))
-        zscore = (S - dof)/sqrt(2*dof)  # ~N(0,1)
-        if abs(zscore) > abs(worst["zscore"]):
-            worst = {"bin": b, "zscore": float(zscore)}
-        if abs(zscore) > 3.0:  # 3σ severo
-            ok = False
-    return ok, worst
+    # controlla che in ciascun bin: sum(e_i^2) ~ dof_bin (z-score |z|<=3, bin con <5 punti esclusi)
+    ok, worst, k = ctests.bin_uniformity(res_std, ctests.z_bins(z, nbins))
+    return bool(ok[0]), {"bin": int(k[0]) if k[0] >= 0 else None, "zscore": float(worst[0])}
+
+# ===== modalità batch: M modelli sulla stessa griglia z (righe = modelli) =====
+def interp_weights(x, xp):
+    # indici e scarti di np.interp(x, xp, .) per xp fisso, calcolati una volta per dataset
+    i = np.clip(np.searchsorted(xp, x, side="right")-1, 0, xp.size-2)
+    return i, x - xp[i], xp[i+1] - xp[i], x < xp[0], x >= xp[-1]
+
+def interp_apply(F, iw):
+    # stessa aritmetica di np.interp (pendenza * scarto + nodo, estremi costanti): bit identici
+    i, dx, h, lo, hi = iw
+    v = (F[..., i+1] - F[..., i])/h*dx + F[..., i]
+    return np.where(hi, F[..., -1:], np.where(lo, F[..., :1], v))
+
+def chi2_batch(y, yhat, sigma):
+    r = (y - yhat)/sigma
+    return np.sum(r*r, axis=-1), int(np.shape(y)[-1])
 
-if __name__=="__main__":
-    if len(sys.argv)<5:
-        print("usage: cfit.py H_curve.csv distances.csv cfit_config.json out_report.json"); sys.exit(2)
-
-    dfH = pd.read_csv(sys.argv[1])
-    dfd = pd.read_csv(sys.argv[2])
-    cfg = load_json(sys.argv[3])
-
-    z_grid = dfd["z"].values
-    H  = dfH["H_km_s_Mpc"].values
-    H0 = float(H[0])
-    DL = dfd["D_L_Mpc"].values
-
-    chi2_tot = 0.0
-    dof_tot  = 0
-    blocks   = {}
-    used_any = False
-    hard_tests = {}
-
-    # ===== SNe (marginalizzazione analitica; test severi su residui) =====
-    if cfg.get("sne_csv", None):
-        sne = pd.read_csv(cfg["sne_csv"])
-        zq   = sne["z"].values
-        mu   = sne["mu"].values
-        sig  = sne["sigma_mu"].values
-        c2, dof, res_std = sne_marginalized(zq, mu, sig, z_grid, DL)
-        chi2_tot += c2; dof_tot += dof; used_any = True
-        blocks["SNe_chi2"] = c2; blocks["SNe_dof"] = dof
-
-        # Test 1: normalità KS su residui standardizzati
-        ks_stat, ks_p = kstest(res_std, cdf='norm')
-        hard_tests["SNe_KS_p"] = float(ks_p)
-        # Test 2: indipendenza (runs test)
-        runs_p = runs_test(np.sign(res_std))
-        hard_tests["SNe_Runs_p"] = float(runs_p)
-        # Test 3: assenza trend con z (Spearman)
-        rho, sp_p = spearmanr(zq, res_std)
-        hard_tests["SNe_Spearman_rho"] = float(rho)
-        hard_tests["SNe_Spearman_p"]   = float(sp_p)
-        # Test 4: uniformità per bin
-        ok_bins, worst = bin_uniformity_z(res_std, zq, nbins=6)
-        hard_tests["SNe_BinUniform_ok"] = bool(ok_bins)
-        hard_tests["SNe_BinUniform_worst_zscore"] = float(worst["zscore"])
-
-    # ===== BAO (opzionale; richiede rs_Mpc nei dati) =====
-    if cfg.get("bao_csv", None):
-        bao = pd.read_csv(cfg["bao_csv"])
+def sne_marginalized_batch(z, mu_obs, sig, z_grid, DL, iw=None, w=None, S0=None, L=None, e=None):
+    # come sne_marginalized con DL (M, G): chi2 (M,), dof, residui standardizzati (M, N)
+    DLq = interp_apply(DL, iw if iw is not None else interp_weights(z, z_grid))
+    mu_th = 5.0*np.log10(np.maximum(DLq,1e-30)) + 25.0
+    if L is not None:
+        c2, res = ccov.marginalized(L, mu_obs - mu_th, e)
+        return c2, int(z.size - 1), res
+    if w is None: w = 1.0/np.maximum(sig, 1e-30)**2
+    d  = mu_obs - mu_th
+    if S0 is None: S0 = np.sum(w)
+    S1 = np.sum(w*d, axis=-1)    # come np.sum in sne_marginalized (stessi bit, non d @ w)
+    S2 = np.sum(w*d*d, axis=-1)
+    res = (d - (S1/S0)[:,None])/np.maximum(sig,1e-30)
+    return S2 - S1*S1/S0, int(z.size - 1), res
+
+class NoDatasets(ValueError):
+    pass
+
+class Prepared:
+    # dataset fissi su una griglia z fissa: tutto cio' che non dipende dal modello si calcola
+    # qui una volta (indici/pesi di interpolazione, 1/sigma^2 e S0, ranghi di z (Spearman),
+    # appartenenza ai bin, colonne BAO/H0); fit(H, dist) resta gather + prodotti scalari
+    def __init__(self, data, z_grid, nbins=6):
+        self.z_grid = np.asarray(z_grid, dtype=float)
+        self.sne = self.bao = self.h0 = self.calibrate = self.null = None
+        if data.get("sne") is not None:
+            sne = data["sne"]
+            z = sne["z"].values.astype(float); sig = sne["sigma_mu"].values.astype(float)
+            w = 1.0/np.maximum(sig, 1e-30)**2
+            self.sne = {"z": z, "mu": sne["mu"].values.astype(float), "sig": sig, "w": w, "S0": float(np.sum(w)),
+                        "iw": interp_weights(z, self.z_grid),
+                        "bins": ctests.z_bins(z, nbins), "rz": ctests.centered_ranks(z),
+                        "L": data.get("sne_chol"), "e": None}
+            if self.sne["L"] is not None:
+                self.sne["e"] = ccov.whiten(self.sne["L"], np.ones(z.size))
+            # calibrazione MC dei p-value: distribuzione nulla calcolata una volta per tutti i modelli
+            self.calibrate, self.null = data.get("calibrate"), None
+            if self.calibrate and self.calibrate.get("method", "mc") == "mc":
+                p = self.sne
+                e = p["e"] if p["e"] is not None else 1.0/np.maximum(sig, 1e-30)
+                o = self.calibrate
+                self.null = ctests.mc_null(e, z, int(o.get("B", 2000)), int(o.get("seed", 0)),
+                                           int(o.get("workers", 1)), p["bins"], p["rz"])
+        if data.get("bao") is not None:
+            bao = data["bao"]; zb = bao["z"].values.astype(float)
+            cols = {c: bao[c].values.astype(float) for c in bao.columns}
+            self.bao = {"z": zb, "iw": interp_weights(zb, self.z_grid), "cols": cols,
+                        "L": data.get("bao_chol") or {}}
+        if data.get("h0") is not None:
+            h0 = data["h0"]
+            self.h0 = (float(h0["H0_km_s_Mpc"].iloc[0]), float(h0["sigma"].iloc[0]))
+
+    def sne_model(self, dist):
+        # mu teorico (senza offset) ai z delle SNe, (M, N)
+        DLq = interp_apply(np.atleast_2d(dist["D_L_Mpc"]), self.sne["iw"])
+        return 5.0*np.log10(np.maximum(DLq,1e-30)) + 25.0
+
+    def bao_model(self, H, dist):
+        # osservabili BAO del modello ai z dei dati: [(colonna, yhat (M, nb), colonna sigma, nome)]
         c_km_s = 299792.458
-        zb = bao["z"].values
-        DM = np.interp(zb, z_grid, dfd["D_M_Mpc"].values)
-        DA = np.interp(zb, z_grid, dfd["D_A_Mpc"].values)
-        Hz = np.interp(zb, dfH["z"].values, dfH["H_km_s_Mpc"].values)
-        if {"DV_over_rs","sigma","rs_Mpc"} <= set(bao.columns):
+        zb, w, bao = self.bao["z"], self.bao["iw"], self.bao["cols"]
+        DM = interp_apply(np.atleast_2d(dist["D_M_Mpc"]), w); DA = interp_apply(np.atleast_2d(dist["D_A_Mpc"]), w)
+        Hz = interp_apply(np.atleast_2d(H), w)
+        out = []
+        if {"DV_over_rs","sigma","rs_Mpc"} <= set(bao):
             DV = ((1.0+zb)**2*DA**2*c_km_s*zb/Hz)**(1.0/3.0)
-            yhat = DV/bao["rs_Mpc"].values
-            c2, n = chi2(bao["DV_over_rs"].values, yhat, bao["sigma"].values)
-            blocks["BAO_DVrs_chi2"] = c2; blocks["BAO_DVrs_dof"] = n
-            chi2_tot += c2; dof_tot += n; used_any = True
-        if {"DM_over_rs","sigma_DM","rs_Mpc"} <= set(bao.columns):
-            yhat = DM/bao["rs_Mpc"].values
-            c2, n = chi2(bao["DM_over_rs"].values, yhat, bao["sigma_DM"].values)
-            blocks["BAO_DMrs_chi2"] = blocks.get("BAO_DMrs_chi2",0.0)+c2
-            blocks["BAO_DMrs_dof"]  = blocks.get("BAO_DMrs_dof",0)+n
-            chi2_tot += c2; dof_tot += n; used_any = True
-        if {"Hz_rs","sigma_Hz","rs_Mpc"} <= set(bao.columns):
-            yhat = Hz*bao["rs_Mpc"].values/c_km_s
-            c2, n = chi2(bao["Hz_rs"].values, yhat, bao["sigma_Hz"].values)
-            blocks["BAO_Hzrs_chi2"] = blocks.get("BAO_Hzrs_chi2",0.0)+c2
-            blocks["BAO_Hzrs_dof"]  = blocks.get("BAO_Hzrs_dof",0)+n
-            chi2_tot += c2; dof_tot += n; used_any = True
-
-    # ===== H0 (opzionale) =====
-    if cfg.get("h0_csv", None):
-        h0 = pd.read_csv(cfg["h0_csv"])
-        H0_obs = float(h0["H0_km_s_Mpc"].iloc[0])
-        sig = float(h0["sigma"].iloc[0])
-        c2 = (H0 - H0_obs)**2/(sig*sig)
-        blocks["H0_chi2"] = c2; blocks["H0_dof"] = 1
-        chi2_tot += c2; dof_tot += 1; used_any = True
-
-    # Nessun dataset => FAIL
-    if not used_any:
-        report = {"reason":"NO_DATASETS","chi2_total":0.0,"dof_total":0,"chi2_reduced":None,
-                  "PASS": False, "blocks": blocks, "hard_tests": hard_tests}
-        with open(sys.argv[4],"w") as f: json.dump(report,f,indent=2)
-        print("C_FIT: PASS=False reason=NO_DATASETS")
-        sys.exit(0)
-
-    red = chi2_tot/max(dof_tot,1)
-    # Regole dure: chi2_red <= 1.0 ; KS p>=0.01 ; runs p>=0.01 ; Spearman p>=0.01 ; bin-uniform ok
-    pass_reduced = (red <= 1.0)
-    t_ok = True
-    if "SNe_KS_p" in hard_tests:        t_ok &= (hard_tests["SNe_KS_p"]      >= 0.01)
-    if "SNe_Runs_p" in hard_tests:      t_ok &= (hard_tests["SNe_Runs_p"]    >= 0.01)
-    if "SNe_Spearman_p" in hard_tests:  t_ok &= (hard_tests["SNe_Spearman_p"]>= 0.01)
-    if "SNe_BinUniform_ok" in hard_tests: t_ok &= bool(hard_tests["SNe_BinUniform_ok"])
-
-    PASS = bool(pass_reduced and t_ok)
-
-    report = {
-        "chi2_total": float(chi2_tot),
-        "dof_total": int(dof_tot),
-        "chi2_reduced": float(red),
-        "PASS_REDUCED_CHI2_LE_1": bool(pass_reduced),
-        "PASS": PASS,
+            out.append(("DV_over_rs", DV/bao["rs_Mpc"], "sigma", "BAO_DVrs_chi2"))
+        if {"DM_over_rs","sigma_DM","rs_Mpc"} <= set(bao):
+            out.append(("DM_over_rs", DM/bao["rs_Mpc"], "sigma_DM", "BAO_DMrs_chi2"))
+        if {"Hz_rs","sigma_Hz","rs_Mpc"} <= set(bao):
+            out.append(("Hz_rs", Hz*bao["rs_Mpc"]/c_km_s, "sigma_Hz", "BAO_Hzrs_chi2"))
+        return out
+
+    def fit(self, H, dist, tests=True, obs=None):
+        # c_fit su M modelli in un passo: H e dist[...] (M, G) sulla griglia z_grid;
+        # tests=False: solo chi2 (niente test severi ne' PASS), per scansioni/MCMC;
+        # tests="flags": esiti dei test (ctests.pass_flags, senza p-value esatti) e PASS.
+        # obs: dati sostitutivi {"mu": (R, N), "bao": {colonna: (R, nb)}, "H0": (R,)}, per
+        # realizzazioni simulate di un solo modello (righe = realizzazioni)
+        obs = obs or {}
+        H = np.atleast_2d(H)
+        M = max([H.shape[0]] + [np.shape(v)[0] for v in (obs.get("mu"), obs.get("H0")) if v is not None]
+                + [np.shape(v)[0] for v in (obs.get("bao") or {}).values()])
+        chi2_tot = np.zeros(M); dof_tot = 0; cols = {}
+
+        if self.sne is not None:
+            p = self.sne
+            c2, dof, res = sne_marginalized_batch(p["z"], obs.get("mu", p["mu"]), p["sig"], self.z_grid,
+                                                  np.atleast_2d(dist["D_L_Mpc"]), iw=p["iw"], w=p["w"], S0=p["S0"],
+                                                  L=p["L"], e=p["e"])
+            chi2_tot += c2; dof_tot += dof
+            cols["SNe_chi2"] = c2; cols["SNe_dof"] = np.full(M, dof)
+            if tests == "flags":
+                cols.update(ctests.pass_flags(res, bins=p["bins"], rz=p["rz"]))
+            elif tests:
+                cols.update(ctests.hard_tests(res, p["z"], bins=p["bins"], rz=p["rz"]))
+                if self.calibrate:
+                    cols.update(ctests.calibrate(res, p["z"], None, self.calibrate, p["bins"], p["rz"], self.null))
+
+        if self.bao is not None:
+            bao, Lb, yobs = self.bao["cols"], self.bao["L"], obs.get("bao") or {}
+            for k, yhat, sk, name in self.bao_model(H, dist):
+                y = yobs.get(k, bao[k])
+                c2, n = ccov.chi2_cov(Lb[k], y, yhat) if k in Lb else chi2_batch(y, yhat, bao[sk])
+                cols[name] = c2; chi2_tot += c2; dof_tot += n
+
+        if self.h0 is not None:
+            H0_obs, sig = self.h0
+            c2 = (H[:,0] - obs.get("H0", H0_obs))**2/(sig*sig)
+            cols["H0_chi2"] = c2; chi2_tot += c2; dof_tot += 1
+
+        if dof_tot == 0:
+            raise NoDatasets("c_fit_batch: nessun dataset nel config")
+        red = chi2_tot/dof_tot
+        out = {"chi2_total": chi2_tot, "dof_total": np.full(M, dof_tot), "chi2_reduced": red,
+               "PASS_REDUCED_CHI2_LE_1": red <= 1.0}
+        if not tests: return {**out, **cols}
+        PASS = red <= 1.0
+        for k in ("SNe_KS_p", "SNe_Runs_p", "SNe_Spearman_p"):
+            if k in cols: PASS &= cols[k] >= ctests.ALPHA
+        for k in ("SNe_KS_ok", "SNe_Runs_ok", "SNe_Spearman_ok", "SNe_BinUniform_ok"):
+            if k in cols: PASS &= cols[k]
+        return {**out, "PASS": PASS, **cols}
+
+def c_fit_batch(z_grid, H, dist, data, prep=None):
+    # c_fit su M modelli; per chiamate ripetute sugli stessi dati passare prep (Prepared)
+    return (prep or Prepared(data, z_grid)).fit(H, dist)
+
+def load_data(cfg):
+    # dataset dal config (percorsi relativi alla cartella di lavoro), letti una volta
+    # sne_cov / bao_cov: covarianze piene, fattorizzate qui una volta (ccov, cache cov_cache)
+    # tabelle .csv, oppure .npz/.parquet colonnari mappati in memoria (ctable)
+    read = lambda k: load_table(cfg[k]) if cfg.get(k, None) else None
+    # calibrate: {"method": "mc"|"perm", "B", "seed", "workers"} -> p-value empirici (ctests)
+    data = {"sne": read("sne_csv"), "bao": read("bao_csv"), "h0": read("h0_csv"), "calibrate": cfg.get("calibrate")}
+    if data["sne"] is not None and cfg.get("sne_cov"):
+        data["sne_chol"] = ccov.sne_factor(cfg, data["sne"])
+    if data["bao"] is not None and cfg.get("bao_cov"):
+        data["bao_chol"] = ccov.bao_factors(cfg, data["bao"])
+    return data
+
+def data_redshifts(data):
+    # redshift dei dati (SNe, BAO): aggiunti come nodi alla griglia, l'interpolazione
+    # in c_fit li legge esatti e il fit non dipende dalla spaziatura della tabella
+    zs = [np.asarray(data[k]["z"], dtype=float) for k in ("sne", "bao") if data.get(k) is not None]
+    return np.unique(np.concatenate(zs)) if zs else np.empty(0)
+
+def c_fit(Htab, dist, data, prep=None):
+    # stadio C_fit in memoria per un modello: Htab/dist con colonne come H_curve.csv/distances.csv
+    # (DataFrame o dict di array), data da load_data -> report. Stessa verosimiglianza e regola
+    # PASS di scan/simulate (Prepared.fit su una riga), riportata nel formato storico
+    prep = prep or Prepared(data, np.asarray(dist["z"], dtype=float))
+    try:
+        f = prep.fit(np.asarray(Htab["H_km_s_Mpc"], dtype=float), dist)
+    except NoDatasets:
+        return {"reason":"NO_DATASETS","chi2_total":0.0,"dof_total":0,"chi2_reduced":None,
+                "PASS": False, "blocks": {}, "hard_tests": {}}
+    blocks, hard_tests = {}, {}
+    for k, v in f.items():
+        if k.endswith("_chi2"):
+            # dof per blocco: SNe N-1 (offset marginalizzato), BAO un punto per riga, H0 uno
+            blocks[k] = float(v[0])
+            blocks[k[:-5]+"_dof"] = int(f["SNe_dof"][0]) if k == "SNe_chi2" else 1 if k == "H0_chi2" else int(prep.bao["z"].size)
+        elif k.startswith("SNe_") and k != "SNe_dof":
+            hard_tests[k] = v[0].item()
+    return {
+        "chi2_total": float(f["chi2_total"][0]),
+        "dof_total": int(f["dof_total"][0]),
+        "chi2_reduced": float(f["chi2_reduced"][0]),
+        "PASS_REDUCED_CHI2_LE_1": bool(f["PASS_REDUCED_CHI2_LE_1"][0]),
+        "PASS": bool(f["PASS"][0]),
         "blocks": blocks,
         "hard_tests": hard_tests
     }
+
+def summary(report):
+    if report.get("reason") == "NO_DATASETS":
+        return "C_FIT: PASS=False reason=NO_DATASETS"
+    return f"C_FIT: PASS={report['PASS']} chi2_red={report['chi2_reduced']:.3f}"
+
+def main():
+    if len(sys.argv)<5:
+        print("usage: cfit.py H_curve.{csv,npz} distances.{csv,npz} cfit_config.json out_report.json"); sys.exit(2)
+    # tabelle CSV, .npz o .parquet (ctable), anche su griglia non uniforme
+    report = c_fit(load_table(sys.argv[1]), load_table(sys.argv[2]), load_data(load_json(sys.argv[3])))
     with open(sys.argv[4],"w") as f: json.dump(report,f,indent=2)
-    print(f"C_FIT: PASS={PASS} chi2_red={red:.3f}")
+    print(summary(report))
+
+if __name__=="__main__":
+    main()
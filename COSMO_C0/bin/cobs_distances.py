@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
-import sys, json, numpy as np, pandas as pd
+import argparse, json, numpy as np, pandas as pd
+from cobs_hz import load_table, save_table
+
+C_KM_S = 299792.458
 
 def load_json(p):
     with open(p,"r") as f: return json.load(f)
@@ -8,47 +11,167 @@ def etherington_check(DL, DA, z):
     # Identità strutturale: DL = (1+z)^2 DA
     return np.max(np.abs(DL - (1.0+z)**2 * DA) / np.maximum((1.0+z)**2 * DA, 1e-32))
 
-if __name__=="__main__":
-    if len(sys.argv)<5:
-        print("usage: cobs_distances.py H_curve.csv matter_EH.json out_dist.csv out_report.json"); sys.exit(2)
+# ---------- motori di integrazione per chi(z) = c ∫0^z dz'/H(z') ----------
+# Tabella (z, H): trapz (storico), simpson (quadratiche a coppie di intervalli), spline
+# (cubica sull'inverso di H, primitiva esatta). Ogni motore integra il proprio interpolante
+# fino a z arbitrari (nessun np.interp a valle); stima d'errore alla Richardson sul
+# sottogriglia a passo doppio. gl: Gauss-Legendre su E(z) analitica, raffinamento a tolleranza.
+ORDER = {"trapz": 2, "simpson": 4, "spline": 4}
 
-    dfH = pd.read_csv(sys.argv[1])
-    eps = load_json(sys.argv[2])
+def _trapz_at(z, f, zq):
+    F = np.concatenate(([0.0], np.cumsum(0.5*(f[1:]+f[:-1])*np.diff(z))))
+    i = np.clip(np.searchsorted(z, zq, side="right")-1, 0, z.size-2)
+    t = zq - z[i]; h = z[i+1] - z[i]
+    fq = f[i] + (f[i+1]-f[i])*t/h
+    return F[i] + 0.5*(f[i] + fq)*t
 
-    z = dfH["z"].values
-    H = dfH["H_km_s_Mpc"].values
-    H0 = float(H[0])
-    c_km_s = 299792.458
+def _simpson_at(z, f, zq):
+    # quadratica di Lagrange su ogni coppia (z0,z1,z2) (griglia anche non uniforme);
+    # con un numero dispari di intervalli l'ultimo usa la quadratica sui tre nodi finali;
+    # con due soli nodi non c'e' quadratica: trapezio (interpolante lineare, esatto li')
+    if z.size < 3:
+        return _trapz_at(z, f, zq)
+    n = z.size - 1
+    starts = np.arange(0, n-1, 2)
+    if n % 2: starts = np.append(starts, n-2)
+    z0, z1, z2 = z[starts], z[starts+1], z[starts+2]
+    f0, f1, f2 = f[starts], f[starts+1], f[starts+2]
+    def prim(k, x):
+        # ∫_{z0}^{x} della quadratica k (x dentro il suo supporto)
+        a, b, c = z0[k], z1[k], z2[k]
+        u = x - a
+        d1 = (f1[k]-f0[k])/(b-a); d2 = ((f2[k]-f1[k])/(c-b) - d1)/(c-a)
+        # Newton: f0 + d1 (x-a) + d2 (x-a)(x-b)
+        return f0[k]*u + d1*u*u/2 + d2*(u**3/3 - (b-a)*u*u/2)
+    ks = np.arange(starts.size)
+    off = np.zeros(starts.size)
+    if n % 2: off[-1] = prim(ks[-1], z1[-1])  # l'ultima quadratica copre solo [z_{n-1}, z_n]
+    F = np.concatenate(([0.0], np.cumsum(prim(ks, z2) - off)))
+    k = np.clip(np.searchsorted(z2, zq, side="left"), 0, starts.size-1)
+    return F[k] + prim(k, zq) - off[k]
 
-    # comovente: chi(z) = ∫0^z c/H dz'
-    dz = np.diff(z)
+def _spline_at(z, f, zq):
+    from scipy.interpolate import CubicSpline
+    return CubicSpline(z, f).antiderivative()(zq)
+
+TABLE_ENGINES = {"trapz": _trapz_at, "simpson": _simpson_at, "spline": _spline_at}
+
+def chi_table(z, H, zq, engine="spline"):
+    # chi ai z richiesti e stima d'errore (confronto con la griglia a passo doppio)
+    if z.size < 2:
+        raise ValueError(f"chi_table: servono almeno 2 nodi z (ricevuti {z.size})")
     invH = 1.0/np.clip(H,1e-30,None)
-    chi = np.zeros_like(z)
-    chi[1:] = np.cumsum(0.5*(invH[1:]+invH[:-1])*dz)    # (Mpc*s)/km
-    chi *= c_km_s                                      # -> Mpc
+    at = TABLE_ENGINES[engine]
+    chi = C_KM_S*at(z, invH, zq)
+    zc, fc = z[::2], invH[::2]
+    if zc[-1] != z[-1]: zc, fc = np.append(zc, z[-1]), np.append(fc, invH[-1])
+    chi_c = C_KM_S*at(zc, fc, zq)
+    # Richardson solo se le due griglie usano lo stesso ordine; simpson con griglia grossa
+    # di 2 nodi ricade sul trapezio: |chi - chi_c| come stima (conservativa)
+    p = ORDER[engine] if engine != "simpson" or zc.size >= 3 else 0
+    err = np.abs(chi - chi_c)/max(2**p - 1, 1)
+    return chi, err
+
+GL_NODES, GL_WEIGHTS = np.polynomial.legendre.leggauss(8)
 
-    # curvatura
+def _gl(f, a, b):
+    m, r = 0.5*(a+b), 0.5*(b-a)
+    x = m[:,None] + r[:,None]*GL_NODES[None,:]
+    return r*(f(x) @ GL_WEIGHTS)
+
+def chi_analytic(E, H0, zq, tol=1e-12, max_iter=40):
+    # chi(z) = (c/H0) E(0) ∫ dz/E(z): intervalli tra z richiesti consecutivi, ciascuno
+    # bisecato finche' |GL(intero) - GL(due meta')| <= tol |GL|; somme cumulative
+    zs = np.unique(np.concatenate(([0.0], np.asarray(zq, dtype=float))))
+    f = lambda x: 1.0/E(x)
+    a, b, own = zs[:-1].copy(), zs[1:].copy(), np.arange(zs.size-1)
+    I = np.zeros(zs.size-1); err = np.zeros(zs.size-1)
+    nevals = 0
+    for _ in range(max_iter):
+        if a.size == 0: break
+        m = 0.5*(a+b)
+        I1 = _gl(f, a, b); I2 = _gl(f, a, m) + _gl(f, m, b); nevals += 3*a.size*GL_NODES.size
+        e = np.abs(I1 - I2)
+        done = e <= tol*np.abs(I2)
+        np.add.at(I, own[done], I2[done]); np.add.at(err, own[done], e[done])
+        a, b, own = np.concatenate((a[~done], m[~done])), np.concatenate((m[~done], b[~done])), \
+                    np.concatenate((own[~done], own[~done]))
+    if a.size:
+        raise RuntimeError(f"chi_analytic: {a.size} intervalli non convergono a tol={tol}")
+    scale = C_KM_S*E(0.0)/H0
+    chi_s = np.concatenate(([0.0], np.cumsum(I)))*scale
+    err_s = np.concatenate(([0.0], np.cumsum(err)))*scale
+    idx = np.searchsorted(zs, zq)
+    return chi_s[idx], err_s[idx], nevals
+
+def E_analytic(eps):
+    r, m, k = float(eps["epsilon_rad"]), float(eps["epsilon_mat"]), float(eps["epsilon_curv"])
+    return lambda z: np.sqrt(r*(1+z)**4 + m*(1+z)**3 + k*(1+z)**2 + 1.0)
+
+def omega_k(eps):
     Ok_raw = float(eps["epsilon_curv"])
     E0 = np.sqrt(float(eps["epsilon_rad"]) + float(eps["epsilon_mat"]) + Ok_raw + 1.0)
-    Ok = Ok_raw / (E0*E0)  # Ω_k oggi
+    return Ok_raw / (E0*E0)  # Ω_k oggi
 
+def transverse(chi, Ok, H0):
     if abs(Ok) < 1e-15:
-        DM = chi
-    elif Ok > 0:
-        DM = np.sinh(np.sqrt(Ok)*H0*chi/c_km_s) * c_km_s/(np.sqrt(Ok)*H0)
-    else:
-        DM = np.sin(np.sqrt(-Ok)*H0*chi/c_km_s) * c_km_s/(np.sqrt(-Ok)*H0)
+        return chi
+    if Ok > 0:
+        return np.sinh(np.sqrt(Ok)*H0*chi/C_KM_S) * C_KM_S/(np.sqrt(Ok)*H0)
+    return np.sin(np.sqrt(-Ok)*H0*chi/C_KM_S) * C_KM_S/(np.sqrt(-Ok)*H0)
+
+def distances(zq, chi, Ok, H0):
+    # D_C, D_M, D_A, D_L ai z richiesti
+    zq = np.asarray(zq, dtype=float)
+    DM = transverse(chi, Ok, H0)
+    DA = DM/(1.0+zq)
+    return {"z": zq, "D_C_Mpc": chi, "D_M_Mpc": DM, "D_A_Mpc": DA, "D_L_Mpc": (1.0+zq)**2 * DA}
 
+def distances_batch(z, H, Ok):
+    # molti modelli sulla stessa griglia: H (M, G), Ok (M,); trapezi cumulativi come c_obs
+    H = np.asarray(H, dtype=float); Ok = np.asarray(Ok, dtype=float)[:,None]
+    H0 = H[:,:1]
+    invH = 1.0/np.clip(H,1e-30,None)
+    chi = np.zeros_like(H)
+    chi[:,1:] = np.cumsum(0.5*(invH[:,1:]+invH[:,:-1])*np.diff(z), axis=1)*C_KM_S
+    sk = np.sqrt(np.abs(Ok)); x = sk*H0*chi/C_KM_S
+    with np.errstate(divide="ignore", invalid="ignore"):
+        DM = np.where(np.abs(Ok) < 1e-15, chi,
+                      np.where(Ok > 0, np.sinh(x), np.sin(x))*C_KM_S/(sk*H0))
     DA = DM/(1.0+z)
-    DL = (1.0+z)**2 * DA
+    return {"z": z, "D_C_Mpc": chi, "D_M_Mpc": DM, "D_A_Mpc": DA, "D_L_Mpc": (1.0+z)**2 * DA}
 
-    out = pd.DataFrame({"z":z,"D_C_Mpc":chi,"D_M_Mpc":DM,"D_A_Mpc":DA,"D_L_Mpc":DL})
-    out.to_csv(sys.argv[3], index=False)
+def c_obs(z, H, eps, engine="trapz", tol=1e-12, zq=None):
+    # stadio C_obs in memoria: tabella (z, H [km/s/Mpc]) -> (colonne distanze, report)
+    z = np.asarray(z, dtype=float); H = np.asarray(H, dtype=float)
+    H0 = float(H[0])
+    Ok = omega_k(eps)
+    explicit = zq is not None
+    zq = z if zq is None else np.asarray(zq, dtype=float)
 
-    ether_rel = etherington_check(DL, DA, z)
+    extra = {}
+    if engine == "trapz" and not explicit:
+        # comovente: chi(z) = ∫0^z c/H dz' (trapezi cumulativi sulla tabella, storico)
+        dz = np.diff(z)
+        invH = 1.0/np.clip(H,1e-30,None)
+        chi = np.zeros_like(z)
+        chi[1:] = np.cumsum(0.5*(invH[1:]+invH[:-1])*dz)    # (Mpc*s)/km
+        chi *= C_KM_S                                      # -> Mpc
+    elif engine == "gl":
+        chi, err, nevals = chi_analytic(E_analytic(eps), H0, zq, tol=tol)
+        extra = {"distance_engine": "gl", "tol": tol, "E_evals": int(nevals)}
+    else:
+        chi, err = chi_table(z, H, zq, engine=engine)
+        extra = {"distance_engine": engine, "grid_points": int(z.size)}
+    if extra:
+        extra["chi_err_est_rel_max"] = float(np.max(err[zq > 0]/chi[zq > 0])) if np.any(zq > 0) else 0.0
+        extra["z_query"] = int(np.size(zq))
+
+    d = distances(zq, chi, Ok, H0)
+    ether_rel = etherington_check(d["D_L_Mpc"], d["D_A_Mpc"], d["z"])
 
     # Certificazione low-z per identità: DL'(0) = c/H0 esatto
-    slope_target = c_km_s / H0
+    slope_target = C_KM_S / H0
     lowz_rel = 0.0
     pass_lowz = True
 
@@ -61,6 +184,34 @@ if __name__=="__main__":
         "PASS_LOWZ": pass_lowz,
         "note": "DL'(0)=c/H0 verificata per identità analitica; nessuna approssimazione numerica."
     }
-    with open(sys.argv[4],"w") as f:
+    report.update(extra)
+    return d, report
+
+def c_obs_model(model, zq, tol=1e-12):
+    # distanze direttamente dal modello (cobs_hz.HModel) ai z richiesti, senza tabella H:
+    # Gauss-Legendre adattivo su E(z) analitica
+    return c_obs([0.0], [model.H0], model.eps, "gl", tol, zq)
+
+def main():
+    ap = argparse.ArgumentParser(usage="cobs_distances.py H_curve.{csv,npz} matter_EH.json out_dist.{csv,npz} out_report.json [opzioni]")
+    ap.add_argument("H_curve"); ap.add_argument("matter_EH"); ap.add_argument("out_dist"); ap.add_argument("out_report")
+    ap.add_argument("--engine", choices=["trapz","simpson","spline","gl"], default="trapz",
+                    help="trapz: storico; simpson/spline: ordine 4 sulla tabella H; gl: Gauss-Legendre su E(z) analitica")
+    ap.add_argument("--tol", type=float, default=1e-12, help="errore relativo per intervallo (gl)")
+    ap.add_argument("--z", type=float, nargs="+", default=None, help="redshift richiesti (default: griglia di H_curve)")
+    ap.add_argument("--z-file", default=None, help="CSV con colonna z dei redshift richiesti")
+    args = ap.parse_args()
+
+    dfH = load_table(args.H_curve)
+    eps = load_json(args.matter_EH)
+    zq = args.z
+    if args.z_file: zq = pd.read_csv(args.z_file)["z"].values.astype(float)
+
+    d, report = c_obs(np.asarray(dfH["z"]), np.asarray(dfH["H_km_s_Mpc"]), eps, args.engine, args.tol, zq)
+    save_table(args.out_dist, d, {"engine": args.engine})
+    with open(args.out_report,"w") as f:
         json.dump(report,f,indent=2)
-    print(f"C_OBS: PASS_ETHERINGTON={pass_ether} PASS_LOWZ={pass_lowz}")
+    print(f"C_OBS: PASS_ETHERINGTON={report['PASS_ETHERINGTON']} PASS_LOWZ={report['PASS_LOWZ']}")
+
+if __name__=="__main__":
+    main()
@@ -1,27 +1,102 @@
 #!/usr/bin/env python3
-import sys, json, numpy as np, pandas as pd
+import argparse, json, numpy as np, pandas as pd
+import ctable
+
+Mpc_km = 3.085677581491367e19
 
 def load_json(p):
     with open(p,"r") as f: return json.load(f)
 
-def H_curve(H_L_SI, eps):
-    z = np.linspace(0.0, 2.5, 2001)
+def H_arrays(H_L_SI, eps, z=None):
+    # colonne di H_curve come array NumPy (uso in memoria, es. cosmo_c0 run)
+    if z is None: z = np.linspace(0.0, 2.5, 2001)
     rad = eps["epsilon_rad"]*(1+z)**4
     mat = eps["epsilon_mat"]*(1+z)**3
     curv = eps["epsilon_curv"]*(1+z)**2
     E = np.sqrt(rad+mat+curv+1.0)
     H_SI = H_L_SI*E
-    Mpc_km = 3.085677581491367e19
     H_km_s_Mpc = H_SI*Mpc_km
-    df = pd.DataFrame({"z":z,"H_SI":H_SI,"H_km_s_Mpc":H_km_s_Mpc})
-    return df
+    return {"z":z,"H_SI":H_SI,"H_km_s_Mpc":H_km_s_Mpc}
 
-if __name__=="__main__":
-    if len(sys.argv)<4:
-        print("usage: cobs_hz.py Lambda4.json matter_EH.json out.csv"); sys.exit(2)
-    lam = load_json(sys.argv[1])
-    eps = load_json(sys.argv[2])
+def H_curve(H_L_SI, eps):
+    return pd.DataFrame(H_arrays(H_L_SI, eps))
+
+class HModel:
+    # H(z) = H_L E(z) valutato su richiesta a qualunque z (stessa aritmetica di H_arrays);
+    # la griglia serve solo per esportare una tabella
+    def __init__(self, H_L_SI, eps):
+        self.H_L_SI = float(H_L_SI)
+        self.eps = {k: float(eps[k]) for k in ("epsilon_rad", "epsilon_mat", "epsilon_curv")}
+
+    @classmethod
+    def from_files(cls, lambda4, matter):
+        return cls(load_json(lambda4)["H_L_SI"], load_json(matter))
+
+    def __call__(self, z):
+        # H in km/s/Mpc, vettoriale
+        return H_arrays(self.H_L_SI, self.eps, np.asarray(z, dtype=float))["H_km_s_Mpc"]
+
+    def E(self, z):
+        return H_arrays(self.H_L_SI, self.eps, np.asarray(z, dtype=float))["H_SI"]/self.H_L_SI
+
+    @property
+    def Ok(self):
+        e = self.eps
+        return e["epsilon_curv"]/(e["epsilon_rad"] + e["epsilon_mat"] + e["epsilon_curv"] + 1.0)
+
+    @property
+    def H0(self):
+        return float(self(0.0))
+
+    def table(self, z):
+        return H_arrays(self.H_L_SI, self.eps, np.asarray(z, dtype=float))
+
+    def adaptive_grid(self, zmax=2.5, tol=1e-7, n0=33, max_points=1_000_001):
+        # bisezione degli intervalli dove l'interpolazione lineare di H sbaglia piu' di tol
+        # (relativo) a meta' intervallo: i nodi si addensano dove H'' / H e' grande (termini
+        # di materia e radiazione ad alto z), radi dove H e' quasi lineare
+        z = np.linspace(0.0, zmax, n0)
+        Hz = self(z)
+        while z.size < max_points:
+            m = 0.5*(z[:-1] + z[1:]); Hm = self(m)
+            bad = np.abs(0.5*(Hz[:-1] + Hz[1:]) - Hm) > tol*Hm
+            if not bad.any(): break
+            z = np.concatenate((z, m[bad])); Hz = np.concatenate((Hz, Hm[bad]))
+            o = np.argsort(z, kind="stable"); z, Hz = z[o], Hz[o]
+        return z
+
+def save_table(path, cols, meta=None):
+    # formato dall'estensione (ctable): .npz/.parquet colonnari, altrimenti CSV
+    return ctable.write(path, cols, meta)
+
+def load_table(path):
+    # .npz/.parquet -> DataFrame sulle colonne mappate in memoria; CSV letto come sempre
+    if path.endswith((".npz", ".parquet")):
+        return ctable.read(path)
+    return pd.read_csv(path)
+
+def main():
+    ap = argparse.ArgumentParser(usage="cobs_hz.py Lambda4.json matter_EH.json out.{csv,npz} [opzioni]")
+    ap.add_argument("lambda4"); ap.add_argument("matter"); ap.add_argument("out")
+    ap.add_argument("--adaptive", action="store_true",
+                    help="griglia non uniforme (errore di interpolazione lineare di H <= --tol)")
+    ap.add_argument("--tol", type=float, default=1e-7)
+    ap.add_argument("--zmax", type=float, default=2.5)
+    a = ap.parse_args()
+    lam = load_json(a.lambda4)
+    eps = load_json(a.matter)
+    if a.adaptive or a.out.endswith((".npz", ".parquet")):
+        model = HModel(lam["H_L_SI"], eps)
+        z = model.adaptive_grid(a.zmax, a.tol) if a.adaptive else np.linspace(0.0, a.zmax, 2001)
+        save_table(a.out, model.table(z), {"H_L_SI": model.H_L_SI, **model.eps,
+                                            "grid": "adaptive" if a.adaptive else "uniform",
+                                            "tol": a.tol if a.adaptive else None})
+        print(f"H0_km_s_Mpc={model.H0:.6f} punti={z.size}")
+        return
     df = H_curve(lam["H_L_SI"], eps)
-    df.to_csv(sys.argv[3], index=False)
+    df.to_csv(a.out, index=False)
     H0 = float(df.loc[df["z"].sub(0).abs().idxmin(),"H_km_s_Mpc"])
     print(f"H0_km_s_Mpc={H0:.6f}")
+
+if __name__=="__main__":
+    main()
@@ -1,30 +1,67 @@
 #!/usr/bin/env python3
-import json, hashlib, platform, sys, time, os, pandas as pd
+import json, hashlib, platform, sys, time, os
 from mpmath import gammainc, gamma
+import ctable
+
+# tabelle: artifacts/H_curve.{npz,parquet,csv}, tutti i formati presenti (vedi formats)
+TABLES = ["artifacts/H_curve","artifacts/distances"]
+REPORTS = ["artifacts/C_obs_report.json","artifacts/C_fit_report.json"]
+
 def sha256(p):
     h=hashlib.sha256()
     with open(p,'rb') as f:
         for b in iter(lambda:f.read(65536), b''): h.update(b)
     return h.hexdigest()
-obs=json.load(open("artifacts/C_obs_report.json"))
-fit=json.load(open("artifacts/C_fit_report.json"))
-N_SNe=len(pd.read_csv("data/sne.csv")) if os.path.exists("data/sne.csv") else 0
-k=fit.get("dof_total",0); x=fit.get("chi2_total",0.0)
-p=float(gammainc(k/2, x/2, float('inf'))/gamma(k/2)) if k>0 else None
-files=["artifacts/H_curve.csv","artifacts/distances.csv","artifacts/C_obs_report.json","artifacts/C_fit_report.json"]
-hashes={p:sha256(p) for p in files if os.path.exists(p)}
-seal={
- "timestamp_utc": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
- "python": sys.version.split()[0],
- "packages": {
-  "numpy": __import__('numpy').__version__,
-  "pandas": __import__('pandas').__version__,
-  "scipy": __import__('importlib').import_module('scipy').__version__ if __import__('importlib').util.find_spec('scipy') else None,
-  "mpmath": __import__('mpmath').__version__
- },
- "C_OBS": obs, "C_FIT": fit, "p_value": p, "N_SNe": N_SNe,
- "hashes": hashes,
- "PASS_ALL": bool(obs.get("PASS_ETHERINGTON") and obs.get("PASS_LOWZ") and fit.get("PASS", False))
-}
-with open("artifacts/SEAL.json","w") as f: json.dump(seal,f,indent=2)
-print(f"SEAL: PASS_ALL={seal['PASS_ALL']} p_value={seal['p_value']} N_SNe={seal['N_SNe']}")
+
+def p_value(fit):
+    k=fit.get("dof_total",0); x=fit.get("chi2_total",0.0)
+    return float(gammainc(k/2, x/2, float('inf'))/gamma(k/2)) if k>0 else None
+
+def formats(stem):
+    # formati presenti di una tabella; se piu' d'uno devono avere lo stesso hash colonnare
+    # (una copia obsoleta, es. .npz accanto al CSV rigenerato, non va sigillata)
+    paths = [stem+e for e in (".npz", ".parquet", ".csv") if os.path.exists(stem+e)]
+    if len(paths) > 1 and len({ctable.table_hash(p) for p in paths}) > 1:
+        sys.exit(f"SEAL: {stem}: formati con contenuto diverso ({', '.join(paths)}), rimuovere la copia obsoleta")
+    return paths
+
+def artifact_paths():
+    return [p for t in TABLES for p in formats(t)] + [p for p in REPORTS if os.path.exists(p)]
+
+def seal(obs, fit, N_SNe, hashes, table_hashes=None):
+    # SEAL da report e hash gia' calcolati (cseal.py li rilegge dal disco, cosmo_c0 run no)
+    # hashes: sha256 dei byte dei file; table_hashes: hash colonnare canonico delle tabelle
+    # (ctable), lo stesso per CSV, .npz o .parquet con gli stessi valori
+    s = {
+     "timestamp_utc": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+     "python": sys.version.split()[0],
+     "packages": {
+      "numpy": __import__('numpy').__version__,
+      "pandas": __import__('pandas').__version__,
+      "scipy": __import__('importlib').import_module('scipy').__version__ if __import__('importlib').util.find_spec('scipy') else None,
+      "mpmath": __import__('mpmath').__version__
+     },
+     "C_OBS": obs, "C_FIT": fit, "p_value": p_value(fit), "N_SNe": N_SNe,
+     "hashes": hashes,
+     "PASS_ALL": bool(obs.get("PASS_ETHERINGTON") and obs.get("PASS_LOWZ") and fit.get("PASS", False))
+    }
+    if table_hashes: s["table_hashes"] = table_hashes
+    return s
+
+def summary(s):
+    return f"SEAL: PASS_ALL={s['PASS_ALL']} p_value={s['p_value']} N_SNe={s['N_SNe']}"
+
+def main():
+    obs=json.load(open("artifacts/C_obs_report.json"))
+    fit=json.load(open("artifacts/C_fit_report.json"))
+    sne=formats("data/sne")
+    N_SNe=ctable.rows(sne[0]) if sne else 0
+    paths=artifact_paths()
+    tables=[p for p in paths if p not in REPORTS]
+    s=seal(obs, fit, N_SNe, {p:sha256(p) for p in paths},
+           {p:ctable.table_hash(p) for p in tables})
+    with open("artifacts/SEAL.json","w") as f: json.dump(s,f,indent=2)
+    print(summary(s))
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# Tabelle colonnari per COSMO_C0 (H_curve, distances, sne, ...):
+#   .npz    zip non compresso, una colonna .npy per membro allineata a 64 byte + manifest.json;
+#           leggibile con np.load, qui mappato in memoria colonna per colonna (zero copie)
+#   .parquet  via pyarrow (se installato), letto con memory_map
+#   .csv    testo per uso umano (pandas), come prima
+# L'hash di una tabella e' calcolato sulla rappresentazione colonnare canonica (nome, dtype
+# little-endian, forma e byte di ogni colonna, nell'ordine del manifest): identico per gli
+# stessi valori in .npz, .parquet o .csv (letto round-trip), indipendente dai byte del file.
+import hashlib, json, os, struct, sys, zipfile
+import numpy as np
+import pandas as pd
+
+FORMAT = "ctable-v1"
+MANIFEST = "manifest.json"
+ALIGN = 64
+PAD_ID = 0xD935  # campo extra di padding (come zipalign)
+
+def canonical(a):
+    # float/int/bool little-endian contigui; stringhe -> unicode a larghezza fissa
+    a = np.asarray(a)
+    if a.dtype.kind in "OUST":
+        a = a.astype(str)
+    return np.ascontiguousarray(a, dtype=a.dtype.newbyteorder("<"))
+
+def columns_hash(cols):
+    h = hashlib.sha256(f"{FORMAT}\n".encode())
+    for name, a in cols.items():
+        a = canonical(a)
+        h.update(f"{name}:{a.dtype.str}:{a.shape}\n".encode())
+        h.update(memoryview(a).cast("B"))
+    return h.hexdigest()
+
+def _columns(cols):
+    if isinstance(cols, pd.DataFrame):
+        return {k: cols[k].to_numpy() for k in cols.columns}
+    return dict(cols)
+
+def write(path, cols, meta=None):
+    # scrive la tabella (formato dall'estensione) e restituisce l'hash colonnare
+    cols = _columns(cols)
+    if path.endswith(".npz"):
+        return _write_npz(path, {k: canonical(v) for k,v in cols.items()}, meta)
+    if path.endswith(".parquet"):
+        import pyarrow as pa, pyarrow.parquet as pq
+        t = pa.table({k: canonical(v) for k,v in cols.items()})
+        t = t.replace_schema_metadata({"ctable": json.dumps({"format": FORMAT, "meta": meta or {}})})
+        pq.write_table(t, path)
+    else:
+        pd.DataFrame(cols).to_csv(path, index=False)
+    return columns_hash(cols)
+
+def _member(name, offset):
+    # membro .npy non compresso a offset noto, data fissa (byte riproducibili); header locale
+    # 30 + nome + extra + 20 (zip64) e header .npy multiplo di 64 -> dati allineati a ALIGN
+    zi = zipfile.ZipInfo(name + ".npy", date_time=(1980, 1, 1, 0, 0, 0))
+    zi.compress_type = zipfile.ZIP_STORED
+    pad = -(offset + 30 + len(zi.filename.encode()) + 4 + 20) % ALIGN
+    zi.extra = struct.pack("<HH", PAD_ID, pad) + b"\0"*pad
+    return zi
+
+def _write_npz(path, cols, meta):
+    digest = columns_hash(cols)
+    man = {"format": FORMAT, "rows": int(len(next(iter(cols.values())))) if cols else 0,
+           "columns": [{"name": k, "dtype": a.dtype.str, "shape": list(a.shape)} for k,a in cols.items()],
+           "sha256": digest, "meta": meta or {}}
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f, zipfile.ZipFile(f, "w", zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for k, a in cols.items():
+            zi = _member(k, f.tell())
+            with zf.open(zi, "w", force_zip64=True) as fh:
+                np.lib.format.write_array(fh, a, allow_pickle=False)
+        zi = zipfile.ZipInfo(MANIFEST, date_time=(1980, 1, 1, 0, 0, 0))
+        zf.writestr(zi, json.dumps(man, indent=1))
+    os.replace(tmp, path)
+    return digest
+
+class Writer:
+    # scrittura a blocchi di righe con memoria limitata: ogni colonna numerica va in un file
+    # temporaneo, close() assembla .npz (copia a blocchi, hash incrementale) o CSV in append
+    def __init__(self, path, meta=None):
+        self.path, self.meta, self.n, self.tmp, self.dtypes = path, meta or {}, 0, {}, {}
+        self.csv = not path.endswith(".npz")
+        if path.endswith(".parquet"):
+            raise ValueError("Writer: Parquet a blocchi non supportato (usare .npz o .csv)")
+
+    def append(self, cols):
+        cols = _columns(cols)
+        if self.csv:
+            pd.DataFrame(cols).to_csv(self.path, mode="a" if self.n else "w", header=not self.n, index=False)
+        else:
+            for k, a in cols.items():
+                if k not in self.tmp:
+                    self.dtypes[k] = canonical(a).dtype
+                    self.tmp[k] = open(f"{self.path}.{os.getpid()}.{len(self.tmp)}.col", "w+b")
+                self.tmp[k].write(memoryview(canonical(np.asarray(a, dtype=self.dtypes[k]))).cast("B"))
+        self.n += len(next(iter(cols.values())))
+
+    def close(self):
+        if self.csv:
+            return None  # CSV: hash colonnare su richiesta (table_hash), non a blocchi
+        try:
+            return _stream_npz(self.path, self.tmp, self.dtypes, self.n, self.meta)
+        finally:
+            for f in self.tmp.values():
+                f.close(); os.remove(f.name)
+
+def _stream_npz(path, files, dtypes, n, meta, block=1 << 24):
+    h = hashlib.sha256(f"{FORMAT}\n".encode())
+    man = {"format": FORMAT, "rows": n,
+           "columns": [{"name": k, "dtype": dtypes[k].str, "shape": [n]} for k in files],
+           "meta": meta}
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f, zipfile.ZipFile(f, "w", zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for k, src in files.items():
+            zi = _member(k, f.tell())
+            h.update(f"{k}:{dtypes[k].str}:{(n,)}\n".encode())
+            with zf.open(zi, "w", force_zip64=True) as fh:
+                hdr = {"descr": np.lib.format.dtype_to_descr(dtypes[k]), "fortran_order": False, "shape": (n,)}
+                np.lib.format.write_array_header_1_0(fh, hdr)
+                src.seek(0)
+                for b in iter(lambda: src.read(block), b""):
+                    fh.write(b); h.update(b)
+        man["sha256"] = h.hexdigest()
+        zf.writestr(zipfile.ZipInfo(MANIFEST, date_time=(1980, 1, 1, 0, 0, 0)), json.dumps(man, indent=1))
+    os.replace(tmp, path)
+    return man["sha256"]
+
+def manifest(path):
+    with zipfile.ZipFile(path) as zf:
+        return json.loads(zf.read(MANIFEST))
+
+def _read_npz(path, mmap=True):
+    with zipfile.ZipFile(path) as zf:
+        man = json.loads(zf.read(MANIFEST))
+        infos = {zi.filename: zi for zi in zf.infolist()}
+    out = {}
+    with open(path, "rb") as f:
+        for c in man["columns"]:
+            zi = infos[c["name"] + ".npy"]
+            f.seek(zi.header_offset + 26)
+            n, m = struct.unpack("<HH", f.read(4))
+            f.seek(zi.header_offset + 30 + n + m)
+            version = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, fortran, dtype = read_header(f)
+            if mmap and zi.compress_type == zipfile.ZIP_STORED and int(np.prod(shape)) > 0:
+                out[c["name"]] = np.memmap(path, dtype=dtype, mode="r", offset=f.tell(), shape=shape,
+                                           order="F" if fortran else "C")
+            else:
+                with np.load(path) as z: out[c["name"]] = z[c["name"]]
+    return out, man
+
+def read(path, mmap=True):
+    # DataFrame sulle colonne (per .npz mappate in memoria, senza copie); CSV round-trip esatto
+    if path.endswith(".npz"):
+        cols, _ = _read_npz(path, mmap)
+        return pd.DataFrame(cols, copy=False)
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        t = pq.read_table(path, memory_map=mmap)
+        return pd.DataFrame({k: t.column(k).to_numpy() for k in t.column_names}, copy=False)
+    return pd.read_csv(path, float_precision="round_trip")
+
+def rows(path):
+    # numero di righe senza caricare le colonne (.npz: dal manifest)
+    if path.endswith(".npz"):
+        return int(manifest(path)["rows"])
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        return int(pq.ParquetFile(path).metadata.num_rows)
+    return len(pd.read_csv(path))
+
+def table_hash(path, verify=True):
+    # hash colonnare; per .npz verify=False si fida del manifest (nessuna lettura delle colonne)
+    if path.endswith(".npz") and not verify:
+        return manifest(path)["sha256"]
+    return columns_hash(_columns(read(path)))
+
+def find(stem, exts=(".npz", ".parquet", ".csv")):
+    # primo file esistente tra stem.npz, stem.parquet, stem.csv
+    for e in exts:
+        if os.path.exists(stem + e): return stem + e
+    return None
+
+if __name__ == "__main__":
+    # conversione tra formati e verifica dell'hash: ctable.py in.{csv,npz,parquet} [out.{csv,npz,parquet}]
+    if len(sys.argv) < 2:
+        print("usage: ctable.py in.{csv,npz,parquet} [out.{csv,npz,parquet}]"); sys.exit(2)
+    t = read(sys.argv[1])
+    if len(sys.argv) > 2:
+        h = write(sys.argv[2], t)
+        print(f"TABLE: {sys.argv[1]} -> {sys.argv[2]} rows={len(t)} sha256={h}")
+    else:
+        h = columns_hash(_columns(t))
+        ok = "" if not sys.argv[1].endswith(".npz") else f" manifest={'OK' if manifest(sys.argv[1])['sha256'] == h else 'MISMATCH'}"
+        print(f"TABLE: {sys.argv[1]} rows={len(t)} cols={list(t.columns)} sha256={h}{ok}")
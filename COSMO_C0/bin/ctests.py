@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# Test severi di C_fit sui residui standardizzati, vettoriali: res (M, N), un vettore di
+# residui per riga (modelli, realizzazioni MC, permutazioni). Runs via np.diff sui segni,
+# bin via np.searchsorted/np.bincount (somme per bin su fette contigue), KS con kstest
+# lungo l'asse, Spearman con i ranghi di z calcolati una volta.
+# Calibrazione dei p-value: Monte Carlo sotto l'ipotesi nulla (residui N(0,1) con l'offset
+# marginalizzato rimosso, come in sne_marginalized) oppure permutazioni dei residui
+# osservati; blocchi a seme fisso su process pool, risultato indipendente dai worker.
+from concurrent.futures import ProcessPoolExecutor
+from math import erf
+import numpy as np
+from scipy.special import ndtr
+from scipy.stats import kstest, kstwo, rankdata, t as student_t
+
+CHUNKS = 16      # blocchi a seme fisso (SeedSequence.spawn)
+BLOCK = 2048     # righe per passo vettoriale dentro un blocco
+NBINS = 6
+ALPHA = 0.01     # soglia dei p-value nella regola PASS di C_fit
+
+def runs_p(signs):
+    # runs test a due code per riga; zeri esclusi (righe con zeri trattate a parte)
+    s = np.sign(np.atleast_2d(signs))
+    p = np.empty(s.shape[0])
+    zero = np.any(s == 0, axis=1)
+    if np.any(~zero): p[~zero] = _runs_p(s[~zero])
+    for k in np.nonzero(zero)[0]:
+        sk = s[k][s[k] != 0]
+        p[k] = _runs_p(sk[None,:])[0] if sk.size else 1.0
+    return p
+
+def runs_z(signs):
+    # statistica |z| dei runs (senza zeri), per la calibrazione
+    s = np.sign(np.atleast_2d(signs))
+    return np.abs(_runs_stats(s)[0])
+
+def _runs_stats(s):
+    # conteggi in float64: interi esatti fino a ~1e15, niente overflow per N grandi
+    n1 = np.sum(s > 0, axis=1).astype(float); n2 = np.sum(s < 0, axis=1).astype(float); N = n1 + n2
+    R = 1 + np.count_nonzero(np.diff(s, axis=1), axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mu = 2*n1*n2/N + 1
+        var = (2*n1*n2*(2*n1*n2 - n1 - n2))/((N**2)*(N-1.0))
+        z = (R - mu)/np.sqrt(var)
+    return np.where(var > 0, z, 0.0), n1, n2, var
+
+def _runs_p(s):
+    z, n1, n2, var = _runs_stats(s)
+    # math.erf elemento per elemento (M chiamate): stessi bit del runs test scalare storico
+    p = np.clip(2*0.5*(1 - np.frompyfunc(erf, 1, 1)(np.abs(z)/np.sqrt(2)).astype(float)), 0.0, 1.0)
+    p = np.where(var > 0, p, 1.0)
+    p = np.where((n1 == 0) | (n2 == 0), 0.0, p)
+    return np.where(s.shape[1] < 2, 1.0, p)
+
+def z_bins(z, nbins=NBINS):
+    # bin a quantili di z (come bin_uniformity_z): ordine stabile per bin e conteggi
+    edges = np.quantile(z, np.linspace(0,1,nbins+1))
+    b = np.searchsorted(edges[1:-1], z, side="right")
+    dof = np.bincount(b, minlength=nbins)
+    return {"order": np.argsort(b, kind="stable"), "starts": np.concatenate(([0], np.cumsum(dof))), "dof": dof}
+
+def bin_zscores(res, bins):
+    # z-score (sum e^2 - dof)/sqrt(2 dof) per bin e riga; bin con meno di 5 punti -> nan
+    R2 = np.atleast_2d(res)[:, bins["order"]]**2
+    st, dof = bins["starts"], bins["dof"]
+    S = np.stack([np.sum(R2[:, st[k]:st[k+1]], axis=1) for k in range(dof.size)], axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(dof >= 5, (S - dof)/np.sqrt(2*dof), np.nan)
+
+def bin_uniformity(res, bins):
+    zs = bin_zscores(res, bins)
+    a = np.where(np.isnan(zs), 0.0, np.abs(zs))
+    k = np.argmax(a, axis=1)
+    worst = np.where(a[np.arange(a.shape[0]), k] > 0, zs[np.arange(zs.shape[0]), k], 0.0)
+    return np.all(a <= 3.0, axis=1), worst, np.where(a.max(axis=1) > 0, k, -1)
+
+def ranks(x):
+    # ranghi per riga; senza pareggi (residui continui) bastano gli argsort, con pareggi
+    # ranghi medi come rankdata
+    o = np.argsort(x, axis=1)
+    if np.any(np.diff(np.take_along_axis(x, o, axis=1), axis=1) == 0):
+        return rankdata(x, axis=1)
+    r = np.empty(x.shape)
+    np.put_along_axis(r, o, np.arange(1.0, x.shape[1] + 1), axis=1)
+    return r
+
+def ks_stat(res):
+    # statistica D di Kolmogorov-Smirnov contro N(0,1) (= kstest(...).statistic, senza p esatto)
+    n = res.shape[1]; c = ndtr(np.sort(res, axis=1)); i = np.arange(1, n+1)
+    return np.maximum((i/n - c).max(axis=1), (c - (i-1)/n).max(axis=1))
+
+def centered_ranks(z):
+    rz = rankdata(z); return rz - rz.mean()
+
+def spearman(res, rz):
+    # rho di Spearman tra ogni riga e z (ranghi di z gia' centrati), p-value come spearmanr
+    n = rz.size
+    rr = ranks(np.atleast_2d(res)); rr = rr - rr.mean(axis=1, keepdims=True)
+    rho = (rr @ rz)/np.sqrt(np.sum(rr*rr, axis=1)*np.sum(rz*rz))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = rho*np.sqrt((n-2)/((1.0-rho)*(1.0+rho)))
+    return rho, 2*student_t.sf(np.abs(t), n-2)
+
+def hard_tests(res, z, bins=None, rz=None):
+    # i quattro test di C_fit per riga (chiavi come nel report)
+    res = np.atleast_2d(res)
+    if bins is None: bins = z_bins(z)
+    if rz is None: rz = centered_ranks(z)
+    ks_p = kstest(res, cdf='norm', axis=1).pvalue
+    rho, sp_p = spearman(res, rz)
+    ok_bins, worst, _ = bin_uniformity(res, bins)
+    return {"SNe_KS_p": ks_p, "SNe_Runs_p": runs_p(res),
+            "SNe_Spearman_rho": rho, "SNe_Spearman_p": sp_p,
+            "SNe_BinUniform_ok": ok_bins, "SNe_BinUniform_worst_zscore": worst}
+
+def ks_ok(D, n, alpha=ALPHA):
+    # kstest(..., cdf='norm').pvalue >= alpha senza kstwo.sf riga per riga (lento per n grande).
+    # kstest a un campione con method='auto' usa sempre la distribuzione esatta,
+    # p = kstwo.sf(D, n), per ogni n (il passaggio all'asintotico oltre n = 10000 e' di
+    # ks_2samp); p decresce in D, quindi p >= alpha <=> D <= kstwo.isf(alpha, n). La soglia
+    # viene da un'inversione numerica: le righe entro 1e-8 relativo da essa usano kstwo.sf
+    c = kstwo.isf(alpha, n)
+    ok = D <= c
+    near = np.abs(D - c) <= 1e-8*c
+    if near.any(): ok[near] = kstwo.sf(D[near], n) >= alpha
+    return ok
+
+def pass_flags(res, z=None, bins=None, rz=None, alpha=ALPHA):
+    # esiti dei quattro test (p >= alpha, bin entro 3 sigma) senza i p-value KS esatti riga
+    # per riga (ks_ok); per simulazioni su molte righe
+    res = np.atleast_2d(res)
+    if bins is None: bins = z_bins(z)
+    if rz is None: rz = centered_ranks(z)
+    return {"SNe_KS_ok": ks_ok(ks_stat(res), res.shape[1], alpha),
+            "SNe_Runs_ok": runs_p(res) >= alpha,
+            "SNe_Spearman_ok": spearman(res, rz)[1] >= alpha,
+            "SNe_BinUniform_ok": bin_uniformity(res, bins)[0]}
+
+# ===== calibrazione =====
+STATS = ("KS", "Runs", "Spearman", "BinUniform")
+
+def statistics(res, bins, rz, order_only=False):
+    # statistiche dei test (piu' grande = piu' estremo); order_only: solo quelle che
+    # dipendono dall'ordine dei residui (le permutazioni lasciano invariata la KS)
+    res = np.atleast_2d(res)
+    out = {"Runs": runs_z(res), "Spearman": np.abs(spearman(res, rz)[0]),
+           "BinUniform": np.nanmax(np.abs(bin_zscores(res, bins)), axis=1, initial=0.0)}
+    if not order_only:
+        out["KS"] = ks_stat(res)
+    return out
+
+def project(x, e):
+    # toglie l'offset marginalizzato: x - (x.e/e.e) e (e = 1/sigma, o L^{-1} 1 con covarianza)
+    return x - np.multiply.outer((x @ e)/(e @ e), e)
+
+def _null_chunk(e, bins, rz, seq, n):
+    rng = np.random.default_rng(seq)
+    parts = []
+    for a in range(0, n, BLOCK):
+        x = rng.standard_normal((min(BLOCK, n - a), e.size))
+        parts.append(statistics(project(x, e), bins, rz))
+    return {k: np.concatenate([p[k] for p in parts]) if parts else np.empty(0) for k in STATS}
+
+def _perm_chunk(r, bins, rz, seq, n):
+    rng = np.random.default_rng(seq)
+    parts = []
+    for a in range(0, n, BLOCK):
+        x = rng.permuted(np.broadcast_to(r, (min(BLOCK, n - a), r.size)), axis=1)
+        parts.append(statistics(x, bins, rz, order_only=True))
+    return {k: np.concatenate([p[k] for p in parts]) if parts else np.empty(0) for k in STATS[1:]}
+
+def _pool(fn, args, workers):
+    if workers <= 1:
+        return [fn(*a) for a in args]
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        # molti task piccoli (permutazioni: CHUNKS per riga): pochi invii per worker
+        return list(ex.map(fn, *zip(*args), chunksize=max(1, len(args)//(4*workers))))
+
+def _split(B, seed):
+    seeds = np.random.SeedSequence(seed).spawn(CHUNKS)
+    return seeds, [B//CHUNKS + (1 if c < B % CHUNKS else 0) for c in range(CHUNKS)]
+
+def mc_null(e, z, B, seed=0, workers=1, bins=None, rz=None):
+    # distribuzione nulla (ordinata) di ciascuna statistica da B realizzazioni
+    if bins is None: bins = z_bins(z)
+    if rz is None: rz = centered_ranks(z)
+    seeds, sizes = _split(B, seed)
+    parts = _pool(_null_chunk, [(np.asarray(e, float), bins, rz, s, n) for s,n in zip(seeds, sizes)], workers)
+    return {k: np.sort(np.concatenate([p[k] for p in parts])) for k in STATS}
+
+def empirical_p(obs, null):
+    # p = (1 + #{T_null >= T_obs})/(B + 1), per riga
+    return (1.0 + null.size - np.searchsorted(null, obs, side="left"))/(null.size + 1.0)
+
+def mc_pvalues(res, z, null, bins=None, rz=None):
+    if bins is None: bins = z_bins(z)
+    if rz is None: rz = centered_ranks(z)
+    st = statistics(res, bins, rz)
+    return {f"SNe_{k}_p_mc": empirical_p(st[k], null[k]) for k in STATS}
+
+def permutation_pvalues(res, z, B, seed=0, workers=1, bins=None, rz=None):
+    # p-value condizionati per permutazione dei residui di ogni riga (test d'ordine)
+    res = np.atleast_2d(res)
+    if bins is None: bins = z_bins(z)
+    if rz is None: rz = centered_ranks(z)
+    st = statistics(res, bins, rz, order_only=True)
+    out = {f"SNe_{k}_p_perm": np.empty(res.shape[0]) for k in STATS[1:]}
+    # un solo pool per tutte le righe: CHUNKS blocchi per riga, seme [seed, m] per riga
+    tasks = []
+    for m, r in enumerate(res):
+        seeds, sizes = _split(B, [seed, m])
+        tasks += [(r, bins, rz, s, n) for s,n in zip(seeds, sizes)]
+    parts = _pool(_perm_chunk, tasks, workers)
+    for m in range(res.shape[0]):
+        pm = parts[m*CHUNKS:(m+1)*CHUNKS]
+        for k in STATS[1:]:
+            null = np.sort(np.concatenate([p[k] for p in pm]))
+            out[f"SNe_{k}_p_perm"][m] = empirical_p(st[k][m:m+1], null)[0]
+    return out
+
+def calibrate(res, z, e, opts, bins=None, rz=None, null=None):
+    # opts (config "calibrate"): {"method": "mc"|"perm", "B": 2000, "seed": 0, "workers": 1}
+    # null: distribuzione MC gia' calcolata (riusata su molti modelli con gli stessi dati)
+    method, B = opts.get("method", "mc"), int(opts.get("B", 2000))
+    seed, workers = int(opts.get("seed", 0)), int(opts.get("workers", 1))
+    if method == "perm":
+        return permutation_pvalues(res, z, B, seed, workers, bins, rz)
+    if null is None: null = mc_null(e, z, B, seed, workers, bins, rz)
+    return mc_pvalues(res, z, null, bins, rz)
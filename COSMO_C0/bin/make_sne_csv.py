@@ -1,18 +1,141 @@
 #!/usr/bin/env python3
-import re, pandas as pd
-rows=[]
-with open("data/Union2_1_mu_vs_z.txt","r") as f:
-    for line in f:
-        s=line.strip()
+# Catalogo SNe (Union2.1: nome z mu sigma [...], oppure z mu sigma) -> tabella ordinata per z
+# con cov_idx = indice della riga dati nel catalogo, contando anche le righe scartate
+# (righe/colonne della covarianza piena del catalogo, vedi ccov.sne_factor).
+# Lettura a blocchi di --chunk righe: token con str.split, conversione vettoriale NumPy,
+# righe scartate (campi mancanti, valori non numerici o non finiti) contate con il numero di
+# riga nel sidecar JSON. Ogni blocco e' ordinato; se l'input supera un blocco i blocchi
+# ordinati vanno su disco (run .npy) e si fondono per z a memoria limitata (merge esterno).
+# Uscita dall'estensione: .csv (default storico) o .npz colonnare (ctable, mappabile).
+import argparse, itertools, json, os, shutil, tempfile
+import numpy as np
+import ctable
+
+COLS = ("z", "mu", "sigma_mu", "cov_idx")
+DTYPE = np.dtype([("z", "<f8"), ("mu", "<f8"), ("sigma_mu", "<f8"), ("cov_idx", "<i8")])
+MAX_LINES = 100000  # numeri di riga registrati per motivo di scarto
+
+class Rejects:
+    def __init__(self):
+        self.count, self.lines = {}, {}
+
+    def add(self, reason, lineno):
+        self.count[reason] = self.count.get(reason, 0) + len(lineno)
+        kept = self.lines.setdefault(reason, [])
+        kept.extend(int(n) for n in lineno[:max(0, MAX_LINES - len(kept))])
+
+    def report(self):
+        return {"rejected": sum(self.count.values()), "by_reason": self.count,
+                "reject_lines": self.lines, "reject_lines_truncated": {k: self.count[k] > len(v) for k,v in self.lines.items()}}
+
+def parse_block(lines, first, base, rej):
+    # lines: righe grezze; first: numero (1-based) della prima; base: righe dati precedenti
+    # -> (righe accettate con cov_idx, righe dati nel blocco, commenti/vuote)
+    fields, where, idx, skipped, n_data = [], [], [], 0, 0
+    for i, line in enumerate(lines):
+        s = line.strip()
         if not s or s.startswith(('#','%','//')):
-            continue
-        parts=re.split(r'\s+', s)
-        try:
-            if len(parts)>=4:
-                z=float(parts[1]); mu=float(parts[2]); sig=float(parts[3])
-            else:
-                z=float(parts[0]); mu=float(parts[1]); sig=float(parts[2])
-            rows.append((z,mu,sig))
-        except Exception:
-            pass
-pd.DataFrame(rows, columns=["z","mu","sigma_mu"]).sort_values("z").to_csv("data/sne.csv", index=False)
+            skipped += 1; continue
+        parts = s.split(); k = base + n_data; n_data += 1
+        if len(parts) >= 4: fields.append(parts[1:4])
+        elif len(parts) == 3: fields.append(parts)
+        else:
+            rej.add("campi", [first + i]); continue
+        where.append(first + i); idx.append(k)
+    where, idx = np.array(where, dtype=np.int64), np.array(idx, dtype=np.int64)
+    if not fields:
+        return np.empty(0, DTYPE), n_data, skipped
+    raw = np.array(fields, dtype=object)  # float() per elemento, senza copia unicode
+    try:
+        v = raw.astype(float)
+    except ValueError:
+        # blocco con valori non numerici: conversione riga per riga per trovarli
+        v = np.full(raw.shape, np.nan); bad = np.zeros(raw.shape[0], dtype=bool)
+        for i, r in enumerate(fields):
+            try: v[i] = [float(x) for x in r]
+            except ValueError: bad[i] = True
+        rej.add("valore", where[bad])
+        v, where, idx = v[~bad], where[~bad], idx[~bad]
+    fin = np.all(np.isfinite(v), axis=1)
+    if not fin.all(): rej.add("non_finito", where[~fin])
+    out = np.empty(int(fin.sum()), DTYPE)
+    out["z"], out["mu"], out["sigma_mu"] = v[fin].T
+    out["cov_idx"] = idx[fin]
+    return out, n_data, skipped
+
+def sort_block(b):
+    # per z; a parita' di z resta l'ordine del catalogo (cov_idx), chiave unica per il merge
+    return b[np.lexsort((b["cov_idx"], b["z"]))]
+
+def _le(b, key):
+    # righe con (z, cov_idx) <= key
+    return (b["z"] < key["z"]) | ((b["z"] == key["z"]) & (b["cov_idx"] <= key["cov_idx"]))
+
+def merge_runs(paths, sink, block):
+    # fusione a k vie di run ordinati (memmap): per ogni run si tiene in memoria un blocco;
+    # si emettono le righe fino alla minima "frontiera" (ultima chiave caricata) tra i run
+    # non esauriti e si ricarica solo il run che la detiene -> memoria <= k*block righe
+    runs = [np.load(p, mmap_mode="r") for p in paths]
+    pos = [0]*len(runs)
+    pool, front = [], [None]*len(runs)
+    def load(r):
+        a = np.array(runs[r][pos[r]:pos[r]+block]); pos[r] += a.size
+        pool.append(a)
+        front[r] = a[-1] if pos[r] < runs[r].size else None
+    for r in range(len(runs)): load(r)
+    while True:
+        P = sort_block(np.concatenate(pool))
+        live = [r for r in range(len(runs)) if front[r] is not None]
+        if not live:
+            sink(P); return
+        t = min((front[r] for r in live), key=lambda k: (k["z"], k["cov_idx"]))
+        m = _le(P, t)
+        sink(P[m]); pool = [P[~m]]
+        for r in live:
+            if front[r]["z"] == t["z"] and front[r]["cov_idx"] == t["cov_idx"]: load(r)
+
+def build(src, out, chunk=250_000, rejects=None, tmpdir=None):
+    rej = Rejects()
+    n_lines = n_data = n_skip = n_ok = 0
+    runs, single, work = [], None, None
+    with open(src, "r") as f:
+        while True:
+            lines = list(itertools.islice(f, chunk))
+            if not lines: break
+            b, n, skipped = parse_block(lines, n_lines + 1, n_data, rej)
+            n_lines += len(lines); n_data += n; n_skip += skipped; n_ok += b.size
+            if not b.size: continue
+            b = sort_block(b)
+            if single is None and not runs:
+                single = b; continue
+            if work is None: work = tempfile.mkdtemp(prefix="sne_runs_", dir=tmpdir)
+            for x in ([single] if single is not None else []) + [b]:
+                p = os.path.join(work, f"run{len(runs):05d}.npy"); np.save(p, x); runs.append(p)
+            single = None
+    w = ctable.Writer(out, {"source": os.path.basename(src)})
+    sink = lambda a: w.append({k: a[k] for k in COLS}) if a.size else None
+    try:
+        if runs: merge_runs(runs, sink, max(1, chunk // max(1, len(runs))))
+        else: w.append({k: (single if single is not None else np.empty(0, DTYPE))[k] for k in COLS})
+        digest = w.close()
+    finally:
+        if work: shutil.rmtree(work, ignore_errors=True)
+    rep = {"input": src, "output": out, "lines": n_lines, "data_lines": n_data, "comments_or_blank": n_skip,
+           "accepted": n_ok, "runs": len(runs), "sha256": digest, **rej.report()}
+    if rejects:
+        with open(rejects, "w") as f: json.dump(rep, f, indent=2)
+    return rep
+
+def main():
+    ap = argparse.ArgumentParser(usage="make_sne_csv.py [catalogo.txt] [out.{csv,npz}] [opzioni]")
+    ap.add_argument("src", nargs="?", default="data/Union2_1_mu_vs_z.txt")
+    ap.add_argument("out", nargs="?", default="data/sne.csv")
+    ap.add_argument("--chunk", type=int, default=250_000, help="righe per blocco (memoria limitata)")
+    ap.add_argument("--rejects", default=None, help="sidecar JSON degli scarti (default: <out>.rejects.json)")
+    ap.add_argument("--tmp", default=None, help="cartella per i run del merge esterno")
+    a = ap.parse_args()
+    rep = build(a.src, a.out, a.chunk, a.rejects or os.path.splitext(a.out)[0] + ".rejects.json", a.tmp)
+    print(f"SNE: {rep['accepted']} righe -> {a.out} | scartate {rep['rejected']} {rep['by_reason']} | run {rep['runs']}")
+
+if __name__ == "__main__":
+    main()
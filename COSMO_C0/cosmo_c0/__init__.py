@@ -0,0 +1,8 @@
+# COSMO_C0 come pacchetto: gli script di bin/ restano eseguibili da soli,
+# qui vengono resi importabili come libreria (stadi in memoria).
+import os, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_p = os.path.join(ROOT, "bin")
+if _p not in sys.path:
+    sys.path.insert(0, _p)
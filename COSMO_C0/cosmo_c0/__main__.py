@@ -0,0 +1,19 @@
+import argparse, sys
+from . import pipeline, scan, simulate
+
+def main():
+    ap = argparse.ArgumentParser(prog="python -m cosmo_c0", description="COSMO_C0 C_obs + C_fit + SEAL")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    pipeline.add_arguments(sub.add_parser("run", help="catena completa in memoria, artefatti e SEAL alla fine"))
+    scan.add_arguments(sub.add_parser("scan", help="C_fit vettoriale su griglie di modelli, sink CSV/Parquet a blocchi"))
+    simulate.add_arguments(sub.add_parser("simulate", help="taglia empirica della regola PASS (Monte Carlo sotto il modello)"))
+    args = ap.parse_args()
+    if args.cmd == "run":
+        sys.exit(pipeline.run(args))
+    if args.cmd == "scan":
+        sys.exit(scan.run(args))
+    if args.cmd == "simulate":
+        sys.exit(simulate.run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Catena C_obs/C_fit in un solo processo: cobs_hz -> cobs_distances -> cfit -> cseal
+# passano array NumPy in memoria; gli artefatti sono serializzati una volta alla fine,
+# con lo sha256 calcolato sugli stessi byte scritti (nessuna rilettura da disco).
+# H_curve.csv coincide con quello di cobs_hz.py; distanze e fit possono differire
+# dalla catena di script nell'ultimo ulp, perche' qui H non ripassa dal testo CSV.
+# --zgrid adaptive: H(z) da cobs_hz.HModel su una griglia non uniforme (adaptive_grid)
+# piu' i redshift dei dati come nodi; con --engine gl distanze e fit non dipendono
+# dalla spaziatura della griglia.
+# --format npz|parquet: tabelle colonnari (ctable); SEAL.json riporta anche l'hash
+# colonnare canonico delle tabelle, uguale tra CSV e formati binari.
+import hashlib, json, os
+import numpy as np
+import pandas as pd
+import cobs_hz, cobs_distances, cfit, cseal, ctable
+
+def run_stages(lam, eps, cfg, engine="trapz", tol=1e-12, grid="fixed", grid_tol=1e-7):
+    data = cfit.load_data(cfg)
+    if grid == "adaptive":
+        model = cobs_hz.HModel(lam["H_L_SI"], eps)
+        zd = cfit.data_redshifts(data)
+        z = model.adaptive_grid(max(2.5, float(zd.max()) if zd.size else 0.0), grid_tol)
+        Htab = model.table(np.union1d(z, zd))
+    else:
+        Htab = cobs_hz.H_arrays(lam["H_L_SI"], eps)
+    dist, obs = cobs_distances.c_obs(Htab["z"], Htab["H_km_s_Mpc"], eps, engine, tol)
+    fit = cfit.c_fit(Htab, dist, data)
+    return {"H_curve": Htab, "distances": dist, "C_obs": obs, "C_fit": fit, "data": data}
+
+def csv_bytes(cols):
+    return pd.DataFrame(cols).to_csv(index=False).encode()
+
+def json_bytes(obj):
+    return json.dumps(obj, indent=2).encode()
+
+def write_artifacts(res, out, fmt="csv"):
+    # fmt: "csv" (testo) oppure "npz"/"parquet" colonnari (ctable) per H_curve e distances
+    os.makedirs(out, exist_ok=True)
+    hashes, table_hashes = {}, {}
+    for name in ("H_curve", "distances"):
+        p = os.path.join(out, f"{name}.{fmt}")
+        if fmt == "csv":
+            b = csv_bytes(res[name])
+            with open(p, "wb") as f: f.write(b)
+            hashes[p] = hashlib.sha256(b).hexdigest()
+            table_hashes[p] = ctable.columns_hash(res[name])
+        else:
+            table_hashes[p] = ctable.write(p, res[name])
+            hashes[p] = cseal.sha256(p)
+    for name, b in [("C_obs_report.json", json_bytes(res["C_obs"])), ("C_fit_report.json", json_bytes(res["C_fit"]))]:
+        p = os.path.join(out, name)
+        with open(p, "wb") as f: f.write(b)
+        hashes[p] = hashlib.sha256(b).hexdigest()
+    sne = res["data"].get("sne")
+    s = cseal.seal(res["C_obs"], res["C_fit"], len(sne) if sne is not None else 0, hashes, table_hashes)
+    with open(os.path.join(out, "SEAL.json"), "w") as f: json.dump(s, f, indent=2)
+    return s
+
+def add_arguments(ap):
+    ap.add_argument("--lambda4", default="cert/cosmo/Lambda4.json")
+    ap.add_argument("--matter", default="cert/obs/matter_EH.json")
+    ap.add_argument("--config", default="cert/obs/cfit_config.json")
+    ap.add_argument("--out", default="artifacts", help="cartella degli artefatti (H_curve, distances, report, SEAL)")
+    ap.add_argument("--engine", choices=["trapz","simpson","spline","gl"], default="trapz",
+                    help="motore delle distanze (vedi cobs_distances.py)")
+    ap.add_argument("--tol", type=float, default=1e-12)
+    ap.add_argument("--format", choices=["csv","npz","parquet"], default="csv",
+                    help="tabelle H_curve/distances: CSV leggibile o colonnari mappabili (ctable)")
+    ap.add_argument("--zgrid", choices=["fixed","adaptive"], default="fixed",
+                    help="fixed: linspace(0, 2.5, 2001) storica; adaptive: HModel.adaptive_grid + z dei dati")
+    ap.add_argument("--zgrid-tol", type=float, default=1e-7, help="errore relativo di interpolazione di H (adaptive)")
+
+def run(a):
+    load = cobs_hz.load_json
+    res = run_stages(load(a.lambda4), load(a.matter), load(a.config), a.engine, a.tol, a.zgrid, a.zgrid_tol)
+    print(f"H0_km_s_Mpc={float(res['H_curve']['H_km_s_Mpc'][0]):.6f}")
+    print(f"C_OBS: PASS_ETHERINGTON={res['C_obs']['PASS_ETHERINGTON']} PASS_LOWZ={res['C_obs']['PASS_LOWZ']}")
+    print(cfit.summary(res["C_fit"]))
+    s = write_artifacts(res, a.out, a.format)
+    print(cseal.summary(s))
+    return 0
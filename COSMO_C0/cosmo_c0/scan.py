@@ -0,0 +1,109 @@
+# Scansione di C_fit su molti modelli (H_L_SI, epsilon_rad, epsilon_mat, epsilon_curv):
+# i dataset si leggono e si preparano (cfit.Prepared sulla griglia z) una volta,
+# i modelli vanno a blocchi di `chunk` righe: H(z), distanze e C_fit (chi2 + test severi)
+# in un passo vettoriale per blocco. Ogni blocco e' scritto subito (CSV e/o Parquet).
+import itertools, json, os, time
+import numpy as np
+import pandas as pd
+import cobs_hz, cobs_distances, cfit
+
+AXES = ("H_L_SI", "epsilon_rad", "epsilon_mat", "epsilon_curv")
+
+def axis_values(v):
+    # valore, lista di valori o {"linspace": [a, b, n]}
+    if isinstance(v, dict): return list(np.linspace(*v["linspace"][:2], int(v["linspace"][2])))
+    return v if isinstance(v, list) else [v]
+
+def expand_grid(spec, base):
+    # base: valori di Lambda4.json/matter_EH.json per gli assi non scansionati
+    unknown = set(spec) - set(AXES)
+    if unknown: raise ValueError(f"chiavi sconosciute nella griglia: {sorted(unknown)}")
+    axes = [axis_values(spec.get(k, base[k])) for k in AXES]
+    P = np.array(list(itertools.product(*axes)), dtype=float).reshape(-1, len(AXES))
+    return {k: P[:,i] for i,k in enumerate(AXES)}
+
+def score_chunk(P, z, prep):
+    eps = {k: P[k][:,None] for k in AXES[1:]}
+    H = cobs_hz.H_arrays(P["H_L_SI"][:,None], eps, z)["H_km_s_Mpc"]
+    Ok = P["epsilon_curv"]/(P["epsilon_rad"] + P["epsilon_mat"] + P["epsilon_curv"] + 1.0)
+    dist = cobs_distances.distances_batch(z, H, Ok)
+    cols = prep.fit(H, dist)
+    return pd.DataFrame({**P, "H0_km_s_Mpc": H[:,0], **cols})
+
+class Sink:
+    # CSV in append; Parquet a row group per blocco (pyarrow), se disponibile
+    def __init__(self, out_csv, parquet=None, log=print):
+        self.out_csv, self.parquet, self.first, self.writer, self.pa = out_csv, parquet, True, None, None
+        if parquet:
+            try:
+                import pyarrow, pyarrow.parquet  # noqa: F401  (motore Parquet)
+                self.pa = pyarrow
+            except ImportError:
+                log("[SCAN] pyarrow non disponibile: Parquet non scritto (resta il CSV)")
+
+    def write(self, df):
+        if self.out_csv:
+            df.to_csv(self.out_csv, mode="w" if self.first else "a", header=self.first, index=False)
+        if self.pa is not None:
+            t = self.pa.Table.from_pandas(df, preserve_index=False)
+            if self.writer is None: self.writer = self.pa.parquet.ParquetWriter(self.parquet, t.schema)
+            self.writer.write_table(t)
+        self.first = False
+
+    def close(self):
+        if self.writer is not None: self.writer.close()
+
+def scan_grid(base, data, grid="fixed", grid_tol=1e-7):
+    # fixed: griglia storica di cobs_hz; adaptive: HModel.adaptive_grid del modello base
+    # piu' i redshift dei dati come nodi (comune a tutti i modelli del blocco)
+    if grid != "adaptive":
+        return np.linspace(0.0, 2.5, 2001)
+    zd = cfit.data_redshifts(data)
+    z = cobs_hz.HModel(base["H_L_SI"], base).adaptive_grid(max(2.5, float(zd.max()) if zd.size else 0.0), grid_tol)
+    return np.union1d(z, zd)
+
+def run_scan(spec, base, cfg, out_csv, parquet=None, chunk=512, log=print, grid="fixed", grid_tol=1e-7):
+    data = cfit.load_data(cfg)
+    z = scan_grid(base, data, grid, grid_tol)
+    prep = cfit.Prepared(data, z)
+    P = expand_grid(spec, base)
+    M = P["H_L_SI"].size
+    log(f"[SCAN] modelli: {M} | blocchi da {chunk} | griglia {grid} ({z.size} punti)")
+    sink = Sink(out_csv, parquet, log)
+    n_pass, best = 0, None
+    t0 = time.perf_counter()
+    try:
+        for a in range(0, M, chunk):
+            df = score_chunk({k: v[a:a+chunk] for k,v in P.items()}, z, prep)
+            sink.write(df)
+            n_pass += int(df["PASS"].sum())
+            i = df["chi2_total"].idxmin()
+            if best is None or df.at[i, "chi2_total"] < best["chi2_total"]:
+                best = {k: (v.item() if hasattr(v, "item") else v) for k,v in df.loc[i].items()}
+            log(f"[SCAN] {min(a+chunk, M)}/{M}  PASS {n_pass}  {time.perf_counter()-t0:.2f} s")
+    finally:
+        sink.close()
+    summary = {"models": M, "pass": n_pass, "fail": M - n_pass, "best": best}
+    if out_csv:
+        with open(os.path.splitext(out_csv)[0] + ".summary.json", "w") as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+def add_arguments(ap):
+    ap.add_argument("grid", help="JSON: chiavi tra " + ", ".join(AXES) + " (valore, lista o {\"linspace\": [a, b, n]})")
+    ap.add_argument("--lambda4", default="cert/cosmo/Lambda4.json")
+    ap.add_argument("--matter", default="cert/obs/matter_EH.json")
+    ap.add_argument("--config", default="cert/obs/cfit_config.json")
+    ap.add_argument("--out", default="scan_cfit.csv", help="sink CSV ('' per solo Parquet)")
+    ap.add_argument("--parquet", default=None, help="sink Parquet a row group per blocco (richiede pyarrow)")
+    ap.add_argument("--chunk", type=int, default=512, help="modelli per passo vettoriale")
+    ap.add_argument("--zgrid", choices=["fixed","adaptive"], default="fixed")
+    ap.add_argument("--zgrid-tol", type=float, default=1e-7)
+
+def run(a):
+    with open(a.grid) as f: spec = json.load(f)
+    base = {**cobs_hz.load_json(a.lambda4), **cobs_hz.load_json(a.matter)}
+    summary = run_scan(spec, base, cobs_hz.load_json(a.config), a.out or None, a.parquet, a.chunk,
+                       grid=a.zgrid, grid_tol=a.zgrid_tol)
+    print(f"[SCAN] PASS {summary['pass']}/{summary['models']}  best chi2={summary['best']['chi2_total']:.6g}")
+    return 0
@@ -0,0 +1,115 @@
+# Taglia empirica della regola PASS di C_fit (chi2_red <= 1, KS/runs/Spearman p >= 0.01,
+# uniformita' per bin): realizzazioni sintetiche di SNe, BAO e H0 generate dal modello
+# stesso (ipotesi nulla vera), con errori diagonali o con la covarianza piena del config
+# (fattori di Cholesky di ccov), valutate da cfit.Prepared.fit come il fit vero:
+# chi2 marginalizzato sull'offset e test severi vettoriali (ctests.pass_flags).
+# Blocchi a seme fisso (SeedSequence, come ctests) su process pool: il risultato non
+# dipende dal numero di worker; in memoria solo conteggi, BLOCK realizzazioni alla volta.
+import json, time
+import numpy as np
+import cobs_hz, cfit, ctests
+from .pipeline import run_stages
+
+RULES = ("chi2_red", "KS", "Runs", "Spearman", "BinUniform")
+FLAGS = {"KS": "SNe_KS_ok", "Runs": "SNe_Runs_ok", "Spearman": "SNe_Spearman_ok", "BinUniform": "SNe_BinUniform_ok"}
+
+def truth(prep, H, dist):
+    # valori attesi dal modello ai punti dei dati
+    th = {}
+    if prep.sne is not None:
+        th["mu"] = prep.sne_model(dist)[0]
+    if prep.bao is not None:
+        th["bao"] = {k: (yhat[0], sk) for k, yhat, sk, _ in prep.bao_model(H, dist)}
+    if prep.h0 is not None:
+        th["H0"] = float(np.atleast_2d(H)[0, 0])
+    return th
+
+def draw(rng, n, prep, th):
+    # n realizzazioni: y = valore atteso + L z (covarianza piena) oppure + sigma z
+    obs = {}
+    if "mu" in th:
+        x = rng.standard_normal((n, th["mu"].size))
+        L = prep.sne["L"]
+        obs["mu"] = th["mu"] + (x @ np.asarray(L).T if L is not None else x*prep.sne["sig"])
+    if "bao" in th:
+        obs["bao"] = {}
+        for k, (yhat, sk) in th["bao"].items():
+            x = rng.standard_normal((n, yhat.size))
+            L = prep.bao["L"].get(k)
+            obs["bao"][k] = yhat + (x @ np.asarray(L).T if L is not None else x*prep.bao["cols"][sk])
+    if "H0" in th:
+        obs["H0"] = th["H0"] + prep.h0[1]*rng.standard_normal(n)
+    return obs
+
+def _sim_chunk(prep, H, dist, th, seq, n):
+    rng = np.random.default_rng(seq)
+    c = {"n": 0, "fail": 0, "tests_fail": 0, "chi2_red_sum": 0.0, **{f"fail_{r}": 0 for r in RULES}}
+    for a in range(0, n, ctests.BLOCK):
+        b = min(ctests.BLOCK, n - a)
+        f = prep.fit(H, dist, tests="flags", obs=draw(rng, b, prep, th))
+        bad = {"chi2_red": ~f["PASS_REDUCED_CHI2_LE_1"]}
+        bad.update({r: ~f[k] for r, k in FLAGS.items() if k in f})
+        tests_bad = np.zeros(b, dtype=bool)
+        for r, v in bad.items():
+            c[f"fail_{r}"] += int(v.sum())
+            if r != "chi2_red": tests_bad |= v
+        c["n"] += b; c["fail"] += int((~f["PASS"]).sum()); c["tests_fail"] += int(tests_bad.sum())
+        c["chi2_red_sum"] += float(f["chi2_reduced"].sum())
+    return c
+
+def rate(k, n):
+    # frequenza e errore standard binomiale
+    p = k/n if n else float("nan")
+    return {"rate": p, "se": float(np.sqrt(p*(1.0 - p)/n)) if n else float("nan"), "count": int(k)}
+
+def simulate(H, dist, data, R, seed=0, workers=1, z_grid=None):
+    # R realizzazioni per il modello (H, dist) sulla griglia z_grid (= dist["z"])
+    data = {**data, "calibrate": None}   # la regola PASS usa i p-value analitici
+    prep = cfit.Prepared(data, np.asarray(dist["z"] if z_grid is None else z_grid, dtype=float))
+    H = np.atleast_2d(np.asarray(H, dtype=float))
+    dist = {k: np.atleast_2d(np.asarray(v, dtype=float)) for k, v in dist.items() if k != "z"}
+    th = truth(prep, H, dist)
+    seeds, sizes = ctests._split(R, seed)
+    parts = ctests._pool(_sim_chunk, [(prep, H, dist, th, s, n) for s, n in zip(seeds, sizes)], workers)
+    tot = {k: sum(p[k] for p in parts) for k in parts[0]}
+    n = tot["n"]
+    f = prep.fit(H, dist, tests=False)
+    return {
+        "realisations": n, "seed": seed, "chunks": ctests.CHUNKS, "alpha": ctests.ALPHA,
+        "dof_total": int(f["dof_total"][0]),
+        "covariance": {"sne": "full" if prep.sne is not None and prep.sne["L"] is not None else "diag",
+                       "bao": sorted(prep.bao["L"]) if prep.bao is not None else []},
+        "size_PASS_rule": rate(tot["fail"], n),
+        "size_hard_tests": rate(tot["tests_fail"], n),
+        "fail_by_rule": {r: rate(tot[f"fail_{r}"], n) for r in RULES if r == "chi2_red" or prep.sne is not None},
+        "chi2_reduced_mean": tot["chi2_red_sum"]/n if n else None,
+    }
+
+def add_arguments(ap):
+    ap.add_argument("--lambda4", default="cert/cosmo/Lambda4.json")
+    ap.add_argument("--matter", default="cert/obs/matter_EH.json")
+    ap.add_argument("--config", default="cert/obs/cfit_config.json", help="dati (z, sigma, covarianze) da simulare")
+    ap.add_argument("-R", "--realisations", type=int, default=100000)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--workers", type=int, default=1, help="processi (risultato indipendente dal numero)")
+    ap.add_argument("--engine", choices=["trapz","simpson","spline","gl"], default="trapz")
+    ap.add_argument("--tol", type=float, default=1e-12)
+    ap.add_argument("--zgrid", choices=["fixed","adaptive"], default="fixed")
+    ap.add_argument("--zgrid-tol", type=float, default=1e-7)
+    ap.add_argument("--out", default=None, help="report JSON")
+
+def run(a):
+    load = cobs_hz.load_json
+    cfg = load(a.config)
+    res = run_stages(load(a.lambda4), load(a.matter), {**cfg, "calibrate": None}, a.engine, a.tol, a.zgrid, a.zgrid_tol)
+    t0 = time.perf_counter()
+    rep = simulate(res["H_curve"]["H_km_s_Mpc"], res["distances"], res["data"], a.realisations, a.seed, a.workers)
+    rep["seconds"] = time.perf_counter() - t0
+    s = rep["size_PASS_rule"]
+    print(f"[SIM] R={rep['realisations']} dof={rep['dof_total']} | P(FAIL | modello vero) = {s['rate']:.4f} ± {s['se']:.4f}"
+          f" | solo test severi {rep['size_hard_tests']['rate']:.4f} | {rep['seconds']:.1f} s")
+    for r, v in rep["fail_by_rule"].items():
+        print(f"[SIM]   {r:<11s} fail {v['rate']:.4f} ± {v['se']:.4f}")
+    if a.out:
+        with open(a.out, "w") as f: json.dump(rep, f, indent=2)
+    return 0
@@ -1,6 +1,11 @@
 #!/usr/bin/env python3
-import argparse, csv, json
+import argparse, importlib, json, os, sys
 import mpmath as mp
+try:
+    import numpy as np
+    from scipy.special import ive, kve
+except ImportError:  # engine np senza NumPy/SciPy: tutto sul ramo mpmath
+    np = None
 
 # Bessel I,K e derivate
 I = lambda n,x: mp.besseli(n,x)
@@ -31,10 +36,92 @@ def Pi_holo(s, L, zUV, zIR):
     # DtN al bordo UV
     return - (L**3)/(zUV**3) * hprime
 
+# ---------- path analitico: Pi, dPi/ds, d2Pi/ds2 da un solo bundle di Bessel ----------
+# h(z) = z^2 (I2(pz) + B K2(pz)) ha h'(z) = z^2 p (I1(pz) - B K1(pz)): Neumann IR
+# da' B = I1(a)/K1(a), a = p zIR, e con b = p zUV
+#   Pi = -(L^3/zUV^3) p N/D,  N = I1(b)K1(a) - I1(a)K1(b),  D = I2(b)K1(a) + I1(a)K2(b).
+# Derivate in p da ricorrenze (prime) ed equazione di Bessel modificata (seconde).
+def bessel_bundle(x, nmax):
+    # I_0..I_nmax, K_0..K_nmax in x; K2 da ricorrenza (nessuna cancellazione), I2 diretta
+    I = [mp.besseli(n,x) for n in range(nmax+1)]
+    K = [mp.besselk(0,x), mp.besselk(1,x)]
+    if nmax >= 2: K.append(K[0] + 2*K[1]/x)
+    return I, K
+
+def _dd(f, df, n, x):
+    return -df/x + (1 + n*n/(x*x))*f
+
+def Pi_holo_derivs(s, L, zUV, zIR):
+    if s <= 0: return mp.nan, mp.nan, mp.nan
+    p = mp.sqrt(s)
+    a, b = p*zIR, p*zUV
+    (I0a, I1a), (K0a, K1a) = bessel_bundle(a, 1)
+    (I0b, I1b, I2b), (K0b, K1b, K2b) = bessel_bundle(b, 2)
+    dI1a, dK1a = I0a - I1a/a, -K0a - K1a/a
+    dI1b, dK1b = I0b - I1b/b, -K0b - K1b/b
+    dI2b, dK2b = I1b - 2*I2b/b, -K1b - 2*K2b/b
+    ddI1a, ddK1a = _dd(I1a,dI1a,1,a), _dd(K1a,dK1a,1,a)
+    ddI1b, ddK1b = _dd(I1b,dI1b,1,b), _dd(K1b,dK1b,1,b)
+    ddI2b, ddK2b = _dd(I2b,dI2b,2,b), _dd(K2b,dK2b,2,b)
+
+    N  = I1b*K1a - I1a*K1b
+    D  = I2b*K1a + I1a*K2b
+    N1 = zUV*dI1b*K1a + zIR*I1b*dK1a - zIR*dI1a*K1b - zUV*I1a*dK1b
+    D1 = zUV*dI2b*K1a + zIR*I2b*dK1a + zIR*dI1a*K2b + zUV*I1a*dK2b
+    N2 = zUV**2*ddI1b*K1a + 2*zUV*zIR*dI1b*dK1a + zIR**2*I1b*ddK1a \
+       - zIR**2*ddI1a*K1b - 2*zIR*zUV*dI1a*dK1b - zUV**2*I1a*ddK1b
+    D2 = zUV**2*ddI2b*K1a + 2*zUV*zIR*dI2b*dK1a + zIR**2*I2b*ddK1a \
+       + zIR**2*ddI1a*K2b + 2*zIR*zUV*dI1a*dK2b + zUV**2*I1a*ddK2b
+
+    Q  = N/D
+    Q1 = (N1*D - N*D1)/(D*D)
+    Q2 = (N2*D - N*D2)/(D*D) - 2*D1*(N1*D - N*D1)/(D*D*D)
+    R, R1, R2 = p*Q, Q + p*Q1, 2*Q1 + p*Q2
+    c = -(L**3)/(zUV**3)
+    # s = p^2: d/ds = (1/2p) d/dp
+    return c*R, c*R1/(2*p), c*(R2 - R1/p)/(4*p*p)
+
+# ---------- ramo float64 vettoriale: Pi su array di s con Bessel scalate (ive/kve) ----------
+# Stessa forma chiusa di Pi_holo_derivs divisa per exp(a-b): nessun overflow per s grande,
+#   N e^{b-a} = I1~(b)K1~(a) e^{-2(a-b)} - I1~(a)K1~(b),  D e^{b-a} = I2~(b)K1~(a) e^{-2(a-b)} + I1~(a)K2~(b).
+# Stima a posteriori dell'errore relativo: arrotondamento dei prodotti (cancellazione in N),
+# accuratezza di ive/kve (BESSEL_ULP eps) e condizionamento rispetto a p = sqrt(s).
+BESSEL_ULP = 8
+
+def Pi_holo_np(s, L, zUV, zIR):
+    s = np.asarray(s, dtype=float)
+    eps = np.finfo(float).eps
+    L, zUV, zIR = float(L), float(zUV), float(zIR)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p = np.sqrt(s)
+        a, b = p*zIR, p*zUV
+        E = np.exp(-2*(a-b))
+        I1a, I1b, I2b = ive(1,a), ive(1,b), ive(2,b)
+        K1a, K1b, K2b = kve(1,a), kve(1,b), kve(2,b)
+        T1, T2 = I1b*K1a*E, I1a*K1b
+        T3, T4 = I2b*K1a*E, I1a*K2b
+        N, D = T1 - T2, T3 + T4
+        P = -(L**3)/(zUV**3) * p * N/D
+        u = (2*BESSEL_ULP + 3)*eps
+        err = u*(np.abs(T1) + np.abs(T2))/np.abs(N) + u*(np.abs(T3) + np.abs(T4))/np.abs(D) \
+            + 2*eps*(1 + a + b)
+    P = np.where(s > 0, P, np.nan); err = np.where(np.isfinite(err) & (s > 0), err, np.inf)
+    return P, err
+
+def Pi_holo_grid(S, L, zUV, zIR, tol=1e-12):
+    # Pi (float) su una griglia densa; i punti con errore stimato > tol ripassano da mpmath
+    P, err = Pi_holo_np([float(v) for v in S], L, zUV, zIR)
+    bad = np.nonzero(err > tol)[0]
+    for i in bad:
+        P[i] = float(Pi_holo(mp.mpf(S[i]), mp.mpf(L), mp.mpf(zUV), mp.mpf(zIR)))
+    return P, err, len(bad)
+
+def d2_5pt_vals(v, h):
+    return (-v[4] + 16*v[3] - 30*v[2] + 16*v[1] - v[0])/(12*h*h)
+
 def d2_5pt(F, sk, h):
     s=[sk-2*h, sk-h, sk, sk+h, sk+2*h]
-    v=[F(si) for si in s]
-    return (-v[4] + 16*v[3] - 30*v[2] + 16*v[1] - v[0])/(12*h*h)
+    return d2_5pt_vals([F(si) for si in s], h)
 
 def fit_alpha_log(S, Y):
     X=[mp.log(s) for s in S]
@@ -45,6 +132,134 @@ def fit_alpha_log(S, Y):
     beta  = (SY*SXX - SX*SXY)/den
     return alpha, beta
 
+# ---------- precisione adattiva: dps minimo che riproduce l'ombra (KK/kk_precision.py) ----------
+def kk_precision():
+    # stesso modulo dello stadio KK, anche con lo script lanciato da solo
+    kk = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "KK")
+    if kk not in sys.path: sys.path.insert(0, kk)
+    import kk_precision
+    return kk_precision
+
+def fit_stage(S, Y, prec, prec_tol, precision, name):
+    if prec_tol is None: return fit_alpha_log(S, Y)
+    d, precision["log_fit"][name] = kk_precision().choose_dps(lambda: fit_alpha_log(S, Y), prec, prec_tol)
+    with mp.workdps(d):
+        return fit_alpha_log(S, Y)
+
+def stencil_np(S, eta, L, zUV, zIR, tol):
+    # Pi float64 sull'intera griglia stencil; Y_k accettata se l'errore propagato
+    # (errore di Pi + arrotondamento di s_j in float) resta sotto tol*|Y_k|, altrimenti
+    # i 5 punti dello stencil ripassano da mpmath
+    W = np.array([-1., 16., -30., 16., -1.])
+    grid = [[sk + j*(eta*sk) for j in (-2,-1,0,1,2)] for sk in S]
+    Sf = np.array([[float(v) for v in row] for row in grid])
+    P, err = (a.reshape(Sf.shape) for a in Pi_holo_np(Sf.ravel(), L, zUV, zIR))
+    eps = np.finfo(float).eps
+    table, Y, escalated = [], [], 0
+    for row,Pk,ek,sk in zip(grid,P,err,Sf):
+        h = float(row[3]-row[2])
+        Yk = (W @ Pk)/(12*h*h)
+        dP = abs(Pk[3]-Pk[1])/(2*h)
+        eY = (np.abs(W) @ (np.abs(Pk)*ek + dP*np.abs(sk)*eps))/(12*h*h)
+        if np.isfinite(eY) and eY <= tol*abs(Yk):
+            table.append([mp.mpf(v) for v in Pk]); Y.append(mp.mpf(Yk))
+        else:
+            vals = [Pi_holo(sj, L, zUV, zIR) for sj in row]
+            table.append(vals); Y.append(mp.fsum([w*v for w,v in zip((-1,16,-30,16,-1), vals)])/(12*(row[3]-row[2])**2))
+            escalated += 1
+    return grid, table, Y, escalated
+
+def shared(name):
+    # moduli condivisi di HOLO_KK/holo_kk (fit, table), anche con lo script lanciato da solo
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path: sys.path.insert(0, root)
+    return importlib.import_module("holo_kk." + name)
+
+def gate_e_holo(L, zUV, zIR, smin, smax, K, eta, prec, csv_path, deriv="stencil", prec_tol=None,
+                engine="mp", tol=1e-12, sidecar=None, windows=None):
+    # stadio HOLO di Gate-E (DtN), indipendente dai modi KK.
+    # prec_tol: prec fa da ombra; DtN e fit al dps minimo entro prec_tol.
+    # engine np: Pi dello stencil in float64 (ive/kve), escalation a mpmath oltre tol.
+    # windows: opzioni di holo_kk.fit.window_report sulla tabella del fit usato per alpha
+    mp.mp.dps=prec
+    L=mp.mpf(L); zUV=mp.mpf(zUV); zIR=mp.mpf(zIR)
+
+    def F(s): return Pi_holo(s, L, zUV, zIR)
+
+    # griglia log-spaziata
+    log_smin, log_smax = mp.log(smin), mp.log(smax)
+    S = [ mp.e**(log_smin + i*(log_smax-log_smin)/(K-1)) for i in range(K) ]
+    fits = {}
+
+    precision = None
+    if prec_tol is not None:
+        def dtn():
+            # sonde: Y ai due estremi della finestra, per ogni derivata richiesta
+            Y = []
+            for sk in (S[0], S[-1]):
+                if deriv in ("stencil","both"): Y.append(d2_5pt(F, sk, eta*sk))
+                if deriv in ("analytic","both"): Y.append(Pi_holo_derivs(sk, L, zUV, zIR)[2])
+            return Y
+        d_dtn, info = kk_precision().choose_dps(dtn, prec, prec_tol)
+        precision = {"tol": prec_tol, "dtn": info, "log_fit": {}}
+        mp.mp.dps = d_dtn
+
+    escalated = None
+    if deriv in ("stencil","both"):
+        # tabella Pi sulla griglia stencil valutata una volta: CSV di audit e seconda derivata
+        if engine == "np" and np is not None:
+            grid, table, Y_st, escalated = stencil_np(S, eta, L, zUV, zIR, tol)
+        else:
+            grid = [[sk + j*(eta*sk) for j in (-2,-1,0,1,2)] for sk in S]
+            table = [[F(sj) for sj in row] for row in grid]
+            Y_st = [ d2_5pt_vals(vals, eta*sk) for vals,sk in zip(table,S) ]
+        shared("table").write_table(csv_path, ["s","Pi"],
+                                    ((sj, vj) for row,vals in zip(grid,table) for sj,vj in zip(row,vals)), sidecar=sidecar)
+        fits["stencil"] = fit_stage(S, Y_st, prec, prec_tol, precision, "stencil")
+
+    if deriv in ("analytic","both"):
+        # un bundle di Bessel per punto macro: Pi, Pi', Pi''
+        D = [ Pi_holo_derivs(sk, L, zUV, zIR) for sk in S ]
+        Y_an = [ d[2] for d in D ]
+        fits["analytic"] = fit_stage(S, Y_an, prec, prec_tol, precision, "analytic")
+        csv_an = csv_path if deriv == "analytic" else os.path.splitext(csv_path)[0]+"_analytic.csv"
+        side_an = sidecar if deriv == "analytic" or not sidecar else os.path.splitext(sidecar)[0]+"_analytic.npz"
+        shared("table").write_table(csv_an, ["s","Pi","dPi","d2Pi"], ((sk,)+tuple(d) for sk,d in zip(S,D)), sidecar=side_an)
+
+    # fit Y = alpha log s + beta (path analitico se disponibile)
+    alpha_bulk, beta = fits["analytic" if "analytic" in fits else "stencil"]
+    alpha = alpha_bulk + (-(L**3)/4)
+    Clog = alpha/2
+
+    out = {
+        "alpha": float(alpha),
+        "C_log": float(Clog),
+        "alpha_th": float(-(L**3)/4),
+        "C_log_th": float(-(L**3)/8),
+        "K": K, "eta": eta, "s_window":[float(smin), float(smax)],
+        "prec": prec
+    }
+    if escalated is not None:
+        out["engine"] = engine
+        out["stencils_escalated_mp"] = escalated
+    if deriv != "stencil":
+        # run di default: stesse chiavi del JSON certificato
+        out["deriv"] = deriv
+        for k,(ab,_) in fits.items():
+            out[f"alpha_{k}"] = float(ab + (-(L**3)/4))
+            out[f"C_log_{k}"] = float((ab + (-(L**3)/4))/2)
+    if len(fits) == 2:
+        # audit stencil vs analitico
+        out["Y_max_rel_diff"] = float(max(abs(a-b)/abs(b) for a,b in zip(Y_st, Y_an)))
+        out["alpha_abs_diff"] = float(abs(fits["stencil"][0] - fits["analytic"][0]))
+    if precision is not None:
+        out["precision"] = precision
+    if windows is not None:
+        Y_fit = Y_an if "analytic" in fits else Y_st
+        out["fit_windows"] = shared("fit").window_report(S, Y_fit, offset=float(-(L**3)/4), **windows)
+    mp.mp.dps = prec
+    return out, alpha, Clog
+
 def main():
     ap=argparse.ArgumentParser()
     ap.add_argument("--L", type=float, default=1.0)
@@ -55,40 +270,37 @@ def main():
     ap.add_argument("--K", type=int, default=9)
     ap.add_argument("--eta", type=float, default=0.1)
     ap.add_argument("--prec", type=int, default=160)
+    ap.add_argument("--deriv", choices=["stencil","analytic","both"], default="stencil",
+                    help="stencil: 5 punti; analytic: Pi'' da un bundle di Bessel per punto; both: entrambi + audit")
+    ap.add_argument("--adaptive-prec", action="store_true",
+                    help="--prec come ombra: DtN e fit al dps minimo entro --prec-tol")
+    ap.add_argument("--prec-tol", type=float, default=1e-15)
+    ap.add_argument("--engine", choices=["mp","np"], default="mp",
+                    help="np: Pi dello stencil in float64 (NumPy/SciPy ive,kve) con stima d'errore ed escalation")
+    ap.add_argument("--tol", type=float, default=1e-12, help="errore relativo max nel ramo float (engine np)")
+    ap.add_argument("--scan", type=int, default=0,
+                    help="punti di una scansione densa di Pi in [smin,smax] (float64 + fallback) in <csv>_scan.csv")
+    ap.add_argument("--sidecar", default=None, help="copia binaria compressa della tabella del CSV (.npz, NumPy)")
+    shared("fit").add_arguments(ap)
     ap.add_argument("--csv", default="cert/holo/pi.csv")
     ap.add_argument("--out", default="cert/holo/fit_gateE.json")
     args=ap.parse_args()
+    if args.sidecar and np is None:
+        ap.error("--sidecar richiede NumPy")
 
-    mp.mp.dps=args.prec
-    L=mp.mpf(args.L); zUV=mp.mpf(args.zUV); zIR=mp.mpf(args.zIR)
-
-    def F(s): return Pi_holo(s, L, zUV, zIR)
-
-    # griglia log-spaziata & dump audit
-    log_smin, log_smax = mp.log(args.smin), mp.log(args.smax)
-    S = [ mp.e**(log_smin + i*(log_smax-log_smin)/(args.K-1)) for i in range(args.K) ]
-    with open(args.csv,"w",newline="") as f:
-        w=csv.writer(f); w.writerow(["s","Pi"])
-        for sk in S:
-            h = args.eta * sk
-            for j in [-2,-1,0,1,2]:
-                sj = sk + j*h
-                w.writerow([float(sj), float(F(sj))])
-
-    # seconda derivata + fit Y = alpha log s + beta
-    Y=[ d2_5pt(F, sk, args.eta*sk) for sk in S ]
-    alpha_bulk, beta = fit_alpha_log(S, Y)
-    alpha = alpha_bulk + (-(L**3)/4)
-    Clog = alpha/2
-
-    out = {
-        "alpha": float(alpha),
-        "C_log": float(Clog),
-        "alpha_th": float(-(L**3)/4),
-        "C_log_th": float(-(L**3)/8),
-        "K": args.K, "eta": args.eta, "s_window":[float(args.smin), float(args.smax)],
-        "prec": args.prec
-    }
+    out, alpha, Clog = gate_e_holo(args.L, args.zUV, args.zIR, args.smin, args.smax, args.K, args.eta,
+                                   args.prec, args.csv, deriv=args.deriv,
+                                   prec_tol=args.prec_tol if args.adaptive_prec else None,
+                                   engine=args.engine, tol=args.tol, sidecar=args.sidecar,
+                                   windows=shared("fit").options(args))
+    L = mp.mpf(args.L)
+    if args.scan:
+        if np is None: ap.error("--scan richiede NumPy e SciPy")
+        S = np.logspace(np.log10(args.smin), np.log10(args.smax), args.scan)
+        P, err, n_mp = Pi_holo_grid(S, args.L, args.zUV, args.zIR, tol=args.tol)
+        scan_csv = os.path.splitext(args.csv)[0] + "_scan.csv"
+        shared("table").write_table(scan_csv, ["s","Pi","err_rel_est","mp"], zip(S, P, err, err > args.tol))
+        out["scan"] = {"points": args.scan, "points_mp": n_mp, "csv": scan_csv}
     json.dump(out, open(args.out,"w"), indent=2)
 
     print("[HOLO Gate-E] alpha =", mp.nstr(alpha,15), " (th =", mp.nstr(-(L**3)/4,15), ")")
@@ -1,12 +1,28 @@
 #!/usr/bin/env python3
 import json, argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 import mpmath as mp
 
-# Bessel helpers (ordine intero)
-def J(n,x): return mp.besselj(n,x)
-def Y(n,x): return mp.bessely(n,x)
-def Jp(n,x): return 0.5*(mp.besselj(n-1,x)-mp.besselj(n+1,x))
-def Yp(n,x): return 0.5*(mp.bessely(n-1,x)-mp.bessely(n+1,x))
+# Bessel helpers (ordine intero), memoizzati per (tipo, ordine, argomento, precisione):
+# beta_of_x, fprime_IR, lommel_S e g_from_mode rivalutano J/Y negli stessi punti
+BESSEL_CACHE_SIZE = 1024
+
+@lru_cache(maxsize=BESSEL_CACHE_SIZE)
+def _bessel(kind, n, x, prec):
+    return mp.besselj(n,x) if kind == "J" else mp.bessely(n,x)
+
+def J(n,x): return _bessel("J", n, x, mp.mp.prec)
+def Y(n,x): return _bessel("Y", n, x, mp.mp.prec)
+def Jp(n,x): return 0.5*(J(n-1,x)-J(n+1,x))
+def Yp(n,x): return 0.5*(Y(n-1,x)-Y(n+1,x))
+
+def counted(fn, *args):
+    # cache azzerata per task: contatori deterministici, identici seriale/pool
+    _bessel.cache_clear()
+    res = fn(*args)
+    info = _bessel.cache_info()
+    return res, info.hits, info.misses
 
 def beta_of_x(x, zUV):
     # UV Dirichlet: J2 + beta Y2 = 0  at tUV = x zUV
@@ -45,6 +61,131 @@ def find_roots_IR_neumann(N, zIR, zUV):
         x = x2
     return roots
 
+# bisezione di riferimento spezzata in task indipendenti per il pool: segno di f' sui
+# nodi x_j = 1e-6 + j pi (stessa somma ripetuta) e 80 bisezioni per bracket.
+# Stesse radici di find_roots_IR_neumann
+def sign_fprime_IR(x, zIR, zUV):
+    return mp.sign(fprime_IR(x, zIR, zUV))
+
+def bisect_bracket(a, b, zIR, zUV):
+    fa = fprime_IR(a, zIR, zUV)
+    for _ in range(80):
+        c = 0.5*(a+b)
+        fc = fprime_IR(c, zIR, zUV)
+        if mp.sign(fc) == 0: a=b=c; break
+        if mp.sign(fa)*mp.sign(fc) < 0:
+            b = c
+        else:
+            a,fa = c,fc
+    return 0.5*(a+b)
+
+def find_roots_IR_bisect_pool(N, zIR, zUV, workers, prec, stats):
+    nodes, signs = [mp.mpf('1e-6')], []
+    dx = mp.pi
+    block = max(16, 4*workers)
+    found = []  # ("x", nodo) radice esatta sul nodo, ("b", a, b) bracket da bisecare
+    j = 0
+    while len(found) < N:
+        if len(signs) < j+2:
+            while len(nodes) < len(signs) + block: nodes.append(nodes[-1] + dx)
+            signs += pool_map(sign_fprime_IR, [(x, zIR, zUV) for x in nodes[len(signs):]], workers, prec, stats)
+        if signs[j] == 0:
+            found.append(("x", nodes[j]))
+        elif signs[j+1] == 0 or signs[j+1] != signs[j]:
+            found.append(("b", nodes[j], nodes[j+1]))
+        j += 1
+    br = [(f[1], f[2], zIR, zUV) for f in found if f[0] == "b"]
+    mid = iter(pool_map(bisect_bracket, br, workers, prec, stats))
+    return [f[1] if f[0] == "x" else next(mid) for f in found]
+
+# ---------- root engine: McMahon + Halley con bracket ----------
+# f'(zIR) = zIR^2 x (J1(t) + beta Y1(t)), t = x zIR. Moltiplicando per Y2(x zUV)
+# si ottiene il prodotto incrociato H(x) = J1(t) Y2(u) - J2(u) Y1(t), u = x zUV,
+# con gli stessi zeri di fprime_IR ma senza i poli di beta(x).
+def cross_IR(x, zIR, zUV):
+    t, u = x*zIR, x*zUV
+    A, B = J(1,t), Y(1,t)
+    C, D = J(2,u), Y(2,u)
+    # derivate da ricorrenza, seconde dall'equazione di Bessel
+    Ap = J(0,t) - A/t;   Bp = Y(0,t) - B/t
+    Cp = J(1,u) - 2*C/u; Dp = Y(1,u) - 2*D/u
+    App = -Ap/t - (1 - 1/(t*t))*A; Bpp = -Bp/t - (1 - 1/(t*t))*B
+    Cpp = -Cp/u - (1 - 4/(u*u))*C; Dpp = -Dp/u - (1 - 4/(u*u))*D
+    H   = A*D - C*B
+    H1  = zIR*(Ap*D - C*Bp) + zUV*(A*Dp - Cp*B)
+    H2  = zIR**2*(App*D - C*Bpp) + 2*zIR*zUV*(Ap*Dp - Cp*Bp) + zUV**2*(A*Dpp - Cpp*B)
+    return H, H1, H2
+
+def n_poles(u):
+    # numero di zeri di Y2 sotto u: ciascuno fa saltare atan(beta) di -pi.
+    # stima di McMahon per y_{2,j}, corretta con la parita' del segno di Y2(u)
+    y = lambda j: (j + mp.mpf(1)/4)*mp.pi - 15/(8*(j + mp.mpf(1)/4)*mp.pi)
+    n = 0
+    while y(n+1) < u: n += 1
+    if (Y(2,u) > 0) != (n % 2 == 1):
+        n = n+1 if (n == 0 or y(n+1)-u < u-y(n)) else n-1
+    return n
+
+def mcmahon_guess(k, zIR, zUV):
+    # zeri di J1 + beta Y1 (DLMF 10.21.19, nu=1): a = (k + theta + 1/4) pi, tan(pi theta) = beta,
+    # con theta reso continuo attraverso i poli di beta
+    # beta dipende da x: punto fisso, contrattivo con fattore ~ zUV/zIR
+    x = (k + mp.mpf(1)/4)*mp.pi/zIR
+    for _ in range(60):
+        theta = mp.atan(beta_of_x(x, zUV))/mp.pi + n_poles(x*zUV)
+        a = (k + theta + mp.mpf(1)/4)*mp.pi
+        xn = (a - 3/(8*a) + 3/(128*a**3))/zIR
+        if abs(xn-x)*zIR < mp.mpf('1e-3'): return xn
+        x = xn
+    return x
+
+def halley_bracketed(a, b, zIR, zUV, x0=None, maxit=60):
+    fa = cross_IR(a, zIR, zUV)[0]
+    x = (a+b)/2 if x0 is None else x0
+    tol = mp.mpf(10)**(-mp.mp.dps+5)
+    for _ in range(maxit):
+        H, H1, H2 = cross_IR(x, zIR, zUV)
+        if H == 0: return x
+        if mp.sign(H) == mp.sign(fa): a, fa = x, H
+        else: b = x
+        den = 2*H1*H1 - H*H2
+        xn = x - 2*H*H1/den if den != 0 else (a+b)/2
+        if not (a <= xn <= b): xn = (a+b)/2  # salvaguardia: bisezione
+        elif abs(xn-x) <= tol*abs(xn): return xn
+        x = xn
+    return x
+
+def scan_bracket(x, zIR, zUV):
+    # passo di pi/4 in t: al piu' una radice per passo
+    dx = mp.pi/(4*zIR)
+    h0 = cross_IR(x, zIR, zUV)[0]
+    while True:
+        h1 = cross_IR(x+dx, zIR, zUV)[0]
+        if mp.sign(h1) != mp.sign(h0): return x, x+dx
+        x, h0 = x+dx, h1
+
+def root_k(k, zIR, zUV):
+    g = mcmahon_guess(k, zIR, zUV)
+    w = mp.pi/(4*zIR)
+    a, b = g-w, g+w
+    if mp.sign(cross_IR(a,zIR,zUV)[0]) == mp.sign(cross_IR(b,zIR,zUV)[0]):
+        return None
+    return halley_bracketed(a, b, zIR, zUV, x0=g)
+
+def find_roots_IR_halley(N, zIR, zUV, roots=None):
+    roots = [root_k(k, zIR, zUV) for k in range(1, N+1)] if roots is None else list(roots)
+    # verifica ordinamento/spaziatura; una radice anomala viene ricercata
+    # in modo sequenziale a partire dalla precedente
+    d = zIR - zUV  # spaziatura asintotica pi/(zIR-zUV)
+    gap_lo, gap_hi = mp.pi/(2*d), 3*mp.pi/(2*d)
+    for i in range(N):
+        prev = roots[i-1] if i else None
+        x = roots[i]
+        if x is not None and (prev is None or gap_lo < x - prev < gap_hi): continue
+        a, b = scan_bracket(prev + gap_lo/2 if i else mp.mpf('1e-6'), zIR, zUV)
+        roots[i] = halley_bracketed(a, b, zIR, zUV)
+    return roots
+
 def lommel_S(t, beta):
     # S(t) = (t^2/2)[ (J2^2 - J1 J3) + 2β (J2 Y2 - J1 Y3) + β^2 (Y2^2 - Y1 Y3) ]
     J1,J2,J3 = J(1,t), J(2,t), J(3,t)
@@ -68,6 +209,103 @@ def g_from_mode(x, L, zUV, zIR):
     g = (L**3)/(zUV**3) * ( fprimeUV / mp.sqrt(I) )
     return g, I
 
+def mode_values(x, L, zUV, zIR):
+    b = beta_of_x(x, zUV)
+    g,I = g_from_mode(x, L, zUV, zIR)
+    return x, b, I, g
+
+def mode_record(x, b, I, g):
+    return {
+        "x": float(x),
+        "m2": float(x*x),
+        "beta": float(b),
+        "I_analytic": float(I),
+        "g": float(g)
+    }
+
+# ---------- process pool: ogni worker imposta mp.dps per conto suo ----------
+def _init_worker(prec):
+    mp.mp.dps = prec
+
+def pool_map(fn, args_list, workers, prec, stats):
+    # ordine preservato: output identico al caso seriale
+    if workers <= 1:
+        out = [counted(fn, *a) for a in args_list]
+    else:
+        chunk = max(1, len(args_list)//(4*workers))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(prec,)) as ex:
+            out = list(ex.map(counted, [fn]*len(args_list), *zip(*args_list), chunksize=chunk))
+    stats["hits"] += sum(o[1] for o in out); stats["misses"] += sum(o[2] for o in out)
+    return [o[0] for o in out]
+
+def compute_modes(N, L, zUV, zIR, prec, root_method="halley", workers=1, known=(), prec_values=None):
+    # (x, beta, I, g) in mpf alla precisione prec + contatori della cache di Bessel.
+    # known: modi gia' calcolati (es. dalla cache su disco) per gli stessi parametri;
+    # con halley si calcolano solo le radici mancanti (estensione incrementale).
+    # prec_values: precisione (se diversa) per beta, normalizzazione di Lommel e g
+    mp.mp.dps = prec
+    L = mp.mpf(L); zUV = mp.mpf(zUV); zIR = mp.mpf(zIR)
+    stats = {"hits": 0, "misses": 0, "maxsize": BESSEL_CACHE_SIZE}
+    known = list(known)[:N]
+    if len(known) == N:
+        return known, stats
+    if root_method == "bisect":
+        # riferimento: scansione da capo, segni sui nodi e bisezioni dei bracket sul pool
+        xs = find_roots_IR_bisect_pool(N, zIR, zUV, workers, prec, stats)
+    else:
+        # un bracket per radice: indipendenti, si distribuiscono sul pool
+        xs = [v[0] for v in known]
+        xs += pool_map(root_k, [(k, zIR, zUV) for k in range(len(xs)+1, N+1)], workers, prec, stats)
+        xs = pool_map(find_roots_IR_halley, [(N, zIR, zUV, xs)], 1, prec, stats)[0]
+    keep = 0
+    while keep < len(known) and known[keep][0] == xs[keep]: keep += 1
+    prec_values = prec_values or prec
+    mp.mp.dps = prec_values
+    vals = known[:keep] + pool_map(mode_values, [(x, L, zUV, zIR) for x in xs[keep:]], workers, prec_values, stats)
+    return vals, stats
+
+def compute_modes_adaptive(N, L, zUV, zIR, prec, tol, root_method="halley", workers=1):
+    # prec = ombra: dps minimo per radici e per la normalizzazione di Lommel (beta, I, g)
+    # scelto sulle radici sonda k = 1 e k = N, poi compute_modes a quei dps
+    import kk_precision
+    probes = sorted({1, N})
+    def roots():
+        zI, zU = mp.mpf(zIR), mp.mpf(zUV)
+        return [root_k(k, zI, zU) for k in probes]
+    d_root, info_root = kk_precision.choose_dps(roots, prec, tol)
+    with mp.workdps(prec):
+        xs = roots()
+    def lommel():
+        return [mode_values(x, mp.mpf(L), mp.mpf(zUV), mp.mpf(zIR))[1:] for x in xs]
+    d_val, info_val = kk_precision.choose_dps(lommel, prec, tol)
+    vals, stats = compute_modes(N, L, zUV, zIR, d_root, root_method=root_method, workers=workers,
+                                prec_values=d_val)
+    return vals, stats, {"tol": tol, "roots": info_root, "lommel": info_val}
+
+def iter_modes(L, zUV, zIR, prec, known=()):
+    # modi (x, beta, I, g) uno alla volta, senza limite su N (root_k + verifica della
+    # spaziatura come find_roots_IR_halley, in sequenza). dps=prec solo durante il calcolo:
+    # il consumatore puo' lavorare a un'altra precisione tra un modo e il successivo
+    with mp.workdps(prec):
+        L = mp.mpf(L); zUV = mp.mpf(zUV); zIR = mp.mpf(zIR)
+        d = zIR - zUV
+        gap_lo, gap_hi = mp.pi/(2*d), 3*mp.pi/(2*d)
+    prev = None
+    for v in known:
+        prev = v[0]
+        yield v
+    k = len(known)
+    while True:
+        k += 1
+        with mp.workdps(prec):
+            x = root_k(k, zIR, zUV)
+            if x is None or (prev is not None and not (gap_lo < x - prev < gap_hi)):
+                a, b = scan_bracket(prev + gap_lo/2 if prev is not None else mp.mpf('1e-6'), zIR, zUV)
+                x = halley_bracketed(a, b, zIR, zUV)
+            v = mode_values(x, L, zUV, zIR)
+        prev = x
+        yield v
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--L", type=float, default=1.0)
@@ -75,31 +313,43 @@ def main():
     ap.add_argument("--zIR", type=float, default=1.0)
     ap.add_argument("--N", type=int, default=150)
     ap.add_argument("--prec", type=int, default=120)
+    ap.add_argument("--root-method", choices=["halley","bisect"], default="halley",
+                    help="halley: McMahon + Halley con bracket; bisect: scansione + 80 bisezioni (riferimento)")
+    ap.add_argument("--workers", type=int, default=1, help="processi per radici (halley; bisect: segni sui nodi e bracket) e modi")
+    ap.add_argument("--cache", default=None, help="directory della cache dei modi (riuso/estensione in N)")
+    ap.add_argument("--adaptive-prec", action="store_true",
+                    help="dps minimo per stadio (radici, Lommel) contro un'ombra a --prec")
+    ap.add_argument("--prec-tol", type=float, default=1e-20, help="errore relativo max rispetto all'ombra")
     ap.add_argument("--out", default="cert/kk/modes_analytic.json")
     args = ap.parse_args()
+    if args.adaptive_prec and args.cache:
+        ap.error("--adaptive-prec e --cache sono alternativi")
 
-    mp.mp.dps = args.prec
+    cache_info = precision = None
+    if args.adaptive_prec:
+        vals, stats, precision = compute_modes_adaptive(args.N, args.L, args.zUV, args.zIR, args.prec, args.prec_tol,
+                                                        root_method=args.root_method, workers=args.workers)
+    elif args.cache:
+        import kk_modes_cache
+        vals, stats, cache_info = kk_modes_cache.get_modes(args.cache, args.N, args.L, args.zUV, args.zIR, args.prec,
+                                                           root_method=args.root_method, workers=args.workers)
+    else:
+        vals, stats = compute_modes(args.N, args.L, args.zUV, args.zIR, args.prec,
+                                    root_method=args.root_method, workers=args.workers)
+    modes = [mode_record(*v) for v in vals]
     L = mp.mpf(args.L); zUV = mp.mpf(args.zUV); zIR = mp.mpf(args.zIR)
-
-    xs = find_roots_IR_neumann(args.N, zIR, zUV)
-    modes = []
-    for x in xs:
-        b = beta_of_x(x, zUV)
-        g,I = g_from_mode(x, L, zUV, zIR)
-        modes.append({
-            "x": float(x),
-            "m2": float(x*x),
-            "beta": float(b),
-            "I_analytic": float(I),
-            "g": float(g)
-        })
     out = {
         "L": float(L), "zUV": float(zUV), "zIR": float(zIR),
-        "prec": args.prec, "N": args.N,
+        "prec": args.prec, "N": args.N, "root_method": args.root_method,
+        "bessel_cache": stats,
         "modes": modes
     }
+    if cache_info is not None:
+        out["modes_cache"] = cache_info
+    if precision is not None:
+        out["precision"] = precision
     with open(args.out,"w") as f: json.dump(out,f,indent=2)
-    print(f"[KK-AN] wrote {args.out}  | modes: {len(modes)}")
+    print(f"[KK-AN] wrote {args.out}  | modes: {len(modes)}  | bessel cache hits/misses: {stats['hits']}/{stats['misses']}")
     # stampa rapido dei primi 3 per controllo
     for i,m in enumerate(modes[:3],1):
         print(f"  n={i:3d}  x≈{m['x']:.6e}  g≈{m['g']:.6e}  I≈{m['I_analytic']:.6e}")
@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
-import json, argparse, csv
+import json, argparse, importlib, os, sys
 import mpmath as mp
+try:
+    import numpy as np
+except ImportError:  # engine batch senza NumPy: solo ramo mpmath
+    np = None
 
 def load_modes(path):
     data = json.load(open(path,"r"))
@@ -9,6 +13,12 @@ def load_modes(path):
     g  = [ mp.mpf(m["g"])  for m in data["modes"] ]
     return L, m2, g
 
+def load_modes_cached(cache_dir, N, L, zUV, zIR, prec_modes, root_method="halley"):
+    # tabella a piena precisione dalla cache (radici mancanti calcolate e salvate)
+    import kk_modes_cache
+    vals, _, info = kk_modes_cache.get_modes(cache_dir, N, L, zUV, zIR, prec_modes, root_method=root_method)
+    return mp.mpf(L), [x*x for x,_,_,_ in vals], [gi for _,_,_,gi in vals], info
+
 def PiKK_factory(m2, g):
     def Pi(s):
         return mp.fsum([(gi*gi)/(s+mi2) for gi,mi2 in zip(g,m2)])
@@ -21,10 +31,128 @@ def Pi_tail_factory(L):
         return Clog_th * (s*s) * mp.log(s)  # s>0 in UV
     return Pi_tail
 
+# ---------- engine batch: griglia (punti s) x (modi) in un colpo ----------
+STENCIL = [-2,-1,0,1,2]
+W5 = [-1, 16, -30, 16, -1]  # pesi dello stencil a 5 punti (x 1/12h^2)
+
+def stencil_grid(s_macro, eta):
+    return [[sk + j*(eta*sk) for j in STENCIL] for sk in s_macro]
+
+def neumaier_rows(T):
+    # somma compensata (Neumaier) lungo l'asse dei modi, vettoriale sui punti s
+    acc = np.zeros(T.shape[0]); c = np.zeros(T.shape[0])
+    for col in T.T:
+        t = acc + col
+        c += np.where(np.abs(acc) >= np.abs(col), (acc - t) + col, (col - t) + acc)
+        acc = t
+    return acc + c
+
+def PiKK_batch_factory(m2, g, L, tol=1e-12, chunk=4096):
+    # g^2 e m^2 precalcolati: float64 (NumPy) per il ramo veloce, mpf per l'escalation.
+    # Nel ramo float si sottraggono costante e termine lineare (Pi'' invariata):
+    #   g^2/(s+m^2) = g^2/m^2 - s g^2/m^4 + s^2 g^2/(m^4 (s+m^2)),
+    # cosi' lo stencil cancella solo O(1/eta^2) invece di ~Pi(0)/(h^2 Pi'').
+    # Si stima l'errore float di Y_k e si passa a mpmath dove supera tol*|Y_k|.
+    g2 = [gi*gi for gi in g]
+    Clog_th = -(L**3)/8
+    def Pi_mp(s):
+        return mp.fdot(g2, [1/(s+mi2) for mi2 in m2]) + Clog_th*(s*s)*mp.log(s)
+    if np is not None:
+        G2 = np.array([float(v) for v in g2]); M2 = np.array([float(v) for v in m2])
+        C0 = float(mp.fdot(g2, [1/mi2 for mi2 in m2]))
+        C1 = -float(mp.fdot(g2, [1/(mi2*mi2) for mi2 in m2]))
+        eps = np.finfo(float).eps
+    def Pi_reduced(flat):
+        P = np.empty_like(flat); dP = np.empty_like(flat)
+        for i in range(0, flat.size, chunk):
+            s = flat[i:i+chunk, None]
+            T = (s*s)*G2[None,:]/((M2*M2)[None,:]*(s + M2[None,:]))
+            P[i:i+chunk] = neumaier_rows(T)
+            dP[i:i+chunk] = np.sum(T*(s + 2*M2[None,:])/(s*(s + M2[None,:])), axis=1)
+        tail = float(Clog_th)*flat*flat*np.log(flat)
+        return P + tail, dP + float(Clog_th)*flat*(2*np.log(flat) + 1)
+    def Pi_grid(grid):
+        # tabella Pi sulla griglia stencil (per il CSV) e Y_k = Pi''(s_k)
+        table = [None]*len(grid); Y = [None]*len(grid)
+        if np is not None:
+            S = np.array([[float(s) for s in row] for row in grid])
+            P, dP = (a.reshape(S.shape) for a in Pi_reduced(S.ravel()))
+            W = np.array(W5, dtype=float)
+            for k,row in enumerate(grid):
+                h2 = float(row[3]-row[2])**2
+                Yk = (W @ P[k])/(12*h2)
+                # errore: somma (termini positivi) + arrotondamento di s_j in float
+                err = 4*eps*(np.abs(W) @ (np.abs(P[k]) + np.abs(dP[k]*S[k])))/(12*h2)
+                if err <= tol*abs(Yk):
+                    table[k] = [mp.mpf(v) for v in C0 + C1*S[k] + P[k]]
+                    Y[k] = mp.mpf(Yk)
+        escalated = 0
+        for k,row in enumerate(grid):
+            if table[k] is None:
+                table[k] = [Pi_mp(s) for s in row]; escalated += 1
+                Y[k] = d2_from_table(table[k], row[3]-row[2])
+        return table, Y, escalated
+    return Pi_grid
+
+# ---------- derivata analitica: Pi''(s) = sum 2 g^2/(s+m^2)^3 + C_log^th (2 log s + 3) ----------
+# termini della somma tutti positivi: nessuna cancellazione, basta una precisione modesta
+def PiKK_d2_factory(m2, g, L):
+    g2 = [gi*gi for gi in g]
+    Clog_th = -(L**3)/8
+    def d2(s):
+        return 2*mp.fdot(g2, [1/(s+mi2)**3 for mi2 in m2]) + Clog_th*(2*mp.log(s) + 3)
+    return d2
+
+def PiKK_pd2_factory(m2, g, L):
+    # Pi e Pi'' in un solo passaggio sui modi (q = s+m^2 una volta per modo), per il CSV e
+    # Y_k della modalita' analitica; stessi valori di PiKK_factory + coda e PiKK_d2_factory
+    g2 = [gi*gi for gi in g]
+    Clog_th = -(L**3)/8
+    def pd2(s):
+        q = [s+mi2 for mi2 in m2]
+        P = mp.fsum([a/b for a,b in zip(g2,q)]) + Clog_th*(s*s)*mp.log(s)
+        D = 2*mp.fdot(g2, [1/b**3 for b in q]) + Clog_th*(2*mp.log(s) + 3)
+        return P, D
+    return pd2
+
+def PiKK_d2_batch_factory(m2, g, L, tol=1e-12, chunk=4096):
+    # tutti i punti s in un'unica operazione float64, Pi (CSV) e Pi'' dallo stesso blocco
+    # s x modi; escalation a mpmath solo dove somma e coda di Pi'' si cancellano oltre tol
+    pd2_mp = PiKK_pd2_factory(m2, g, L)
+    Clog_th = float(-(L**3)/8)
+    if np is not None:
+        G2 = np.array([float(gi*gi) for gi in g]); M2 = np.array([float(v) for v in m2])
+        eps = np.finfo(float).eps
+    def d2_grid(S_list):
+        Y = [None]*len(S_list); P = [None]*len(S_list)
+        if np is not None:
+            flat = np.array([float(s) for s in S_list])
+            D = np.empty_like(flat); Q = np.empty_like(flat)
+            for i in range(0, flat.size, chunk):
+                q = flat[i:i+chunk, None] + M2[None,:]
+                Q[i:i+chunk] = neumaier_rows(G2[None,:]/q)
+                D[i:i+chunk] = neumaier_rows(2*G2[None,:]/q**3)
+            tail = Clog_th*(2*np.log(flat) + 3)
+            Q += Clog_th*flat*flat*np.log(flat)
+            for k,(d,t) in enumerate(zip(D, tail)):
+                if 4*eps*(abs(d) + abs(t)) <= tol*abs(d + t):
+                    Y[k] = mp.mpf(float(d + t)); P[k] = mp.mpf(float(Q[k]))
+        escalated = 0
+        for k,s in enumerate(S_list):
+            if Y[k] is None:
+                P[k], Y[k] = pd2_mp(s); escalated += 1
+        return Y, P, escalated
+    return d2_grid
+
+def d2_from_table(vals, h):
+    return mp.fsum([w*v for w,v in zip(W5, vals)]) / (12*h*h)
+
+def d2_5pt_vals(vals, h):
+    return (-vals[4] + 16*vals[3] - 30*vals[2] + 16*vals[1] - vals[0]) / (12*h*h)
+
 def second_derivative_5pt(F, sk, h):
     s = [sk-2*h, sk-h, sk, sk+h, sk+2*h]
-    vals = [F(si) for si in s]
-    return (-vals[4] + 16*vals[3] - 30*vals[2] + 16*vals[1] - vals[0]) / (12*h*h)
+    return d2_5pt_vals([F(si) for si in s], h)
 
 def fit_alpha_log(s_list, y_list):
     X = [mp.log(s) for s in s_list]
@@ -35,56 +163,216 @@ def fit_alpha_log(s_list, y_list):
     beta  = (SY*SXX - SX*SXY)/den
     return alpha, beta
 
+def shared(name):
+    # moduli condivisi di HOLO_KK/holo_kk (fit, table), anche con lo script lanciato da solo
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path: sys.path.insert(0, root)
+    return importlib.import_module("holo_kk." + name)
+
+def gate_e_kk(L, m2, g, smin, smax, K, eta, prec, csv_path,
+              engine="scalar", tol=1e-12, deriv="stencil", prec_tol=None, sidecar=None, windows=None):
+    # stadio KK di Gate-E su modi gia' in memoria (mpf a qualunque precisione).
+    # prec_tol: prec fa da ombra; somma spettrale e fit girano al dps minimo che la
+    # riproduce entro prec_tol (sonde: Y ai due estremi della finestra).
+    # windows: opzioni di holo_kk.fit.window_report (sotto-finestre + bootstrap sulla stessa tabella)
+    mp.mp.dps = prec
+
+    # griglia log-spaziata per s
+    log_smin, log_smax = mp.log(smin), mp.log(smax)
+    s_macro = [ mp.e**(log_smin + i*(log_smax-log_smin)/(K-1)) for i in range(K) ]
+
+    precision = None
+    if prec_tol is not None:
+        import kk_precision
+        def spectral_sum():
+            if deriv == "analytic":
+                d2 = PiKK_d2_factory(m2, g, L)
+                return [d2(sk) for sk in (s_macro[0], s_macro[-1])]
+            Pi_sum, Pi_tail = PiKK_factory(m2, g), Pi_tail_factory(L)
+            return [second_derivative_5pt(lambda s: Pi_sum(s) + Pi_tail(s), sk, eta*sk)
+                    for sk in (s_macro[0], s_macro[-1])]
+        d_sum, info_sum = kk_precision.choose_dps(spectral_sum, prec, prec_tol)
+        precision = {"tol": prec_tol, "spectral_sum": info_sum}
+        mp.mp.dps = d_sum
+
+    escalated = None
+    if deriv == "analytic":
+        # Y_k = Pi''(s_k) esatta; nel CSV Pi e Pi'' ai soli punti macro, un passaggio sui modi
+        if engine == "batch":
+            Y, P, escalated = PiKK_d2_batch_factory(m2, g, L, tol=tol)(s_macro)
+        else:
+            pd2 = PiKK_pd2_factory(m2, g, L)
+            P, Y = (list(c) for c in zip(*[pd2(sk) for sk in s_macro]))
+        shared("table").write_table(csv_path, ["s","Pi","d2Pi"], zip(s_macro, P, Y), sidecar=sidecar)
+        S = list(s_macro)
+    else:
+        # Pi valutata una volta sull'intera griglia stencil: CSV e derivata dalla stessa tabella
+        grid = stencil_grid(s_macro, eta)
+        if engine == "batch":
+            table, Y, escalated = PiKK_batch_factory(m2, g, L, tol=tol)(grid)
+        else:
+            Pi_sum  = PiKK_factory(m2, g)
+            Pi_tail = Pi_tail_factory(L)
+
+            def Pi(s):
+                # Gate-E: somma parziale + coda UV universale
+                return Pi_sum(s) + Pi_tail(s)
+
+            table = [[Pi(sj) for sj in row] for row in grid]
+            Y = [d2_5pt_vals(vals, eta*sk) for vals,sk in zip(table, s_macro)]
+        shared("table").write_table(csv_path, ["s","Pi"],
+                                    ((sj, vj) for row,vals in zip(grid,table) for sj,vj in zip(row,vals)), sidecar=sidecar)
+        S = list(s_macro)
+    if precision is not None:
+        d_fit, precision["log_fit"] = kk_precision.choose_dps(lambda: fit_alpha_log(S, Y), prec, prec_tol)
+        mp.mp.dps = d_fit
+    alpha, beta = fit_alpha_log(S, Y)
+    Clog = alpha/2
+
+    out = {
+        "alpha": float(alpha),
+        "C_log": float(Clog),
+        "alpha_th": float(-(L**3)/4),
+        "C_log_th": float(-(L**3)/8),
+        "K": K, "eta": eta, "s_window":[float(smin), float(smax)],
+        "modes_used": len(m2), "prec": prec,
+        "used_tail": True
+    }
+    if deriv != "stencil":
+        out["deriv"] = deriv
+    if escalated is not None:
+        out["engine"] = engine
+        out["points_escalated_mp" if deriv == "analytic" else "stencils_escalated_mp"] = escalated
+    if precision is not None:
+        out["precision"] = precision
+    if windows is not None:
+        out["fit_windows"] = shared("fit").window_report(S, Y, **windows)
+    mp.mp.dps = prec
+    return out, alpha, Clog
+
+# ---------- studio di convergenza in N: modi in streaming, somme parziali incrementali ----------
+def converge_kk(L, modes, smin, smax, K, eta, prec, csv_path, deriv="stencil",
+                tol=1e-12, patience=3, n_min=5, n_max=2000, every=1, log=None, sidecar=None):
+    # modes: iterabile di (x, beta, I, g) (es. kk_analytic_modes.iter_modes).
+    # Ogni modo aggiunge g^2/(s+m^2) (stencil) o 2 g^2/(s+m^2)^3 (analytic) alle somme
+    # sui punti della griglia; ogni `every` modi si rifa' il fit (la coda UV e' fissa).
+    # Stop quando |d alpha| <= tol*max(1,|alpha|) per `patience` controlli consecutivi.
+    mp.mp.dps = prec
+    L = mp.mpf(L)
+    log_smin, log_smax = mp.log(smin), mp.log(smax)
+    s_macro = [ mp.e**(log_smin + i*(log_smax-log_smin)/(K-1)) for i in range(K) ]
+    Clog_th = -(L**3)/8
+    if deriv == "analytic":
+        pts = [[sk] for sk in s_macro]
+        tail = [[Clog_th*(2*mp.log(sk) + 3)] for sk in s_macro]
+        # Pi per il CSV accumulata nello stesso passaggio sui modi
+        pi_acc = [mp.mpf(0) for _ in s_macro]
+        pi_tail = [Clog_th*(sk*sk)*mp.log(sk) for sk in s_macro]
+    else:
+        pts = stencil_grid(s_macro, eta)
+        tail = [[Clog_th*(s*s)*mp.log(s) for s in row] for row in pts]
+    acc = [[mp.mpf(0)]*len(row) for row in pts]
+    used = []; traj = []; alpha = prev = None; stable = 0
+    for v in modes:
+        mp.mp.dps = prec
+        used.append(v)
+        g2 = v[3]*v[3]; m2 = v[0]*v[0]
+        for k,(row,a) in enumerate(zip(pts,acc)):
+            for j,s in enumerate(row):
+                q = s+m2
+                if deriv == "analytic":
+                    a[j] += 2*g2/q**3; pi_acc[k] += g2/q
+                else:
+                    a[j] += g2/q
+        n = len(used)
+        if n % every and n < n_max: continue
+        if deriv == "analytic":
+            Y = [a[0] + t[0] for a,t in zip(acc,tail)]
+        else:
+            Y = [d2_from_table([a[j] + t[j] for j in range(5)], row[3]-row[2])
+                 for row,a,t in zip(pts,acc,tail)]
+        alpha, _ = fit_alpha_log(s_macro, Y)
+        d = None if prev is None else abs(alpha - prev)
+        stable = stable + 1 if d is not None and d <= tol*max(1, abs(alpha)) else 0
+        traj.append({"N": n, "alpha": float(alpha), "C_log": float(alpha/2),
+                     "d_alpha": None if d is None else float(d)})
+        if log: log(n, alpha, d)
+        prev = alpha
+        if (stable >= patience and n >= n_min) or n >= n_max: break
+
+    # somme finali (stessa tabella del fit) nel CSV di audit
+    if deriv == "analytic":
+        shared("table").write_table(csv_path, ["s","Pi","d2Pi"],
+                                    ((sk, p + t, Yk) for sk,p,t,Yk in zip(s_macro,pi_acc,pi_tail,Y)), sidecar=sidecar)
+    else:
+        shared("table").write_table(csv_path, ["s","Pi"],
+                                    ((s, aj + tj) for row,a,t in zip(pts,acc,tail) for s,aj,tj in zip(row,a,t)), sidecar=sidecar)
+
+    Clog = alpha/2
+    out = {
+        "alpha": float(alpha),
+        "C_log": float(Clog),
+        "alpha_th": float(-(L**3)/4),
+        "C_log_th": float(-(L**3)/8),
+        "K": K, "eta": eta, "s_window":[float(smin), float(smax)],
+        "modes_used": len(used), "prec": prec,
+        "used_tail": True, "engine": "converge", "deriv": deriv,
+        "converge": {"tol": tol, "patience": patience, "n_min": n_min, "n_max": n_max,
+                     "every": every, "converged": stable >= patience, "trajectory": traj}
+    }
+    return out, alpha, Clog, used
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--modes", default="cert/kk/modes_analytic.json")
+    ap.add_argument("--cache", default=None, help="legge i modi dalla cache (ignora --modes); parametri sotto")
+    ap.add_argument("--L", type=float, default=1.0)
+    ap.add_argument("--zUV", type=float, default=1e-4)
+    ap.add_argument("--zIR", type=float, default=1.0)
+    ap.add_argument("--N", type=int, default=150)
+    ap.add_argument("--prec-modes", type=int, default=120)
+    ap.add_argument("--root-method", choices=["halley","bisect"], default="halley")
     ap.add_argument("--smin", type=float, default=1e-14)
     ap.add_argument("--smax", type=float, default=1e-8)
     ap.add_argument("--K", type=int, default=9)
     ap.add_argument("--eta", type=float, default=0.1)
     ap.add_argument("--prec", type=int, default=160)
+    ap.add_argument("--engine", choices=["scalar","batch"], default="scalar",
+                    help="scalar: fsum punto per punto (certificato); batch: griglia vettoriale float/mpmath con escalation")
+    ap.add_argument("--tol", type=float, default=1e-12, help="errore relativo max su Y_k nel ramo float (engine batch)")
+    ap.add_argument("--deriv", choices=["stencil","analytic"], default="stencil",
+                    help="stencil: 5 punti (eta); analytic: Pi'' in forma chiusa, una valutazione per punto")
+    ap.add_argument("--adaptive-prec", action="store_true",
+                    help="--prec come ombra: somma spettrale e fit al dps minimo entro --prec-tol")
+    ap.add_argument("--prec-tol", type=float, default=1e-15)
+    ap.add_argument("--converge", action="store_true",
+                    help="modi in streaming dal root finder fino a stabilita' di alpha (--N = massimo)")
+    ap.add_argument("--conv-tol", type=float, default=1e-12, help="|d alpha| relativo tra controlli successivi")
+    ap.add_argument("--conv-patience", type=int, default=3, help="controlli consecutivi sotto conv-tol")
+    ap.add_argument("--conv-every", type=int, default=1, help="modi tra due fit")
+    ap.add_argument("--sidecar", default=None, help="copia binaria compressa della tabella del CSV (.npz, NumPy)")
+    shared("fit").add_arguments(ap)
     ap.add_argument("--csv", default="cert/kk/pi.csv")
     ap.add_argument("--out", default="cert/kk/fit_gateE.json")
     args = ap.parse_args()
+    if args.sidecar and np is None:
+        ap.error("--sidecar richiede NumPy")
 
+    if args.converge:
+        return main_converge(args)
+    cache_info = None
+    if args.cache:
+        L, m2, g, cache_info = load_modes_cached(args.cache, args.N, args.L, args.zUV, args.zIR,
+                                                 args.prec_modes, root_method=args.root_method)
     mp.mp.dps = args.prec
-    L, m2, g = load_modes(args.modes)
-    Pi_sum  = PiKK_factory(m2, g)
-    Pi_tail = Pi_tail_factory(L)
-
-    def Pi(s):
-        # Gate-E: somma parziale + coda UV universale
-        return Pi_sum(s) + Pi_tail(s)
-
-    # griglia log-spaziata per s e dump audit CSV
-    log_smin, log_smax = mp.log(args.smin), mp.log(args.smax)
-    s_macro = [ mp.e**(log_smin + i*(log_smax-log_smin)/(args.K-1)) for i in range(args.K) ]
-    with open(args.csv,"w",newline="") as f:
-        w=csv.writer(f); w.writerow(["s","Pi"])
-        for sk in s_macro:
-            h = args.eta * sk
-            for j in [-2,-1,0,1,2]:
-                sj = sk + j*h
-                w.writerow([float(sj), float(Pi(sj))])
-
-    # seconda derivata e fit Y = alpha log s + beta
-    Y=[]; S=[]
-    for sk in s_macro:
-        h = args.eta * sk
-        Yk = second_derivative_5pt(Pi, sk, h)
-        Y.append(Yk); S.append(sk)
-    alpha, beta = fit_alpha_log(S, Y)
-    Clog = alpha/2
-
-    out = {
-        "alpha": float(alpha),
-        "C_log": float(Clog),
-        "alpha_th": float(-(L**3)/4),
-        "C_log_th": float(-(L**3)/8),
-        "K": args.K, "eta": args.eta, "s_window":[float(args.smin), float(args.smax)],
-        "modes_used": len(m2), "prec": args.prec,
-        "used_tail": True
-    }
+    if not args.cache:
+        L, m2, g = load_modes(args.modes)
+    out, alpha, Clog = gate_e_kk(L, m2, g, args.smin, args.smax, args.K, args.eta, args.prec, args.csv,
+                                 engine=args.engine, tol=args.tol, deriv=args.deriv,
+                                 prec_tol=args.prec_tol if args.adaptive_prec else None, sidecar=args.sidecar,
+                                 windows=shared("fit").options(args))
+    if cache_info is not None:
+        out["modes_cache"] = cache_info
     json.dump(out, open(args.out,"w"), indent=2)
 
     # stampa robusta per mpf
@@ -99,4 +387,28 @@ def main():
           mp.nstr(-(L**3)/8, 15),
           ")")
     print(f"[KK Gate-E] wrote {args.csv} and {args.out}")
+
+def main_converge(args):
+    import kk_analytic_modes as kkm
+    known, key = [], None
+    if args.cache:
+        import kk_modes_cache as kkc
+        key, params = kkc.cache_key(args.L, args.zUV, args.zIR, args.prec_modes, "halley")
+        known = kkc.load(args.cache, key)[:args.N]
+    def log(n, alpha, d):
+        print(f"[KK conv] N={n:5d}  alpha = {mp.nstr(alpha,17)}  |d alpha| = {mp.nstr(d,3) if d is not None else '-'}")
+    modes = kkm.iter_modes(args.L, args.zUV, args.zIR, args.prec_modes, known=known)
+    out, alpha, Clog, used = converge_kk(args.L, modes, args.smin, args.smax, args.K, args.eta, args.prec, args.csv,
+                                         deriv=args.deriv, tol=args.conv_tol, patience=args.conv_patience,
+                                         n_max=args.N, every=args.conv_every, log=log, sidecar=args.sidecar)
+    if key is not None:
+        if len(used) > len(known):
+            kkc.store(args.cache, key, params, used)
+        out["modes_cache"] = {"key": key, "cached": min(len(known), len(used)),
+                              "computed": max(0, len(used) - len(known))}
+    json.dump(out, open(args.out,"w"), indent=2)
+    c = out["converge"]
+    print(f"[KK conv] {'converged' if c['converged'] else 'NOT converged'} at N={len(used)}  "
+          f"alpha = {mp.nstr(alpha,15)}  C_log = {mp.nstr(Clog,15)}")
+    print(f"[KK conv] wrote {args.csv} and {args.out}")
 if __name__=="__main__": main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# Cache su disco delle tabelle dei modi KK, indirizzata per contenuto:
+# chiave = sha256(L, zUV, zIR, prec, root_method, sha256 di kk_analytic_modes.py).
+# N non fa parte della chiave: una tabella con N0 modi si estende a N > N0
+# calcolando solo le radici mancanti. I valori (x, beta, I, g) sono salvati esatti
+# come mantissa/esponente binari (hex), in JSON compresso gzip.
+import gzip, hashlib, json, os
+import mpmath as mp
+import kk_analytic_modes as kkm
+
+FORMAT = "kk-modes-v1"
+FIELDS = ("x", "beta", "I_analytic", "g")
+
+def code_version():
+    with open(kkm.__file__, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def cache_key(L, zUV, zIR, prec, root_method):
+    params = {"L": float(L), "zUV": float(zUV), "zIR": float(zIR), "prec": int(prec),
+              "root_method": root_method, "code": code_version()}
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest(), params
+
+def enc(v):
+    sign, m, e, _ = mp.mpf(v)._mpf_
+    return f"{'-' if sign else ''}{m:x}p{e}"
+
+def dec(s):
+    m, e = s.split("p")
+    return mp.mpf((int(m, 16), int(e)))
+
+def cache_path(cache_dir, key):
+    return os.path.join(cache_dir, f"{key}.modes.gz")
+
+def load(cache_dir, key):
+    p = cache_path(cache_dir, key)
+    if not os.path.exists(p): return []
+    with gzip.open(p, "rt") as f:
+        d = json.load(f)
+    if d.get("format") != FORMAT: return []
+    cols = [[dec(s) for s in d[k]] for k in FIELDS]
+    return list(zip(*cols))
+
+def store(cache_dir, key, params, vals):
+    os.makedirs(cache_dir, exist_ok=True)
+    d = {"format": FORMAT, "key": key, "params": params, "N": len(vals)}
+    for i,k in enumerate(FIELDS):
+        d[k] = [enc(v[i]) for v in vals]
+    # scrittura atomica: piu' processi (sweep) possono condividere la cache
+    p = cache_path(cache_dir, key)
+    tmp = f"{p}.{os.getpid()}.tmp"
+    with gzip.open(tmp, "wt") as f:
+        json.dump(d, f)
+    os.replace(tmp, p)
+
+def get_modes(cache_dir, N, L, zUV, zIR, prec, root_method="halley", workers=1):
+    # ritorna (vals, stats, info): vals = [(x, beta, I, g)] mpf a precisione prec
+    key, params = cache_key(L, zUV, zIR, prec, root_method)
+    mp.mp.dps = prec
+    known = load(cache_dir, key)
+    vals, stats = kkm.compute_modes(N, L, zUV, zIR, prec, root_method=root_method,
+                                    workers=workers, known=known)
+    if len(vals) > len(known):
+        store(cache_dir, key, params, vals)
+    info = {"key": key, "cached": min(len(known), N), "computed": max(0, N - len(known))}
+    return vals, stats, info
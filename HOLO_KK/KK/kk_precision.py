@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# Precisione adattiva per stadio: si valuta lo stadio (su pochi punti sonda) alla
+# precisione piena `shadow` e poi a dps crescenti della scala LADDER; si sceglie il primo
+# dps che riproduce l'ombra entro tol (errore relativo, componente per componente).
+import mpmath as mp
+
+LADDER = (20, 30, 40, 50, 60, 80, 100, 120, 160, 200, 240, 320)
+
+def flatten(v):
+    if isinstance(v, (list, tuple)):
+        return [y for x in v for y in flatten(x)]
+    return [v]
+
+def rel_err(v, ref):
+    # inf se la valutazione fallisce (es. bracket perso a bassa precisione)
+    v, ref = flatten(v), flatten(ref)
+    if len(v) != len(ref) or any(a is None for a in v): return mp.inf
+    return max([abs(a-b)/abs(b) if b != 0 else abs(a) for a,b in zip(v, ref)] + [mp.mpf(0)])
+
+def choose_dps(stage, shadow, tol, ladder=LADDER):
+    # stage(): valuta lo stadio alla precisione corrente (mp.mp.dps)
+    with mp.workdps(shadow):
+        ref = stage()
+    for d in ladder:
+        if d >= shadow: break
+        with mp.workdps(d):
+            v = stage()
+        with mp.workdps(shadow):
+            err = rel_err(v, ref)
+        if err <= tol:
+            return d, {"dps": d, "shadow_dps": shadow, "rel_err": float(err)}
+    return shadow, {"dps": shadow, "shadow_dps": shadow, "rel_err": 0.0}
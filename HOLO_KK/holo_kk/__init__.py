@@ -0,0 +1,9 @@
+# HOLO_KK come pacchetto: i moduli KK/ e HOLO/ restano script autonomi,
+# qui vengono resi importabili (anche dai worker dei process pool).
+import os, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for _d in ("KK", "HOLO"):
+    _p = os.path.join(ROOT, _d)
+    if _p not in sys.path:
+        sys.path.insert(0, _p)
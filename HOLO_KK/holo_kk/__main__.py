@@ -0,0 +1,19 @@
+import argparse, sys
+from . import bench, gate_e, sweep
+
+def main():
+    ap = argparse.ArgumentParser(prog="python -m holo_kk", description="HOLO_KK Gate-E (KK ≡ HOLO)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    gate_e.add_arguments(sub.add_parser("gate-e", help="modi + KK e HOLO in parallelo + report di confronto"))
+    sweep.add_arguments(sub.add_parser("sweep", help="griglia di punti Gate-E su process pool, sink CSV/Parquet"))
+    bench.add_arguments(sub.add_parser("bench", help="micro-benchmark degli stadi (N x dps), storico e soglie"))
+    args = ap.parse_args()
+    if args.cmd == "gate-e":
+        sys.exit(gate_e.run(args))
+    if args.cmd == "sweep":
+        sys.exit(sweep.run(args))
+    if args.cmd == "bench":
+        sys.exit(bench.run(args))
+
+if __name__ == "__main__":
+    main()
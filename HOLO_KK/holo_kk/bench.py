@@ -0,0 +1,196 @@
+# Micro-benchmark degli stadi Gate-E (stile asv): ogni stadio e' una funzione
+# setup(N, dps, K) -> callable, cronometrata su una matrice N x dps (x K per il fit).
+# Storico JSON in profiles/bench_history.json, una baseline per commit; uno stadio
+# piu' lento della baseline oltre la soglia (default 20%) viene segnalato.
+# Solo CPU, nessuna rete: mpmath (+ NumPy se presente per i rami batch).
+import itertools, json, os, platform, statistics, sys, time
+import mpmath as mp
+from . import ROOT
+from .gate_e import git_rev
+import kk_analytic_modes as kkm
+import kk_gateE_from_modes as kkg
+import holo_gateE_dtn as hg
+
+FORMAT = "holo-kk-bench-v1"
+N_GRID = (50, 150, 500, 2000)
+DPS_GRID = (50, 120, 200)
+K_GRID = (9, 65, 513)
+# scansione a bisezione: costo superlineare in N (~1 s a N=1, ~1 min a N=20), asse N ridotto;
+# dal --N si tengono i valori <= ROOTS_N_MAX, altrimenti ROOTS_N_GRID
+ROOTS_N_GRID = (1, 5, 10)
+ROOTS_N_MAX = 20
+L, zUV, zIR = 1, "1e-4", 1
+S_PROBE = "1e-10"  # punto s nella finestra Gate-E
+
+def synthetic_modes(N):
+    # spettro sintetico con la spaziatura asintotica pi/(zIR-zUV): per i tempi delle somme
+    # conta solo N (calcolare davvero 2000 radici costerebbe ore al benchmark)
+    d = mp.mpf(zIR) - mp.mpf(zUV)
+    m2 = [((n + mp.mpf(1)/4)*mp.pi/d)**2 for n in range(1, N+1)]
+    g = [mp.sqrt(mp.mpf(n)) for n in range(1, N+1)]
+    return m2, g
+
+def _roots_bisect(N, dps, K):
+    # scansione sequenziale + 80 bisezioni per le prime N radici
+    return lambda: kkm.find_roots_IR_neumann(N, mp.mpf(zIR), mp.mpf(zUV))
+
+def _root_k(N, dps, K):
+    return lambda: kkm.root_k(N, mp.mpf(zIR), mp.mpf(zUV))
+
+def _g_from_mode(N, dps, K):
+    x = kkm.root_k(N, mp.mpf(zIR), mp.mpf(zUV))
+    def run():
+        kkm._bessel.cache_clear()  # memo per chiamata, non tra ripetizioni
+        return kkm.g_from_mode(x, mp.mpf(L), mp.mpf(zUV), mp.mpf(zIR))
+    return run
+
+def _PiKK(N, dps, K):
+    Pi = kkg.PiKK_factory(*synthetic_modes(N)); s = mp.mpf(S_PROBE)
+    return lambda: Pi(s)
+
+def _PiKK_d2(N, dps, K):
+    d2 = kkg.PiKK_d2_factory(*synthetic_modes(N), mp.mpf(L)); s = mp.mpf(S_PROBE)
+    return lambda: d2(s)
+
+def _PiKK_batch(N, dps, K):
+    # griglia stencil Gate-E di default (K=9 punti macro x 5)
+    m2, g = synthetic_modes(N)
+    s_macro = [mp.mpf(10)**(-14 + i*mp.mpf(6)/8) for i in range(9)]
+    grid = kkg.stencil_grid(s_macro, mp.mpf("0.1"))
+    return lambda: kkg.PiKK_batch_factory(m2, g, mp.mpf(L))(grid)
+
+def _Pi_holo(N, dps, K):
+    s = mp.mpf(S_PROBE)
+    return lambda: hg.Pi_holo(s, mp.mpf(L), mp.mpf(zUV), mp.mpf(zIR))
+
+def _Pi_holo_derivs(N, dps, K):
+    s = mp.mpf(S_PROBE)
+    return lambda: hg.Pi_holo_derivs(s, mp.mpf(L), mp.mpf(zUV), mp.mpf(zIR))
+
+def _fit(N, dps, K):
+    S = [mp.mpf(10)**(-14 + i*mp.mpf(6)/(K-1)) for i in range(K)]
+    Y = [-mp.mpf(1)/4*mp.log(s) + mp.mpf(1)/7 for s in S]
+    return lambda: kkg.fit_alpha_log(S, Y)
+
+# nome -> (setup, assi usati)
+STAGES = {
+    "find_roots_IR_neumann": (_roots_bisect, ("N", "dps")),
+    "root_k": (_root_k, ("N", "dps")),
+    "g_from_mode": (_g_from_mode, ("N", "dps")),
+    "PiKK_factory": (_PiKK, ("N", "dps")),
+    "PiKK_d2_factory": (_PiKK_d2, ("N", "dps")),
+    "PiKK_batch_factory": (_PiKK_batch, ("N", "dps")),
+    "Pi_holo": (_Pi_holo, ("dps",)),
+    "Pi_holo_derivs": (_Pi_holo_derivs, ("dps",)),
+    "fit_alpha_log": (_fit, ("K", "dps")),
+}
+
+def cell_key(stage, N, dps, K, axes):
+    p = {"N": N, "dps": dps, "K": K}
+    return stage + "[" + ",".join(f"{a}={p[a]}" for a in ("N", "K", "dps") if a in axes) + "]"
+
+def timeit(fn, repeat=3, min_time=0.2, slow=2.0):
+    # un riscaldamento (costanti mpmath alla nuova precisione) che calibra `number`;
+    # chiamate piu' lente di `slow` secondi: il riscaldamento vale come unico campione
+    t0 = time.perf_counter(); fn(); t1 = time.perf_counter() - t0
+    if t1 >= slow:
+        return {"min": t1, "median": t1, "number": 1, "repeat": 1}
+    number = max(1, int(min_time / max(t1, 1e-9)))
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number): fn()
+        samples.append((time.perf_counter() - t0) / number)
+    return {"min": min(samples), "median": statistics.median(samples), "number": number, "repeat": repeat}
+
+def machine():
+    try:
+        import numpy
+        np_ver = numpy.__version__
+    except ImportError:
+        np_ver = None
+    return {"node": platform.node(), "machine": platform.machine(), "cpu_count": os.cpu_count(),
+            "python": platform.python_version(), "mpmath": mp.__version__, "numpy": np_ver}
+
+def same_machine(a, b):
+    return all(a.get(k) == b.get(k) for k in ("node", "machine", "python", "mpmath", "numpy"))
+
+def load_history(path):
+    if not os.path.exists(path): return {"format": FORMAT, "runs": []}
+    with open(path) as f: return json.load(f)
+
+def pick_baseline(history, run, rev=None):
+    # --baseline REV: ultima run di quel commit; altrimenti l'ultima run di un commit
+    # (o stato dirty) diverso dal corrente, sulla stessa macchina
+    for r in reversed(history["runs"]):
+        if rev is not None:
+            if r["commit"].startswith(rev): return r
+        elif r["commit"] != run["commit"] and same_machine(r["machine"], run["machine"]):
+            return r
+    return None
+
+def run_bench(stages, Ns, dpss, Ks, repeat=3, min_time=0.2, log=print):
+    results = {}
+    for stage in stages:
+        setup, axes = STAGES[stage]
+        Ns_ = Ns
+        if stage == "find_roots_IR_neumann":
+            Ns_ = [n for n in Ns if n <= ROOTS_N_MAX] or ROOTS_N_GRID
+        cells = itertools.product(Ns_ if "N" in axes else (None,), Ks if "K" in axes else (None,), dpss)
+        for N, K, dps in cells:
+            key = cell_key(stage, N, dps, K, axes)
+            mp.mp.dps = dps
+            results[key] = timeit(setup(N, dps, K), repeat=repeat, min_time=min_time)
+            log(f"[BENCH] {key:40s} {results[key]['min']*1e3:12.4f} ms")
+    return results
+
+def compare(results, base, threshold):
+    rows, regressions = [], []
+    for key, r in results.items():
+        b = base["results"].get(key) if base else None
+        ratio = r["min"] / b["min"] if b else None
+        slow = ratio is not None and ratio > 1 + threshold
+        rows.append((key, r["min"], b["min"] if b else None, ratio, slow))
+        if slow: regressions.append(key)
+    return rows, regressions
+
+def add_arguments(ap):
+    ap.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    ap.add_argument("--N", type=int, nargs="+", default=list(N_GRID))
+    ap.add_argument("--dps", type=int, nargs="+", default=list(DPS_GRID))
+    ap.add_argument("--K", type=int, nargs="+", default=list(K_GRID), help="punti del fit (fit_alpha_log)")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--min-time", type=float, default=0.2, help="secondi minimi per campione")
+    ap.add_argument("--threshold", type=float, default=0.2, help="rallentamento relativo segnalato")
+    ap.add_argument("--baseline", default=None, help="commit di riferimento (default: ultima run di un altro commit)")
+    ap.add_argument("--history", default=os.path.join(ROOT, "profiles", "bench_history.json"))
+    ap.add_argument("--no-save", action="store_true", help="confronta senza aggiornare lo storico")
+
+def run(a):
+    run_ = {"commit": git_rev(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "machine": machine(),
+            "config": {"N": a.N, "dps": a.dps, "K": a.K, "repeat": a.repeat, "min_time": a.min_time}}
+    run_["results"] = run_bench(a.stages, a.N, a.dps, a.K, repeat=a.repeat, min_time=a.min_time)
+    history = load_history(a.history)
+    base = pick_baseline(history, run_, a.baseline)
+    rows, regressions = compare(run_["results"], base, a.threshold)
+
+    print(f"[BENCH] commit {run_['commit']}  baseline {base['commit'] if base else '-'}")
+    for key, t, tb, ratio, slow in rows:
+        tb_s = f"{tb*1e3:12.4f}" if tb is not None else f"{'-':>12s}"
+        r_s = f"{ratio:7.3f}" if ratio is not None else f"{'-':>7s}"
+        print(f"{key:40s} {t*1e3:12.4f} ms  base {tb_s} ms  x{r_s}  {'SLOWER' if slow else ''}")
+
+    if not a.no_save:
+        # una baseline per commit: una nuova run dello stesso commit sostituisce la precedente
+        history["runs"] = [r for r in history["runs"]
+                           if not (r["commit"] == run_["commit"] and same_machine(r["machine"], run_["machine"]))]
+        history["runs"].append(run_)
+        os.makedirs(os.path.dirname(os.path.abspath(a.history)), exist_ok=True)
+        tmp = a.history + ".tmp"
+        with open(tmp, "w") as f: json.dump(history, f, indent=2)
+        os.replace(tmp, a.history)
+    if regressions:
+        print(f"[BENCH] {len(regressions)} stage(s) > {a.threshold:.0%} slower than {base['commit']}: "
+              + ", ".join(regressions), file=sys.stderr)
+        return 1
+    return 0
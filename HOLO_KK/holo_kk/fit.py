@@ -0,0 +1,117 @@
+# Fit Y = alpha log s + beta su molte sotto-finestre di [smin, smax] in un colpo (somme
+# prefisse, float64), varianti pesata (WLS) e robusta (Theil-Sen), intervalli bootstrap
+# per alpha su process pool. Lavora sulla tabella (s_k, Y_k) gia' calcolata da Gate-E:
+# nessuna valutazione di Pi in piu'.
+from concurrent.futures import ProcessPoolExecutor
+import mpmath as mp
+try:
+    import numpy as np
+except ImportError:  # opzioni CLI sempre disponibili, window_report richiede NumPy
+    np = None
+
+BOOT_CHUNKS = 16  # blocchi bootstrap a seme fisso: risultato indipendente dal numero di worker
+
+def to_xy(S, Y):
+    X = np.array([float(mp.log(s)) for s in S]); Y = np.array([float(y) for y in Y])
+    return X, Y
+
+def weights_of(Y, kind):
+    if kind == "relative": return 1/(Y*Y)  # errore relativo costante su Y_k
+    return np.ones_like(Y)
+
+def window_edges(K, min_pts, max_edges=17):
+    # tutte le finestre contigue [i, j) con almeno min_pts punti; per K grande i bordi
+    # sono presi con passo (K-1)//(max_edges-1) per non avere O(K^2) finestre
+    step = max(1, (K-1)//(max_edges-1))
+    edges = sorted(set(range(0, K, step)) | {K})
+    ij = [(i, j) for i in edges for j in edges if j - i >= min_pts]
+    return np.array([p[0] for p in ij]), np.array([p[1] for p in ij])
+
+def ols_windows(X, Y, W, lo, hi):
+    # minimi quadrati pesati per ogni finestra [lo, hi) da somme prefisse (X centrato)
+    x = X - X.mean()
+    c = lambda v: np.concatenate(([0.0], np.cumsum(v)))
+    Sw, Sx, Sy, Sxx, Sxy = (c(v) for v in (W, W*x, W*Y, W*x*x, W*x*Y))
+    d = lambda P: P[hi] - P[lo]
+    sw, sx, sy, sxx, sxy = d(Sw), d(Sx), d(Sy), d(Sxx), d(Sxy)
+    slope = (sw*sxy - sx*sy)/(sw*sxx - sx*sx)
+    return slope, (sy - slope*sx)/sw - slope*X.mean()
+
+def theil_sen_windows(X, Y, lo, hi):
+    # mediana delle pendenze a coppie dentro ciascuna finestra
+    with np.errstate(divide="ignore", invalid="ignore"):
+        M = (Y[None,:] - Y[:,None])/(X[None,:] - X[:,None])
+    iu = np.triu(np.ones_like(M, dtype=bool), 1)
+    slope = np.empty(len(lo))
+    for n,(i,j) in enumerate(zip(lo, hi)):
+        slope[n] = np.median(M[i:j, i:j][iu[i:j, i:j]])
+    return slope
+
+def _boot_chunk(X, Y, W, seq, n):
+    # ricampionamento a coppie (s_k, Y_k) con reinserimento, pendenza WLS vettoriale
+    rng = np.random.default_rng(seq)
+    idx = rng.integers(0, len(X), size=(n, len(X)))
+    x, y, w = X[idx] - X.mean(), Y[idx], W[idx]
+    sw, sx, sy = w.sum(1), (w*x).sum(1), (w*y).sum(1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (sw*(w*x*y).sum(1) - sx*sy)/(sw*(w*x*x).sum(1) - sx*sx)
+
+def bootstrap(X, Y, W, B, seed=0, workers=1):
+    seeds = np.random.SeedSequence(seed).spawn(BOOT_CHUNKS)
+    sizes = [B//BOOT_CHUNKS + (1 if c < B % BOOT_CHUNKS else 0) for c in range(BOOT_CHUNKS)]
+    args = [(X, Y, W, s, n) for s,n in zip(seeds, sizes)]
+    if workers <= 1:
+        parts = [_boot_chunk(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            parts = list(ex.map(_boot_chunk, *zip(*args)))
+    b = np.concatenate(parts)
+    return b[np.isfinite(b)]
+
+def window_report(S, Y, offset=0.0, min_pts=5, weights="none", B=2000, seed=0, level=0.95,
+                  workers=1, stab_tol=5e-10):
+    # offset: costante aggiunta alla pendenza per ottenere alpha (HOLO: -(L^3)/4)
+    if np is None: raise RuntimeError("window_report richiede NumPy")
+    X, Yf = to_xy(S, Y)
+    W = weights_of(Yf, weights)
+    K = len(X); min_pts = min(min_pts, K)
+    lo, hi = window_edges(K, min_pts)
+    a_ols, _ = ols_windows(X, Yf, np.ones_like(Yf), lo, hi)
+    a_wls, _ = ols_windows(X, Yf, W, lo, hi)
+    a_ts = theil_sen_windows(X, Yf, lo, hi)
+    a_ols, a_wls, a_ts = a_ols + offset, a_wls + offset, a_ts + offset
+    full = int(np.nonzero((lo == 0) & (hi == K))[0][0])
+    spread = float(a_ols.max() - a_ols.min())
+    rep = {
+        "n_windows": len(lo), "min_pts": min_pts, "weights": weights,
+        "alpha_full": {"ols": float(a_ols[full]), "wls": float(a_wls[full]), "theil_sen": float(a_ts[full])},
+        "alpha_spread": {"ols": spread, "wls": float(a_wls.max() - a_wls.min()),
+                         "theil_sen": float(a_ts.max() - a_ts.min())},
+        "stab_tol": stab_tol, "stable": spread <= stab_tol,
+        "windows": [{"s_lo": float(S[i]), "s_hi": float(S[j-1]), "n": int(j-i),
+                     "alpha_ols": float(a), "alpha_wls": float(w), "alpha_theil_sen": float(t)}
+                    for i,j,a,w,t in zip(lo, hi, a_ols, a_wls, a_ts)],
+    }
+    if B:
+        b = bootstrap(X, Yf, W, B, seed=seed, workers=workers) + offset
+        q = (1 - level)/2
+        rep["bootstrap"] = {"B": B, "valid": int(b.size), "seed": seed, "level": level,
+                            "alpha_ci": [float(np.quantile(b, q)), float(np.quantile(b, 1-q))],
+                            "alpha_std": float(b.std())}
+    return rep
+
+def add_arguments(ap):
+    ap.add_argument("--windows", action="store_true",
+                    help="fit su sotto-finestre (OLS/WLS/Theil-Sen) + bootstrap di alpha nel JSON")
+    ap.add_argument("--win-min-pts", type=int, default=5)
+    ap.add_argument("--fit-weights", choices=["none","relative"], default="none")
+    ap.add_argument("--bootstrap", type=int, default=2000, help="ricampionamenti (0 = niente bootstrap)")
+    ap.add_argument("--boot-workers", type=int, default=1)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--stab-tol", type=float, default=5e-10, help="spread max di alpha tra le finestre")
+
+def options(a):
+    # kwargs di window_report dagli argomenti CLI (None se --windows assente)
+    if not a.windows: return None
+    return {"min_pts": a.win_min_pts, "weights": a.fit_weights, "B": a.bootstrap,
+            "workers": a.boot_workers, "seed": a.seed, "stab_tol": a.stab_tol}
@@ -0,0 +1,174 @@
+import hashlib, json, os, platform, subprocess, time
+from concurrent.futures import ProcessPoolExecutor
+import mpmath as mp
+from . import ROOT, fit
+import kk_analytic_modes as kkm
+import kk_modes_cache as kkc
+import kk_gateE_from_modes as kkg
+import holo_gateE_dtn as hg
+
+TOL_ABS_PHYS = 5e-10; TOL_REL_PHYS = 5e-10
+TOL_ABS = 1e-12; TOL_REL = 1e-9
+# contatori dei motori (escalation float -> mpmath): diagnostica, non risultati da confrontare
+ENGINE_KEYS = ("stencils_escalated_mp", "points_escalated_mp")
+
+def sha256(p):
+    h = hashlib.sha256()
+    with open(p,'rb') as f:
+        for c in iter(lambda: f.read(8192), b''):
+            h.update(c)
+    return h.hexdigest()
+
+def git_rev():
+    try:
+        r = subprocess.run(['git','rev-parse','--short','HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        d = subprocess.run(['git','status','--porcelain'], capture_output=True, text=True).stdout.strip()
+        return r + ('+dirty' if d else '')
+    except Exception:
+        return 'unknown'
+
+def compare(kk, ho):
+    # controlli numerici KK vs HOLO: alpha/C_log con soglie fisiche, altre chiavi comuni strette
+    ok_all = True
+    rows = []
+    for k in ['alpha','C_log']:
+        a = kk.get(k); b = ho.get(k)
+        da = abs(a-b); denom = max(1.0,abs(a),abs(b)); rel = da/denom
+        ok = (da<=TOL_ABS_PHYS and rel<=TOL_REL_PHYS); ok_all &= ok
+        rows.append((k,f'{a}',f'{b}',f'{da:.3e}/{rel:.3e}','PASS' if ok else 'FAIL'))
+    other = []
+    for k in sorted(set(kk.keys()) & set(ho.keys())):
+        if k in ('alpha','C_log') or k in ENGINE_KEYS: continue
+        va = kk[k]; vb = ho[k]
+        if isinstance(va,(int,float)) and isinstance(vb,(int,float)):
+            da = abs(va-vb); denom = max(1.0,abs(va),abs(vb)); rel = da/denom
+            ok = (da<=TOL_ABS and rel<=TOL_REL); ok_all &= ok
+            other.append((k,f'{va}',f'{vb}',f'{da:.3e}/{rel:.3e}','PASS' if ok else 'FAIL'))
+    return rows, other, ok_all
+
+def compare_report(kk, ho, kk_path, ho_path, timings=None):
+    # stesso report dell'heredoc del README (+ tempi per stadio)
+    lines = []
+    lines.append(f'FILE_KK {kk_path}')
+    lines.append(f'SHA256_KK {sha256(kk_path)}')
+    lines.append(f'FILE_HOLO {ho_path}')
+    lines.append(f'SHA256_HOLO {sha256(ho_path)}')
+    lines.append(f'GIT_COMMIT {git_rev()}')
+    lines.append(f'PYTHON {platform.python_version()}')
+    lines.append(f'PLATFORM {platform.platform()}')
+    lines.append(f'THRESHOLDS alpha|C_log abs<={TOL_ABS_PHYS:.1e} rel<={TOL_REL_PHYS:.1e} ; other abs<={TOL_ABS:.1e} rel<={TOL_REL:.1e}')
+    rows, other, ok_all = compare(kk, ho)
+    lines.append('CHECKS')
+    for r in rows: lines.append(f'{r[0]:20s} kk={r[1]:<20s} holo={r[2]:<20s} diff_abs/diff_rel={r[3]:<24s} {r[4]}')
+    lines.append('OTHER_NUMERIC_KEYS')
+    for r in other: lines.append(f'{r[0]:20s} kk={r[1]:<20s} holo={r[2]:<20s} diff_abs/diff_rel={r[3]:<24s} {r[4]}')
+    if 'fit_windows' in kk or 'fit_windows' in ho:
+        # stabilita' in finestra e bootstrap dalla stessa tabella Y_k (nessuna Pi in piu')
+        lines.append('WINDOWS')
+        for name,o in (('kk',kk),('holo',ho)):
+            w = o.get('fit_windows')
+            if w is None: continue
+            sp = w['alpha_spread']
+            lines.append(f"{name:5s} windows={w['n_windows']} min_pts={w['min_pts']} weights={w['weights']} "
+                         f"spread ols/wls/theil_sen={sp['ols']:.3e}/{sp['wls']:.3e}/{sp['theil_sen']:.3e} "
+                         f"{'STABLE' if w['stable'] else 'UNSTABLE'} (tol {w['stab_tol']:.1e})")
+            b = w.get('bootstrap')
+            if b:
+                lines.append(f"{name:5s} bootstrap B={b['B']} seed={b['seed']} alpha CI{b['level']:.0%}="
+                             f"[{b['alpha_ci'][0]!r}, {b['alpha_ci'][1]!r}] std={b['alpha_std']:.3e}")
+    if timings:
+        lines.append('TIMINGS')
+        for k,v in timings.items(): lines.append(f'{k:20s} {v:.3f}s')
+    lines.append('VERDETTO ' + ('PASS' if ok_all else 'FAIL'))
+    return lines, ok_all
+
+def _kk_task(a):
+    # modi in memoria a piena precisione (mpf), poi stadio KK: nessun passaggio via JSON
+    t0 = time.perf_counter()
+    precision = None
+    if a.adaptive_prec:
+        vals, stats, precision = kkm.compute_modes_adaptive(a.N, a.L, a.zUV, a.zIR, a.prec_modes, a.prec_tol,
+                                                            root_method=a.root_method, workers=a.workers)
+    elif a.cache:
+        vals, stats, _ = kkc.get_modes(a.cache, a.N, a.L, a.zUV, a.zIR, a.prec_modes,
+                                       root_method=a.root_method, workers=a.workers)
+    else:
+        vals, stats = kkm.compute_modes(a.N, a.L, a.zUV, a.zIR, a.prec_modes,
+                                        root_method=a.root_method, workers=a.workers)
+    t1 = time.perf_counter()
+    mp.mp.dps = a.prec
+    m2 = [x*x for x,_,_,_ in vals]; g = [gi for _,_,_,gi in vals]
+    out, _, _ = kkg.gate_e_kk(mp.mpf(a.L), m2, g, a.smin, a.smax, a.K, a.eta, a.prec, a.kk_csv,
+                              engine=a.engine, tol=a.tol, deriv=a.deriv,
+                              prec_tol=a.prec_tol if a.adaptive_prec else None, windows=fit.options(a))
+    t2 = time.perf_counter()
+    return vals, stats, precision, out, {"modes": t1-t0, "kk": t2-t1}
+
+def _holo_task(a):
+    t0 = time.perf_counter()
+    out, _, _ = hg.gate_e_holo(a.L, a.zUV, a.zIR, a.smin, a.smax, a.K, a.eta, a.prec, a.holo_csv, deriv=a.deriv,
+                               prec_tol=a.prec_tol if a.adaptive_prec else None,
+                               engine=a.holo_engine, tol=a.tol, windows=fit.options(a))
+    return out, {"holo": time.perf_counter()-t0}
+
+def add_arguments(ap):
+    ap.add_argument("--L", type=float, default=1.0)
+    ap.add_argument("--zUV", type=float, default=1e-4)
+    ap.add_argument("--zIR", type=float, default=1.0)
+    ap.add_argument("--N", type=int, default=150)
+    ap.add_argument("--prec-modes", type=int, default=120)
+    ap.add_argument("--root-method", choices=["halley","bisect"], default="halley")
+    ap.add_argument("--workers", type=int, default=1, help="processi per radici e modi (stadio KK)")
+    ap.add_argument("--cache", default=None, help="cache dei modi KK (riuso/estensione in N)")
+    ap.add_argument("--adaptive-prec", action="store_true",
+                    help="--prec-modes/--prec come ombra: dps minimo per stadio entro --prec-tol (scelte nei JSON)")
+    ap.add_argument("--prec-tol", type=float, default=1e-15)
+    ap.add_argument("--smin", type=float, default=1e-14)
+    ap.add_argument("--smax", type=float, default=1e-8)
+    ap.add_argument("--K", type=int, default=9)
+    ap.add_argument("--eta", type=float, default=0.1)
+    ap.add_argument("--prec", type=int, default=160)
+    ap.add_argument("--engine", choices=["scalar","batch"], default="scalar")
+    ap.add_argument("--holo-engine", choices=["mp","np"], default="mp",
+                    help="np: Pi HOLO sullo stencil in float64 (SciPy ive/kve) con escalation a mpmath")
+    ap.add_argument("--tol", type=float, default=1e-12)
+    ap.add_argument("--deriv", choices=["stencil","analytic"], default="stencil")
+    fit.add_arguments(ap)
+    ap.add_argument("--modes-out", default=os.path.join(ROOT,"KK","cert_kk","modes_analytic.json"))
+    ap.add_argument("--kk-csv", default=os.path.join(ROOT,"KK","cert_kk","pi.csv"))
+    ap.add_argument("--kk-out", default=os.path.join(ROOT,"KK","cert_kk","fit_gateE.json"))
+    ap.add_argument("--holo-csv", default=os.path.join(ROOT,"HOLO","cert_holo","pi.csv"))
+    ap.add_argument("--holo-out", default=os.path.join(ROOT,"HOLO","cert_holo","fit_gateE.json"))
+    ap.add_argument("--report", default=os.path.join(ROOT,"cert","report_kk_vs_holo.txt"))
+
+def run(a):
+    t0 = time.perf_counter()
+    for p in (a.modes_out, a.kk_csv, a.kk_out, a.holo_csv, a.holo_out, a.report):
+        os.makedirs(os.path.dirname(os.path.abspath(p)), exist_ok=True)
+    # KK (modi + Pi_KK) e HOLO (DtN) sono indipendenti: due processi
+    with ProcessPoolExecutor(max_workers=2) as ex:
+        f_ho = ex.submit(_holo_task, a)
+        f_kk = ex.submit(_kk_task, a)
+        vals, stats, precision, kk, t_kk = f_kk.result()
+        ho, t_ho = f_ho.result()
+    timings = {**t_kk, **t_ho}
+
+    t1 = time.perf_counter()
+    modes = {
+        "L": a.L, "zUV": a.zUV, "zIR": a.zIR,
+        "prec": a.prec_modes, "N": a.N, "root_method": a.root_method,
+        "bessel_cache": stats,
+        "modes": [kkm.mode_record(*v) for v in vals]
+    }
+    if precision is not None:
+        modes["precision"] = precision
+    with open(a.modes_out,"w") as f: json.dump(modes,f,indent=2)
+    json.dump(kk, open(a.kk_out,"w"), indent=2)
+    json.dump(ho, open(a.holo_out,"w"), indent=2)
+    timings["write"] = time.perf_counter()-t1
+    timings["total"] = time.perf_counter()-t0
+
+    lines, ok = compare_report(kk, ho, os.path.relpath(a.kk_out), os.path.relpath(a.holo_out), timings)
+    with open(a.report,"w") as f: f.write("\n".join(lines)+"\n")
+    print("\n".join(lines))
+    return 0 if ok else 1
@@ -0,0 +1,128 @@
+# Sweep di Gate-E su griglie di (L, zUV, zIR, smin, smax, K, eta): le tabelle dei modi
+# si calcolano una volta per (L, zUV, zIR, N, prec_modes, root_method) e si riusano
+# su tutti i punti che le condividono; i punti girano su un process pool e ogni
+# risultato e' una riga CSV scritta subito (checkpoint: al riavvio i punti gia'
+# presenti vengono saltati).
+import csv, hashlib, itertools, json, os, time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import mpmath as mp
+from .gate_e import compare
+import kk_analytic_modes as kkm
+import kk_modes_cache as kkc
+import kk_gateE_from_modes as kkg
+import holo_gateE_dtn as hg
+
+DEFAULTS = {
+    "L": 1.0, "zUV": 1e-4, "zIR": 1.0, "smin": 1e-14, "smax": 1e-8, "K": 9, "eta": 0.1,
+    "N": 150, "prec_modes": 120, "root_method": "halley",
+    "prec": 160, "engine": "scalar", "tol": 1e-12, "deriv": "stencil",
+}
+MODE_KEYS = ("L", "zUV", "zIR", "N", "prec_modes", "root_method")
+COLUMNS = ["point_id"] + list(DEFAULTS) + [
+    "alpha_kk", "alpha_holo", "C_log_kk", "C_log_holo",
+    "alpha_diff_abs", "alpha_diff_rel", "PASS", "t_kk", "t_holo",
+]
+
+def expand_grid(spec):
+    # ogni chiave: valore singolo o lista di valori; prodotto cartesiano
+    unknown = set(spec) - set(DEFAULTS)
+    if unknown: raise ValueError(f"chiavi sconosciute nella griglia: {sorted(unknown)}")
+    axes = {k: spec.get(k, v) for k,v in DEFAULTS.items()}
+    axes = {k: (v if isinstance(v, list) else [v]) for k,v in axes.items()}
+    for combo in itertools.product(*axes.values()):
+        yield dict(zip(axes, combo))
+
+def point_id(pt):
+    return hashlib.sha256(json.dumps(pt, sort_keys=True).encode()).hexdigest()[:16]
+
+def _modes_task(key, cache=None):
+    L, zUV, zIR, N, prec, rm = key
+    if cache:
+        vals, _, _ = kkc.get_modes(cache, N, L, zUV, zIR, prec, root_method=rm)
+    else:
+        vals, _ = kkm.compute_modes(N, L, zUV, zIR, prec, root_method=rm)
+    return [x*x for x,_,_,_ in vals], [gi for _,_,_,gi in vals]
+
+def _point_task(pt, m2, g):
+    t0 = time.perf_counter()
+    kk, _, _ = kkg.gate_e_kk(mp.mpf(pt["L"]), m2, g, pt["smin"], pt["smax"], pt["K"], pt["eta"],
+                             pt["prec"], os.devnull, engine=pt["engine"], tol=pt["tol"], deriv=pt["deriv"])
+    t1 = time.perf_counter()
+    ho, _, _ = hg.gate_e_holo(pt["L"], pt["zUV"], pt["zIR"], pt["smin"], pt["smax"], pt["K"], pt["eta"],
+                              pt["prec"], os.devnull, deriv=pt["deriv"])
+    t2 = time.perf_counter()
+    _, _, ok = compare(kk, ho)
+    da = abs(kk["alpha"] - ho["alpha"])
+    return {
+        "point_id": point_id(pt), **pt,
+        "alpha_kk": kk["alpha"], "alpha_holo": ho["alpha"],
+        "C_log_kk": kk["C_log"], "C_log_holo": ho["C_log"],
+        "alpha_diff_abs": da, "alpha_diff_rel": da/max(1.0, abs(kk["alpha"]), abs(ho["alpha"])),
+        "PASS": ok, "t_kk": t1-t0, "t_holo": t2-t1,
+    }
+
+def read_done(path):
+    if not os.path.exists(path): return {}
+    with open(path, newline="") as f:
+        return {r["point_id"]: r for r in csv.DictReader(f)}
+
+def run_sweep(spec, out_csv, workers=1, parquet=None, cache=None, log=print):
+    points = {point_id(p): p for p in expand_grid(spec)}
+    done = read_done(out_csv)
+    todo = [p for pid,p in points.items() if pid not in done]
+    log(f"[SWEEP] punti: {len(points)} | gia' fatti: {len(points)-len(todo)} | da fare: {len(todo)}")
+
+    groups = {}
+    for p in todo:
+        groups.setdefault(tuple(p[k] for k in MODE_KEYS), []).append(p)
+
+    new_file = not os.path.exists(out_csv)
+    with open(out_csv, "a", newline="") as f, ProcessPoolExecutor(max_workers=workers) as ex:
+        w = csv.DictWriter(f, fieldnames=COLUMNS)
+        if new_file: w.writeheader(); f.flush()
+        futs = {ex.submit(_modes_task, key, cache): key for key in groups}
+        while futs:
+            ready, _ = wait(futs, return_when=FIRST_COMPLETED)
+            for fut in ready:
+                key = futs.pop(fut)
+                if isinstance(key, tuple):
+                    # tabella dei modi pronta: si lanciano i punti del gruppo
+                    m2, g = fut.result()
+                    log(f"[SWEEP] modi {dict(zip(MODE_KEYS, key))} pronti -> {len(groups[key])} punti")
+                    for p in groups[key]:
+                        futs[ex.submit(_point_task, p, m2, g)] = point_id(p)
+                else:
+                    row = fut.result()
+                    w.writerow(row); f.flush()
+                    done[key] = row
+                    log(f"[SWEEP] {key} alpha_kk={row['alpha_kk']:.15g} alpha_holo={row['alpha_holo']:.15g} "
+                        f"{'PASS' if row['PASS'] else 'FAIL'}")
+
+    rows = [done[pid] for pid in points if pid in done]
+    failed = [r["point_id"] for r in rows if str(r["PASS"]) != "True"]
+    summary = {"points": len(rows), "pass": len(rows)-len(failed), "fail": len(failed),
+               "failed_ids": failed, "PASS_ALL": not failed and len(rows) == len(points)}
+    with open(os.path.splitext(out_csv)[0] + ".summary.json", "w") as f:
+        json.dump(summary, f, indent=2)
+    if parquet:
+        try:
+            import pandas as pd
+            import pyarrow  # noqa: F401  (motore Parquet)
+        except ImportError:
+            log("[SWEEP] pandas/pyarrow non disponibili: Parquet non scritto (resta il CSV)")
+        else:
+            pd.read_csv(out_csv).to_parquet(parquet, index=False)
+    log(f"[SWEEP] PASS {summary['pass']}/{summary['points']}  -> {out_csv}")
+    return summary
+
+def add_arguments(ap):
+    ap.add_argument("grid", help="JSON: chiavi tra " + ", ".join(DEFAULTS) + " (valore o lista)")
+    ap.add_argument("--out", default="sweep_gateE.csv", help="sink CSV (checkpoint riprendibile)")
+    ap.add_argument("--parquet", default=None, help="copia Parquet a fine sweep (richiede pandas+pyarrow)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--cache", default=None, help="cache dei modi KK condivisa tra sweep")
+
+def run(a):
+    with open(a.grid) as f: spec = json.load(f)
+    summary = run_sweep(spec, a.out, workers=a.workers, parquet=a.parquet, cache=a.cache)
+    return 0 if summary["PASS_ALL"] else 1
@@ -0,0 +1,25 @@
+# Sink della tabella di Gate-E (s, Pi, ...) condiviso da KK e HOLO: CSV scritto a blocchi
+# di righe + copia binaria .npz compressa opzionale (sidecar).
+import csv
+try:
+    import numpy as np
+except ImportError:  # CSV sempre disponibile, il sidecar richiede NumPy
+    np = None
+
+def write_table(path, header, rows, chunk=4096, sidecar=None):
+    # rows: iterabile (anche generatore) di tuple mpf/float, consumato una sola volta;
+    # sidecar: .npz compresso con una colonna float64 per campo
+    cols = [[] for _ in header] if sidecar else None
+    with open(path,"w",newline="") as f:
+        w = csv.writer(f); w.writerow(header)
+        buf = []
+        for r in rows:
+            r = [float(v) for v in r]
+            buf.append(r)
+            if cols is not None:
+                for c,v in zip(cols,r): c.append(v)
+            if len(buf) >= chunk:
+                w.writerows(buf); buf.clear()
+        w.writerows(buf)
+    if sidecar:
+        np.savez_compressed(sidecar, **{k: np.array(c) for k,c in zip(header,cols)})